@@ -11,14 +11,19 @@ import os
 
 from django.core.asgi import get_asgi_application
 
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-import chats.routing
-
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'OnlineLearning_Platform.settings')
 
+# Set up Django before importing anything that loads models
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from channels.auth import AuthMiddlewareStack  # noqa: E402
+import chats.routing  # noqa: E402
+from chats.buffer import lifespan  # noqa: E402
+
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+    "http": django_asgi_app,
+    "lifespan": lifespan,
     "websocket": AuthMiddlewareStack(
         URLRouter(
             chats.routing.websocket_urlpatterns
@@ -0,0 +1,193 @@
+import io
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models.signals import post_init, post_save
+
+from PIL import Image, ImageOps
+
+from rest_framework import serializers
+
+from OnlineLearning_Platform import metrics
+from jobs.queue import task
+
+
+logger = logging.getLogger(__name__)
+
+# Pillow format name and file extension of each output format
+FORMATS = {
+    'webp': ('WEBP', 'webp'),
+    'jpeg': ('JPEG', 'jpg'),
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.IMAGE_VARIANT_WORKERS, thread_name_prefix='image-variants'
+            )
+        return _executor
+
+
+def variant_name(name, variant, fmt):
+    """
+    Deterministic storage name of a variant, e.g. ``avatars/variants/me.thumb.webp`` for ``avatars/me.png``.
+    """
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, 'variants', f'{stem}.{variant}.{FORMATS[fmt][1]}')
+
+
+def variant_names(name):
+    return {
+        variant: {fmt: variant_name(name, variant, fmt) for fmt in settings.IMAGE_VARIANT_FORMATS}
+        for variant in settings.IMAGE_VARIANTS
+    }
+
+
+def render_variant(image, size, fmt):
+    """
+    Crop-to-fill ``image`` to ``size`` and encode it; returns the encoded bytes.
+    """
+    pil_format = FORMATS[fmt][0]
+    thumbnail = ImageOps.fit(image, size, Image.Resampling.LANCZOS)
+    if pil_format == 'JPEG' and thumbnail.mode != 'RGB':
+        thumbnail = thumbnail.convert('RGB')
+    elif thumbnail.mode not in ('RGB', 'RGBA'):
+        thumbnail = thumbnail.convert('RGBA' if 'A' in thumbnail.getbands() else 'RGB')
+
+    buffer = io.BytesIO()
+    thumbnail.save(buffer, pil_format, quality=settings.IMAGE_VARIANT_QUALITY, optimize=True)
+    return buffer.getvalue()
+
+
+def generate_variants(storage, name, force=False):
+    """
+    Write every configured variant of the image ``name``; returns how many were written.
+
+    Existing variants are kept unless ``force`` is set. Unreadable images are logged and skipped.
+    """
+    names = variant_names(name)
+    todo = [
+        (variant, fmt, target)
+        for variant, formats in names.items()
+        for fmt, target in formats.items()
+        if force or not storage.exists(target)
+    ]
+    if not todo:
+        return 0
+
+    started = time.monotonic()
+    try:
+        with storage.open(name, 'rb') as file:
+            image = Image.open(file)
+            image = ImageOps.exif_transpose(image)
+            image.load()
+    except (OSError, ValueError, Image.DecompressionBombError):
+        logger.warning('Could not generate variants of %s', name, exc_info=True)
+        metrics.incr('image_variant_failures_total')
+        return 0
+
+    for variant, fmt, target in todo:
+        data = render_variant(image, settings.IMAGE_VARIANTS[variant], fmt)
+        storage.delete(target)
+        storage.save(target, ContentFile(data))
+    metrics.incr('image_variants_generated_total', len(todo))
+    metrics.observe('image_variant_seconds', time.monotonic() - started)
+    return len(todo)
+
+
+@task(queue='media')
+def generate_field_variants(model_label, field_name, name):
+    storage = apps.get_model(model_label)._meta.get_field(field_name).storage
+    generate_variants(storage, name, force=True)
+
+
+def _generate_safely(storage, name):
+    try:
+        generate_variants(storage, name, force=True)
+    except Exception:
+        logger.exception('Image variant generation failed for %s', name)
+
+
+def schedule_variants(fieldfile):
+    """
+    Generate the variants of a saved image off the request path, once the row is committed.
+    """
+    storage, name = fieldfile.storage, fieldfile.name
+    if not name:
+        return
+
+    if settings.IMAGE_VARIANTS_QUEUE:
+        # Saved with the row, so the job exists exactly when the image does
+        generate_field_variants.enqueue(
+            fieldfile.instance._meta.label, fieldfile.field.name, name, queue=settings.IMAGE_VARIANTS_QUEUE
+        )
+        return
+
+    def submit():
+        if settings.IMAGE_VARIANTS_ASYNC:
+            get_executor().submit(_generate_safely, storage, name)
+        else:
+            _generate_safely(storage, name)
+
+    transaction.on_commit(submit)
+
+
+def track_image_field(model, field_name):
+    """
+    Regenerate variants of ``model.<field_name>`` whenever a save changes the image.
+    """
+    loaded_attr = f'_loaded_{field_name}_name'
+
+    def remember_loaded_image(sender, instance, **kwargs):
+        value = instance.__dict__.get(field_name)
+        setattr(instance, loaded_attr, getattr(value, 'name', value) or '')
+
+    def image_saved(sender, instance, created, **kwargs):
+        fieldfile = getattr(instance, field_name)
+        if fieldfile.name and (created or fieldfile.name != getattr(instance, loaded_attr, None)):
+            schedule_variants(fieldfile)
+        setattr(instance, loaded_attr, fieldfile.name or '')
+
+    uid = f'{model._meta.label}.{field_name}'
+    post_init.connect(remember_loaded_image, sender=model, weak=False, dispatch_uid=f'{uid}:loaded')
+    post_save.connect(image_saved, sender=model, weak=False, dispatch_uid=f'{uid}:variants')
+
+
+class ImageVariantsField(serializers.Field):
+    """
+    Read-only map of variant -> format -> URL for an image field, ``None`` when there is no image.
+
+    URLs are derived from the image name without touching the storage; a variant that is
+    still being generated returns 404 until the worker finishes.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, fieldfile):
+        if not fieldfile:
+            return None
+        request = self.context.get('request')
+        storage = fieldfile.storage
+        return {
+            variant: {
+                fmt: request.build_absolute_uri(storage.url(name)) if request else storage.url(name)
+                for fmt, name in formats.items()
+            }
+            for variant, formats in variant_names(fieldfile.name).items()
+        }
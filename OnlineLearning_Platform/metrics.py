@@ -0,0 +1,82 @@
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+_collectors = []
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def incr(name, value=1, **labels):
+    """
+    Increase a process-local counter.
+    """
+    with _lock:
+        _counters[_key(name, labels)] += value
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, value, **labels):
+    """
+    Record a sample as ``<name>_count`` / ``<name>_sum`` counters (a Prometheus summary without quantiles).
+    """
+    with _lock:
+        _counters[_key(f'{name}_count', labels)] += 1
+        _counters[_key(f'{name}_sum', labels)] += value
+
+
+def get_value(name, **labels):
+    with _lock:
+        key = _key(name, labels)
+        return _counters.get(key, _gauges.get(key, 0))
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+
+
+def register_collector(collector):
+    """
+    Register a callable run before each render, e.g. to set gauges from the database.
+    """
+    if collector not in _collectors:
+        _collectors.append(collector)
+
+
+def render():
+    """
+    Render every metric in the Prometheus text exposition format.
+    """
+    for collector in _collectors:
+        collector()
+
+    with _lock:
+        samples = sorted(list(_counters.items()) + list(_gauges.items()))
+
+    lines = []
+    for (name, labels), value in samples:
+        label_text = ','.join(f'{key}="{val}"' for key, val in labels)
+        metric = f'{name}{{{label_text}}}' if label_text else name
+        lines.append(f'{metric} {value:g}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    remote_addr = request.META.get('REMOTE_ADDR')
+    if remote_addr not in getattr(settings, 'METRICS_ALLOWED_IPS', ('127.0.0.1',)) and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4')
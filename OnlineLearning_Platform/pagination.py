@@ -0,0 +1,176 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.encoding import force_str
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination that seeks by the ordering key instead of using OFFSET.
+
+    The cursor holds the ordering values of the last (or first) row of the current page,
+    so every page is a single index range scan no matter how deep the client is.
+    Views choose the key with a ``cursor_ordering`` attribute; the last field must be
+    unique (normally ``id``) and none of the fields may be nullable.
+    """
+    ordering = ('created_time', 'id')
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor.'
+
+    @property
+    def page_size(self):
+        return api_settings.PAGE_SIZE or 50
+
+    @property
+    def max_page_size(self):
+        return getattr(settings, 'MAX_PAGE_SIZE', 100)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(view)
+        self.limit = self.get_page_size(request)
+
+        position, reverse = self.decode_cursor(request)
+        fields = self.get_ordering_fields(queryset.model)
+
+        ordering = self.ordering if not reverse else self._flip(self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._seek_filter(fields, position, reverse))
+
+        results = list(queryset[:self.limit + 1])
+        has_more = len(results) > self.limit
+        results = results[:self.limit]
+        if reverse:
+            results.reverse()
+
+        self.next_position = self.previous_position = None
+        if results:
+            first, last = self._position(results[0], fields), self._position(results[-1], fields)
+            if reverse:
+                self.next_position = last
+                self.previous_position = first if has_more else None
+            else:
+                self.next_position = last if has_more else None
+                self.previous_position = first if position is not None else None
+        elif position is not None:
+            # Empty page after a seek: keep a way back (or forward) from the requested position.
+            if reverse:
+                self.next_position = position
+            else:
+                self.previous_position = position
+
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_ordering(self, view):
+        return tuple(getattr(view, 'cursor_ordering', self.ordering))
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return min(self.page_size, self.max_page_size)
+
+    def get_ordering_fields(self, model):
+        return [
+            (model._meta.get_field(name.lstrip('-')), name.startswith('-'))
+            for name in self.ordering
+        ]
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position, reverse=False)
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(self.previous_position, reverse=True)
+
+    def encode_cursor(self, position, reverse):
+        payload = json.dumps({'p': position, 'r': int(reverse)}, separators=(',', ':'))
+        cursor = base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+
+        try:
+            padded = encoded + '=' * (-len(encoded) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+            position = payload['p']
+            reverse = bool(payload.get('r', 0))
+        except (TypeError, ValueError, KeyError, binascii.Error, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def _position(self, obj, fields):
+        return [force_str(field.value_to_string(obj)) for field, _ in fields]
+
+    def _seek_filter(self, fields, position, reverse):
+        try:
+            values = [field.to_python(value) for (field, _), value in zip(fields, position)]
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+        # (a, b) > (x, y)  ==  a > x OR (a = x AND b > y), with the direction per field.
+        condition = Q()
+        for i, (field, descending) in enumerate(fields):
+            lookup = 'lt' if descending != reverse else 'gt'
+            term = Q(**{f'{field.name}__{lookup}': values[i]})
+            for j in range(i):
+                term &= Q(**{fields[j][0].name: values[j]})
+            condition |= term
+        return condition
+
+    @staticmethod
+    def _flip(ordering):
+        return tuple(name[1:] if name.startswith('-') else '-' + name for name in ordering)
+
+
+def paginate(view, queryset, request, serializer_class, **serializer_kwargs):
+    """
+    Paginate a queryset from a plain APIView that does not have GenericAPIView's hooks.
+    """
+    paginator = KeysetPagination()
+    page = paginator.paginate_queryset(queryset, request, view=view)
+    serializer = serializer_class(page, many=True, **serializer_kwargs)
+    return paginator.get_paginated_response(serializer.data)
@@ -49,6 +49,7 @@ INSTALLED_APPS = [
     'courses',
     'chats',
     'payments',
+    'jobs',
 ]
 
 MIDDLEWARE = [
@@ -139,6 +140,74 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+    # Lession, assignment and submission files: deduplicated by content, see gc_media_blobs
+    'course_content': {
+        'BACKEND': 'courses.storage.ContentAddressedStorage',
+    },
+}
+
+# Thumbnails generated for Course, Category and user avatars: name -> (width, height)
+IMAGE_VARIANTS = {
+    'thumb': (160, 160),
+    'card': (480, 270),
+}
+IMAGE_VARIANT_FORMATS = ('webp', 'jpeg')
+IMAGE_VARIANT_QUALITY = 80
+# Variants are rendered by a thread pool after the save commits; False renders them inline.
+# Setting IMAGE_VARIANTS_QUEUE hands them to that background job queue instead.
+IMAGE_VARIANTS_ASYNC = True
+IMAGE_VARIANT_WORKERS = 2
+IMAGE_VARIANTS_QUEUE = None
+
+# Hand protected downloads to the front proxy: None (stream from Django), 'nginx'
+# (X-Accel-Redirect to PROTECTED_MEDIA_INTERNAL_URL, an `internal` location aliased to
+# MEDIA_ROOT) or 'sendfile' (X-Sendfile with the absolute path, Apache/lighttpd).
+PROTECTED_MEDIA_SERVER = None
+PROTECTED_MEDIA_INTERNAL_URL = '/protected-media/'
+
+# Default size limit of lession/assignment/submission files (Course.max_upload_size overrides
+# it) and the sniffed content types accepted for each
+MAX_UPLOAD_SIZE = 200 * 1024 ** 2
+_DOCUMENT_TYPES = (
+    'application/pdf', 'application/zip', 'application/x-ole-storage', 'text/plain',
+    'image/png', 'image/jpeg', 'image/gif', 'image/webp',
+)
+UPLOAD_ALLOWED_TYPES = {
+    'lession': _DOCUMENT_TYPES + ('video/mp4', 'video/webm', 'audio/mpeg', 'audio/ogg'),
+    'assignment': _DOCUMENT_TYPES,
+    'submission': _DOCUMENT_TYPES + ('application/x-7z-compressed', 'application/vnd.rar'),
+}
+
+# Resumable uploads: largest accepted file, largest single PUT, and how long an
+# unfinished upload is kept before cleanup_chunked_uploads removes it
+CHUNKED_UPLOAD_MAX_SIZE = 4 * 1024 ** 3
+CHUNKED_UPLOAD_MAX_CHUNK_SIZE = 16 * 1024 ** 2
+CHUNKED_UPLOAD_EXPIRATION = 60 * 60 * 24
+# Seconds a chunk write may hold its upload before another request may take over (a crashed writer)
+CHUNKED_UPLOAD_LOCK_TIMEOUT = 60 * 15
+
+# CRCs of exported submission files are cached so resumed ZIP downloads need not re-read them
+SUBMISSION_EXPORT_CRC_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+# Background jobs (python manage.py run_worker): attempts per job, retry backoff base and
+# cap in seconds, how long a running job may stay locked before it is requeued, worker
+# slots and the idle poll interval
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_BACKOFF = 10
+JOB_MAX_BACKOFF = 60 * 60
+JOB_LOCK_TIMEOUT = 60 * 15
+JOB_WORKER_CONCURRENCY = 4
+JOB_POLL_INTERVAL = 1.0
+# Queues a worker consumes without --queue; add IMAGE_VARIANTS_QUEUE here when it is set
+JOB_WORKER_QUEUES = ['default', 'email']
+
 # AUTH
 
 AUTH_USER_MODEL = 'users.CustomUser'
@@ -147,8 +216,31 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
+    'DEFAULT_PAGINATION_CLASS': 'OnlineLearning_Platform.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
+}
+
+# Upper bound for the ?page_size= query parameter
+MAX_PAGE_SIZE = 200
+
+# How long a user's enrolled/instructed course ids stay cached (invalidated on change)
+COURSE_ACCESS_CACHE_TIMEOUT = 60 * 60
+
+# Cached course outlines are also invalidated whenever the course content changes
+COURSE_OUTLINE_CACHE_TIMEOUT = 60 * 60
+
+# TTLs (seconds) of cached catalog responses; signals invalidate them on change
+CATALOG_CACHE_TIMEOUTS = {
+    'category': 60 * 60,
+    'course': 10 * 60,
 }
 
+# Dotted path to a courses.search backend; defaults to FTS5 on SQLite
+COURSE_SEARCH_BACKEND = None
+
+# Clients allowed to scrape /metrics/ without a staff session
+METRICS_ALLOWED_IPS = ('127.0.0.1',)
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
@@ -177,11 +269,67 @@ ASGI_APPLICATION = 'OnlineLearning_Platform.asgi.application'
 
 # CHANNEL
 
-CHANNEL_LAYERS = {
-    'default': {
+# 'redis' (one channels_redis layer over CHANNEL_REDIS_HOSTS), 'memory' (single node, no Redis
+# needed) or 'sharded' (one layer per Redis host, channels and groups spread by consistent hashing)
+CHANNEL_LAYER_BACKEND = 'redis'
+CHANNEL_REDIS_HOSTS = [('127.0.0.1', 6379)]
+
+_CHANNEL_LAYER_BACKENDS = {
+    'redis': {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
         'CONFIG': {
-            "hosts": [('127.0.0.1', 6379)],
+            "hosts": CHANNEL_REDIS_HOSTS,
         },
     },
-}
\ No newline at end of file
+    'memory': {
+        'BACKEND': 'chats.layers.MemoryChannelLayer',
+        'CONFIG': {
+            'capacity': 1000,
+            'group_capacity': 10000,
+        },
+    },
+    'sharded': {
+        'BACKEND': 'chats.layers.ShardedChannelLayer',
+        'CONFIG': {
+            'shards': [
+                {'BACKEND': 'chats.layers.RedisShardLayer', 'CONFIG': {'hosts': [host]}}
+                for host in CHANNEL_REDIS_HOSTS
+            ],
+        },
+    },
+}
+
+CHANNEL_LAYERS = {
+    'default': _CHANNEL_LAYER_BACKENDS[CHANNEL_LAYER_BACKEND],
+}
+# How long chat connections may reuse a user's cached id and username (invalidated on change)
+CHAT_IDENTITY_CACHE_TIMEOUT = 60 * 60
+
+# Seconds a chat device stays listed as online after its last heartbeat
+CHAT_PRESENCE_TIMEOUT = 60
+
+# Persist chat messages in batches after delivering them (write-behind) instead of one INSERT per message
+CHAT_WRITE_BEHIND = False
+CHAT_WRITE_BEHIND_BATCH_SIZE = 100
+# Seconds a buffered message may wait before its batch is written
+CHAT_WRITE_BEHIND_INTERVAL = 0.5
+# Messages kept for retry while the database is unavailable; the oldest beyond this are dropped
+CHAT_WRITE_BEHIND_MAX_DEPTH = 10000
+
+# Frames per second a chat connection may send, with bursts of up to CHAT_CONNECTION_BURST (0 disables)
+CHAT_CONNECTION_RATE = 10
+CHAT_CONNECTION_BURST = 20
+# Messages per second a user may send across all devices, shared through the cache (0 disables)
+CHAT_USER_RATE = 5
+CHAT_USER_BURST = 20
+# Longer frames are rejected
+CHAT_MAX_FRAME_SIZE = 8 * 1024
+# Frames queued for one connection; a client too slow to keep up is closed with code 4008
+# ('close'), or loses its oldest frames ('drop'). Read receipts replace older queued ones.
+CHAT_SEND_QUEUE_SIZE = 200
+CHAT_SLOW_CONSUMER = 'close'
+# Frames stay in that queue while more than this many bytes wait in the server's socket buffer
+# (Daphne buffers without limit), and a client that has not taken a frame for
+# CHAT_SEND_TIMEOUT seconds counts as too slow even before the queue is full
+CHAT_SEND_BUFFER_SIZE = 256 * 1024
+CHAT_SEND_TIMEOUT = 10
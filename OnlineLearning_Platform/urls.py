@@ -17,9 +17,13 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from .metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics/', metrics_view, name='metrics'),
     path('', include('users.urls')),
     path('', include('courses.urls')),
     path('', include('payments.urls')),
+    path('', include('chats.urls')),
 ]
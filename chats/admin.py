@@ -1,9 +1,21 @@
 from django.contrib import admin
 
-from .models import Message
+from .models import Conversation, ConversationMember, Message
 
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
     list_display = ('sender', 'receiver', 'content')
 
+
+class ConversationMemberInline(admin.TabularInline):
+    model = ConversationMember
+    extra = 1
+
+
+@admin.register(Conversation)
+class ConversationAdmin(admin.ModelAdmin):
+    list_display = ('key', 'kind', 'title', 'created_time')
+    list_filter = ('kind',)
+    search_fields = ('key', 'title')
+    inlines = [ConversationMemberInline]
@@ -0,0 +1,227 @@
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import ssl
+import struct
+import time
+from urllib.parse import urlsplit
+
+from channels.testing import WebsocketCommunicator
+
+
+WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+def percentiles(values):
+    """
+    p50/p95/p99/max of ``values`` in milliseconds (nearest rank), ``None``s when there are none.
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return {'p50': None, 'p95': None, 'p99': None, 'max': None}
+
+    def rank(fraction):
+        return round(ordered[min(int(fraction * len(ordered) + 0.5), len(ordered)) - 1] * 1000, 3)
+
+    return {'p50': rank(0.50), 'p95': rank(0.95), 'p99': rank(0.99), 'max': round(ordered[-1] * 1000, 3)}
+
+
+class SocketClient:
+    """
+    Minimal WebSocket client over asyncio streams with the parts of WebsocketCommunicator's
+    interface the benchmark uses, for measuring a running server (e.g. Daphne).
+    """
+
+    def __init__(self, url, headers=()):
+        self.url = urlsplit(url)
+        self.headers = headers
+        self.reader = self.writer = None
+
+    async def connect(self, timeout=10):
+        secure = self.url.scheme == 'wss'
+        host, port = self.url.hostname, self.url.port or (443 if secure else 80)
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=ssl.create_default_context() if secure else None), timeout
+        )
+        key = base64.b64encode(os.urandom(16))
+        path = self.url.path + (f'?{self.url.query}' if self.url.query else '')
+        lines = [
+            f'GET {path} HTTP/1.1', f'Host: {host}:{port}', 'Upgrade: websocket', 'Connection: Upgrade',
+            f'Sec-WebSocket-Key: {key.decode()}', 'Sec-WebSocket-Version: 13',
+        ] + [f'{name.decode()}: {value.decode()}' for name, value in self.headers]
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode())
+        await self.writer.drain()
+
+        response = await asyncio.wait_for(self.reader.readuntil(b'\r\n\r\n'), timeout)
+        status_line, *header_lines = response.decode('latin-1').split('\r\n')
+        status = int(status_line.split(' ')[1])
+        headers = dict(line.lower().split(': ', 1) for line in header_lines if ': ' in line)
+        expected = base64.b64encode(hashlib.sha1(key + WEBSOCKET_GUID).digest()).decode().lower()
+        if status != 101 or headers.get('sec-websocket-accept') != expected:
+            self.writer.close()
+            return False, status
+        return True, None
+
+    async def _send_frame(self, opcode, payload):
+        header = bytes([0x80 | opcode])
+        length = len(payload)
+        if length < 126:
+            header += bytes([0x80 | length])
+        elif length < 1 << 16:
+            header += bytes([0x80 | 126]) + struct.pack('>H', length)
+        else:
+            header += bytes([0x80 | 127]) + struct.pack('>Q', length)
+        mask = os.urandom(4)
+        masked = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+        self.writer.write(header + mask + masked)
+        await self.writer.drain()
+
+    async def send_to(self, text_data):
+        await self._send_frame(0x1, text_data.encode())
+
+    async def receive_from(self, timeout=1):
+        return await asyncio.wait_for(self._receive_text(), timeout)
+
+    async def _receive_text(self):
+        parts = []
+        while True:
+            first, second = await self.reader.readexactly(2)
+            length = second & 0x7F
+            if length == 126:
+                length = struct.unpack('>H', await self.reader.readexactly(2))[0]
+            elif length == 127:
+                length = struct.unpack('>Q', await self.reader.readexactly(8))[0]
+            payload = await self.reader.readexactly(length)
+            opcode = first & 0x0F
+            if opcode == 0x8:
+                raise ConnectionError('The server closed the connection.')
+            if opcode == 0x9:
+                await self._send_frame(0xA, payload)
+                continue
+            if opcode in (0x1, 0x0):
+                parts.append(payload)
+                if first & 0x80:
+                    return b''.join(parts).decode()
+
+    async def disconnect(self, code=1000):
+        try:
+            await self._send_frame(0x8, struct.pack('>H', code))
+        except (ConnectionError, RuntimeError):
+            pass
+        self.writer.close()
+
+
+class ChatBenchmark:
+    """
+    Drive ``pairs`` sender/receiver pairs through ChatConsumer and measure them.
+
+    Every receiver and sender connects first (timing each handshake); then each sender
+    sends ``messages`` messages, at ``rate`` per second if given, each stamped with its send
+    time so the receiver can measure end-to-end delivery. With ``url`` the clients are real
+    sockets to a running server, otherwise WebsocketCommunicators on ``application``.
+    """
+
+    def __init__(self, pairs, messages, rate=0, url=None, application=None, timeout=10.0):
+        self.pairs = pairs
+        self.messages = messages
+        self.rate = rate
+        self.url = url
+        self.application = application
+        self.timeout = timeout
+
+    def client(self, token, username):
+        headers = [(b'authorization', f'Bearer {token}'.encode())]
+        if self.url:
+            return SocketClient(f'{self.url}?username={username}', headers)
+        return WebsocketCommunicator(self.application, f'/ws/chat/?username={username}', headers=headers)
+
+    async def _connect(self, client, latencies):
+        started = time.perf_counter()
+        connected, _ = await client.connect(timeout=self.timeout)
+        if not connected:
+            raise RuntimeError('A benchmark client could not connect.')
+        latencies.append(time.perf_counter() - started)
+
+    async def _send(self, pair, sender, start):
+        for seq in range(self.messages):
+            if self.rate:
+                delay = start + seq / self.rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await sender.send_to(text_data=json.dumps({'message': f'{pair}:{seq}:{time.perf_counter()}'}))
+
+    async def _receive(self, pair, receiver, latencies):
+        received = 0
+        while received < self.messages:
+            try:
+                frame = json.loads(await receiver.receive_from(timeout=self.timeout))
+            except (asyncio.TimeoutError, ConnectionError):
+                break
+            stamp = str(frame.get('message', '')).split(':')
+            if len(stamp) == 3 and stamp[0] == str(pair):
+                latencies.append(time.perf_counter() - float(stamp[2]))
+                received += 1
+        return received
+
+    async def _drain(self, client):
+        # The sender's own device receives an echo of everything it sends
+        for _ in range(self.messages):
+            try:
+                await client.receive_from(timeout=self.timeout)
+            except (asyncio.TimeoutError, ConnectionError):
+                return
+
+    @staticmethod
+    async def _disconnect(client):
+        try:
+            await client.disconnect()
+        except (asyncio.CancelledError, ConnectionError):
+            # A client whose receive timed out has already been shut down
+            pass
+
+    async def run(self, users, writes=None):
+        """
+        ``users`` is a list of ``(sender token, sender username, receiver token, receiver username)``.
+        ``writes`` is an optional counter with a ``count`` of database writes; the writes from the
+        first message until every client has disconnected (and buffered messages are flushed)
+        are reported.
+        """
+        connect_latencies, delivery_latencies = [], []
+        clients = []
+        for sender_token, sender_name, receiver_token, receiver_name in users:
+            clients.append((self.client(sender_token, receiver_name), self.client(receiver_token, sender_name)))
+        await asyncio.gather(*(
+            self._connect(client, connect_latencies) for pair in clients for client in pair
+        ))
+
+        drains = [asyncio.ensure_future(self._drain(sender)) for sender, _ in clients]
+        writes_before = writes.count if writes is not None else 0
+        start = time.perf_counter()
+        receiving = [
+            asyncio.ensure_future(self._receive(index, receiver, delivery_latencies))
+            for index, (_, receiver) in enumerate(clients)
+        ]
+        await asyncio.gather(*(self._send(index, sender, start) for index, (sender, _) in enumerate(clients)))
+        delivered = sum(await asyncio.gather(*receiving))
+        duration = time.perf_counter() - start
+
+        await asyncio.gather(*drains)
+        for sender, receiver in clients:
+            await self._disconnect(sender)
+            await self._disconnect(receiver)
+        write_duration = time.perf_counter() - start
+
+        sent = self.pairs * self.messages
+        return {
+            'connect_latency_ms': percentiles(connect_latencies),
+            'delivery_latency_ms': percentiles(delivery_latencies),
+            'sent': sent,
+            'delivered': delivered,
+            'lost': sent - delivered,
+            'duration_s': round(duration, 3),
+            'messages_per_sec': round(delivered / duration, 1) if duration else None,
+            'db_writes': writes.count - writes_before if writes is not None else None,
+            'write_duration_s': round(write_duration, 3),
+        }
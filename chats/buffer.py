@@ -0,0 +1,172 @@
+import asyncio
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import OperationalError, transaction
+
+from channels.db import database_sync_to_async
+
+from OnlineLearning_Platform import metrics
+
+from .inbox import record_messages, send_saved_ids
+from .models import Message
+
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriteBuffer:
+    """
+    Process-wide write-behind buffer for chat messages.
+
+    Consumers deliver a message first and then hand it to ``add``; buffered messages are
+    written with one ``bulk_create`` when ``CHAT_WRITE_BEHIND_BATCH_SIZE`` of them are
+    waiting or ``CHAT_WRITE_BEHIND_INTERVAL`` seconds after the first one arrived. The ids of
+    saved messages are then sent to the devices that got them without one.
+
+    A batch that fails with an ``OperationalError`` (e.g. a locked or unreachable database)
+    goes back to the front of the buffer for the next flush, keeping at most
+    ``CHAT_WRITE_BEHIND_MAX_DEPTH`` messages. Any other failure is retried row by row, and
+    rows that still cannot be written (e.g. their receiver was deleted) are logged and dropped
+    so they cannot block the rest.
+    """
+
+    def __init__(self):
+        self._pending = []
+        self._lock = threading.Lock()
+        self._timer = None
+
+    @property
+    def depth(self):
+        return len(self._pending)
+
+    async def add(self, message):
+        """
+        Buffer an unsaved ``message``. The caller waits only when its message fills a batch.
+        """
+        if message.receiver_id is not None:
+            message.conversation_key = Message.conversation_key_for(message.sender_id, message.receiver_id)
+        with self._lock:
+            self._pending.append(message)
+            depth = len(self._pending)
+        metrics.set_gauge('chat_write_buffer_depth', depth)
+
+        if depth >= settings.CHAT_WRITE_BEHIND_BATCH_SIZE:
+            await self.flush()
+            return
+
+        loop = asyncio.get_running_loop()
+        if self._timer is None or self._timer.done() or self._timer.get_loop() is not loop:
+            self._timer = loop.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(settings.CHAT_WRITE_BEHIND_INTERVAL)
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception('Scheduled chat message flush failed')
+
+    async def flush(self):
+        """
+        Write everything buffered so far.
+        """
+        timer = self._timer
+        if timer is not None and timer is not asyncio.current_task() and not timer.done():
+            timer.cancel()
+        batch = self._take()
+        if batch:
+            await database_sync_to_async(self._write)(batch)
+
+    def flush_sync(self):
+        """
+        ``flush`` for callers without an event loop, e.g. at interpreter exit.
+        """
+        batch = self._take()
+        if batch:
+            self._write(batch)
+
+    def _take(self):
+        with self._lock:
+            batch, self._pending = self._pending, []
+        metrics.set_gauge('chat_write_buffer_depth', 0)
+        return batch
+
+    def _write(self, batch):
+        started = time.monotonic()
+        try:
+            self._persist(batch)
+        except OperationalError:
+            logger.exception('Could not persist %d chat messages, keeping them for the next flush', len(batch))
+            self._requeue(batch)
+            return
+        except Exception:
+            logger.exception('Could not persist a batch of %d chat messages, retrying them one by one', len(batch))
+            self._write_rows(batch)
+            return
+        metrics.incr('chat_messages_persisted_total', len(batch))
+        metrics.observe('chat_write_batch_seconds', time.monotonic() - started)
+        metrics.observe('chat_write_batch_size', len(batch))
+        send_saved_ids(batch)
+
+    def _persist(self, batch):
+        for message in batch:
+            message.pk = None
+        with transaction.atomic():
+            Message.objects.bulk_create(batch)
+            record_messages(batch)
+
+    def _write_rows(self, batch):
+        persisted = []
+        for index, message in enumerate(batch):
+            try:
+                self._persist([message])
+            except OperationalError:
+                logger.exception('Could not persist chat messages, keeping %d for the next flush', len(batch) - index)
+                self._requeue(batch[index:])
+                break
+            except Exception:
+                metrics.incr('chat_messages_dropped_total')
+                logger.exception(
+                    'Dropping chat message from user %s in %s that cannot be persisted',
+                    message.sender_id, message.conversation_key,
+                )
+            else:
+                persisted.append(message)
+        metrics.incr('chat_messages_persisted_total', len(persisted))
+        send_saved_ids(persisted)
+
+    def _requeue(self, batch):
+        metrics.incr('chat_write_failures_total')
+        with self._lock:
+            self._pending[:0] = batch
+            overflow = len(self._pending) - settings.CHAT_WRITE_BEHIND_MAX_DEPTH
+            if overflow > 0:
+                # Give up on the oldest messages rather than grow while the database is down
+                del self._pending[:overflow]
+            depth = len(self._pending)
+        metrics.set_gauge('chat_write_buffer_depth', depth)
+        if overflow > 0:
+            metrics.incr('chat_messages_dropped_total', overflow)
+            logger.error('Chat write buffer is full, dropped the %d oldest messages', overflow)
+
+message_buffer = MessageWriteBuffer()
+
+# Servers that do not send ASGI lifespan events (daphne) still flush on a clean exit
+atexit.register(message_buffer.flush_sync)
+
+
+async def lifespan(scope, receive, send):
+    """
+    ASGI lifespan handler that flushes buffered chat messages when the server shuts down.
+    """
+    while True:
+        event = await receive()
+        if event['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif event['type'] == 'lifespan.shutdown':
+            await message_buffer.flush()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
@@ -1,5 +1,7 @@
+import asyncio
 import json
-import jwt
+import time
+import uuid
 
 from django.conf import settings
 
@@ -7,11 +9,35 @@ from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from urllib.parse import parse_qs
 
-from users.models import CustomUser
-from .models import Message
-    
+from OnlineLearning_Platform import metrics
+
+from . import presence
+from .buffer import message_buffer
+from .conversations import cached_participants, ensure_direct_conversation, load_participants, user_group
+from .identity import cached_chat_users, load_chat_users, verify_token
+from .limits import Outbox, TokenBucket, take_user_token, transport_buffer
+from .models import Conversation, Message
+
 
 class ChatConsumer(AsyncWebsocketConsumer):
+    """
+    One connection is one device of a user.
+
+    Every device joins its user's group, and a message is sent once to the group of each
+    participant of its conversation. Each connected device therefore gets it exactly once,
+    the sender's other devices included, and the fan-out grows with participants rather than
+    with connections. ``?username=`` (a direct conversation) or ``?conversation=<key>`` (a room)
+    picks where frames go; a frame may name another of the user's conversations with
+    ``"conversation"``. Clients send ``{"type": "heartbeat"}`` to stay listed as online.
+
+    Message frames carry the message ``id`` for read receipts. With write-behind it is ``null``
+    and a ``{"type": "saved"}`` frame maps each frame's ``ref`` to the id once it is saved.
+
+    Frames are limited in size and rate, per connection and per user across devices. Outgoing
+    frames wait in a bounded ``Outbox``; a client that cannot keep up is closed (or loses its
+    oldest frames) instead of being buffered for without limit.
+    """
+
     def get_auth_header(self):
         auth_header = dict(self.scope['headers']).get(b'authorization', None)
         if auth_header is None:
@@ -19,91 +45,203 @@ class ChatConsumer(AsyncWebsocketConsumer):
         token = auth_header.decode().split(' ')[1]
         return token
 
-    def get_username_from_token(self):
+    def get_user_id_from_token(self):
         token = self.get_auth_header()
         if not token:
             return None
-        
-        try:
-            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-            user_id = payload.get('user_id', None)
-            return user_id
-        except jwt.ExpiredSignatureError:
-            return None
-        except jwt.InvalidTokenError:
-            return None
-        
-    @database_sync_to_async
-    def get_user_by_username(self, username):
-        try:
-            return CustomUser.objects.get(username=username)
-        except CustomUser.DoesNotExist:
-            return None
+        return verify_token(token)
 
-    @database_sync_to_async
-    def get_user_by_id(self, user_id):
-        try:
-            return CustomUser.objects.get(pk=user_id)
-        except CustomUser.DoesNotExist:
-            return None
-        
     @database_sync_to_async
     def save_message(self, message):
-        Message(
-            sender=self.sender,
-            receiver=self.receiver,
-            content=message
-        ).save()
+        message.save()
+
+    async def get_participants(self, key):
+        """
+        Member ids of conversation ``key`` if the user belongs to it, otherwise ``None``.
+
+        Read again for every frame, not kept per connection: the cache entry is cleared
+        whenever membership changes, so joins and removals apply to open connections too.
+        """
+        participants = cached_participants(key)
+        if participants is None:
+            participants = await database_sync_to_async(load_participants)(key)
+        if not participants or self.sender.id not in participants:
+            return None
+        return participants
+
+    def touch_presence(self, force=False):
+        # Refresh well before expiry, but not on every frame
+        now = time.monotonic()
+        if force or now - self.presence_touched >= settings.CHAT_PRESENCE_TIMEOUT / 3:
+            presence.touch(self.sender.id, self.channel_name)
+            self.presence_touched = now
 
     async def connect(self):
         query_params = parse_qs(self.scope['query_string'].decode())
         receiver_username = query_params.get('username', [None])[0]
-        sender_id = self.get_username_from_token()
+        conversation_key = query_params.get('conversation', [None])[0]
+        sender_id = self.get_user_id_from_token()
 
-        if not receiver_username or not sender_id:
+        if not (receiver_username or conversation_key) or not sender_id:
             await self.close()
             return
-        
-        self.receiver = await self.get_user_by_username(receiver_username)
-        self.sender = await self.get_user_by_id(sender_id)
-        
-        if not self.receiver or not self.sender:
+
+        # A warm reconnect is served from the cache without a thread hop or a query
+        users = cached_chat_users(sender_id, receiver_username)
+        if users is None:
+            users = await database_sync_to_async(load_chat_users)(sender_id, receiver_username)
+        self.sender, self.receiver = users
+
+        if not self.sender or (receiver_username and not self.receiver):
+            await self.close()
+            return
+
+        if self.receiver:
+            conversation_key = Conversation.direct_key(self.sender.id, self.receiver.id)
+            if cached_participants(conversation_key) is None:
+                await database_sync_to_async(ensure_direct_conversation)(self.sender.id, self.receiver.id)
+        if await self.get_participants(conversation_key) is None:
             await self.close()
             return
+        self.conversation_key = conversation_key
 
-        self.receiver_group_name = f'private_{self.receiver.username}'
+        rate = settings.CHAT_CONNECTION_RATE
+        self.bucket = TokenBucket(rate, settings.CHAT_CONNECTION_BURST) if rate else None
+        self.outbox = Outbox(
+            self.send, settings.CHAT_SEND_QUEUE_SIZE, settings.CHAT_SLOW_CONSUMER == 'drop',
+            buffered=transport_buffer(self.base_send), max_buffered=settings.CHAT_SEND_BUFFER_SIZE,
+            send_timeout=settings.CHAT_SEND_TIMEOUT,
+        )
+        self.writer = asyncio.ensure_future(self.outbox.run())
+        self.too_slow = False
+
+        self.user_group_name = user_group(self.sender.id)
         await self.channel_layer.group_add(
-            self.receiver_group_name,
+            self.user_group_name,
             self.channel_name
         )
         await self.accept()
+        self.touch_presence(force=True)
+
+    async def queue_frame(self, data, coalesce=None):
+        """
+        Queue ``data`` for the writer task, dropping or closing a connection that fell behind.
+        """
+        if self.outbox.put(json.dumps(data), coalesce):
+            return
+        metrics.incr('chat_frames_dropped_total', reason='slow_consumer')
+        if not self.outbox.drop_oldest and not self.too_slow:
+            self.too_slow = True
+            self.writer.cancel()
+            # The client can reload what it missed from the history endpoint
+            await self.close(code=4008)
+
+    async def throttled(self, scope, retry_after):
+        metrics.incr('chat_frames_throttled_total', scope=scope)
+        # While a client keeps flooding, one pending error is enough
+        await self.queue_frame({'error': 'Rate limit exceeded.', 'retry_after': round(retry_after, 3)}, 'throttled')
+
+    async def disconnect(self, code):
+        if hasattr(self, 'writer'):
+            self.writer.cancel()
+        if hasattr(self, 'user_group_name'):
+            await self.channel_layer.group_discard(self.user_group_name, self.channel_name)
+            presence.leave(self.sender.id, self.channel_name)
+        # Nothing this connection sent may stay only in memory once it is gone
+        await message_buffer.flush()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        if text_data is None:
+            metrics.incr('chat_frames_dropped_total', reason='binary')
+            return
+        if len(text_data) > settings.CHAT_MAX_FRAME_SIZE:
+            metrics.incr('chat_frames_dropped_total', reason='too_large')
+            await self.queue_frame({'error': 'Frame too large.', 'max_size': settings.CHAT_MAX_FRAME_SIZE})
+            return
+        if self.bucket and not self.bucket.take():
+            await self.throttled('connection', self.bucket.retry_after)
+            return
+
+        try:
+            text_data_json = json.loads(text_data)
+        except ValueError:
+            return
+        if not isinstance(text_data_json, dict):
+            return
 
-    async def disconnect(self):
-        pass
+        self.touch_presence()
+        if text_data_json.get('type') == 'heartbeat':
+            return
 
-    async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
         message = text_data_json.get('message', '')
-        
         if not message:
             return
-        
-        await self.save_message(message)
-
-        await self.channel_layer.group_send(
-            self.receiver_group_name,
-            {
-                'type': 'chat_message',
-                'message': message,
-                'sender': str(self.sender.username)
-            }
-        )
 
-    async def chat_message(self, event):
-        message = event['message']
-        sender = event['sender']
+        if settings.CHAT_USER_RATE:
+            allowed, bucket = await take_user_token(self.sender.id, settings.CHAT_USER_RATE, settings.CHAT_USER_BURST)
+            if not allowed:
+                await self.throttled('user', bucket.retry_after)
+                return
+
+        key = text_data_json.get('conversation')
+        if key is None or key == '':
+            key = self.conversation_key
+        participants = await self.get_participants(key) if isinstance(key, str) else None
+        if participants is None:
+            await self.queue_frame({'error': 'Unknown conversation.', 'conversation': key})
+            return
 
-        await self.send(text_data=json.dumps({
+        pair = Conversation.direct_participants(key)
+        receiver_id = None
+        if pair:
+            receiver_id = pair[1] if pair[0] == self.sender.id else pair[0]
+        record = Message(sender_id=self.sender.id, receiver_id=receiver_id, conversation_key=key, content=message)
+
+        event = {
+            'type': 'chat_message',
             'message': message,
-            'sender': sender
-        }))
+            'sender': str(self.sender.username),
+            'conversation': key,
+            'message_time': record.message_time.isoformat(),
+        }
+        write_behind = settings.CHAT_WRITE_BEHIND
+        if write_behind:
+            # Delivered before it has an id: a "saved" frame maps the ref to the id later
+            record.ref = event['ref'] = uuid.uuid4().hex
+            event['id'] = None
+        else:
+            await self.save_message(record)
+            event['id'] = record.pk
+        for user_id in participants:
+            await self.channel_layer.group_send(user_group(user_id), event)
+
+        if write_behind:
+            await message_buffer.add(record)
+
+    async def chat_message(self, event):
+        frame = {
+            'id': event['id'],
+            'message': event['message'],
+            'sender': event['sender'],
+            'conversation': event['conversation'],
+            'message_time': event['message_time'],
+        }
+        if 'ref' in event:
+            frame['ref'] = event['ref']
+        await self.queue_frame(frame)
+
+    async def chat_saved(self, event):
+        await self.queue_frame({
+            'type': 'saved',
+            'conversation': event['conversation'],
+            'messages': event['messages'],
+        })
+
+    async def chat_read(self, event):
+        # Only the latest read position per reader matters
+        await self.queue_frame({
+            'type': 'read',
+            'conversation': event['conversation'],
+            'user': event['user'],
+            'message_id': event['message_id'],
+        }, coalesce=('read', event['conversation'], event['user']))
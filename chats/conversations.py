@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Conversation, ConversationMember
+
+
+def user_group(user_id):
+    """
+    Channel layer group of every connected device of a user.
+    """
+    return f'user_{user_id}'
+
+
+def _members_key(key):
+    return f'chat-members:{key}'
+
+
+def cached_participants(key):
+    """
+    The member user ids of conversation ``key`` from the cache, or ``None`` on a miss.
+    """
+    return cache.get(_members_key(key))
+
+
+def load_participants(key):
+    """
+    Load and cache the member user ids of conversation ``key``; ``None`` if it does not exist.
+    """
+    members = list(ConversationMember.objects.filter(conversation__key=key).values_list('user_id', flat=True))
+    if not members:
+        return None
+    members = tuple(sorted(members))
+    cache.set(_members_key(key), members, settings.CHAT_IDENTITY_CACHE_TIMEOUT)
+    return members
+
+
+def ensure_direct_conversation(user_id, other_id):
+    """
+    Create the direct conversation of two users if needed; returns its member ids.
+    """
+    key = Conversation.direct_key(user_id, other_id)
+    with transaction.atomic():
+        conversation, created = Conversation.objects.get_or_create(key=key, defaults={'kind': Conversation.KIND_DIRECT})
+        if created:
+            ConversationMember.objects.bulk_create(
+                [ConversationMember(conversation=conversation, user_id=pk) for pk in {user_id, other_id}],
+                ignore_conflicts=True,
+            )
+    return load_participants(key)
+
+
+def invalidate_participants(key):
+    cache.delete(_members_key(key))
@@ -0,0 +1,114 @@
+import hashlib
+import time
+from collections import namedtuple
+
+import jwt
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from users.models import CustomUser
+
+
+# What a chat connection needs to know about a user, cheap to cache and pickle
+ChatUser = namedtuple('ChatUser', ['id', 'username'])
+
+
+def _token_key(token):
+    return f'chat-token:{hashlib.sha256(token.encode()).hexdigest()}'
+
+
+def _user_key(pk):
+    return f'chat-user:{pk}'
+
+
+def _username_key(username):
+    return f'chat-username:{hashlib.md5(username.encode()).hexdigest()}'
+
+
+def verify_token(token):
+    """
+    Return the user id of a valid access token, or ``None``.
+
+    A verified token is cached until it expires, so reconnects skip the signature check.
+    """
+    key = _token_key(token)
+    user_id = cache.get(key)
+    if user_id is not None:
+        return user_id
+
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
+        user_id = int(payload['user_id'])
+    except (jwt.InvalidTokenError, KeyError, TypeError, ValueError):
+        return None
+
+    timeout = int(payload['exp'] - time.time()) if 'exp' in payload else settings.CHAT_IDENTITY_CACHE_TIMEOUT
+    if timeout > 0:
+        cache.set(key, user_id, timeout)
+    return user_id
+
+
+def cached_chat_users(user_id, username):
+    """
+    Return ``(user, other)`` as ``ChatUser``s from the cache alone, or ``None`` on a miss.
+
+    A cached username only counts when the user it points to still has that name. Without a
+    ``username`` only ``user`` is looked up and ``other`` is ``None``.
+    """
+    if username is None:
+        user = cache.get(_user_key(user_id))
+        return (user, None) if user is not None else None
+
+    cached = cache.get_many([_user_key(user_id), _username_key(username)])
+    user = cached.get(_user_key(user_id))
+    other_id = cached.get(_username_key(username))
+    if user is None or other_id is None:
+        return None
+
+    other = user if other_id == user.id else cache.get(_user_key(other_id))
+    if other is None or other.username != username:
+        return None
+    return user, other
+
+
+def load_chat_users(user_id, username):
+    """
+    Load the user ``user_id`` and the user called ``username`` in one query and cache them.
+
+    Returns ``(user, other)`` with ``None`` for either that does not exist (or was not asked for).
+    """
+    lookup = Q(pk=user_id) | Q(username=username) if username is not None else Q(pk=user_id)
+    found = [ChatUser(*row) for row in CustomUser.objects.filter(lookup).values_list('pk', 'username')]
+    entries = {}
+    for chat_user in found:
+        entries[_user_key(chat_user.id)] = chat_user
+        entries[_username_key(chat_user.username)] = chat_user.id
+    cache.set_many(entries, settings.CHAT_IDENTITY_CACHE_TIMEOUT)
+
+    user = next((chat_user for chat_user in found if chat_user.id == user_id), None)
+    other = next((chat_user for chat_user in found if username is not None and chat_user.username == username), None)
+    return user, other
+
+
+def get_chat_users(user_ids):
+    """
+    Map each of ``user_ids`` that exists to its ``ChatUser``, loading cache misses in one query.
+    """
+    user_ids = set(user_ids)
+    cached = cache.get_many([_user_key(pk) for pk in user_ids])
+    users = {chat_user.id: chat_user for chat_user in cached.values()}
+    missing = user_ids - users.keys()
+    if missing:
+        found = [ChatUser(*row) for row in CustomUser.objects.filter(pk__in=missing).values_list('pk', 'username')]
+        cache.set_many({_user_key(chat_user.id): chat_user for chat_user in found}, settings.CHAT_IDENTITY_CACHE_TIMEOUT)
+        users.update((chat_user.id, chat_user) for chat_user in found)
+    return users
+
+
+def invalidate_chat_user(user_id):
+    """
+    Forget a user's cached identity; cached usernames pointing at it are then ignored.
+    """
+    cache.delete(_user_key(user_id))
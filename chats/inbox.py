@@ -0,0 +1,131 @@
+import logging
+from collections import Counter, defaultdict
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+from django.db.models import Case, Count, DateTimeField, F, IntegerField, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest
+
+from .conversations import cached_participants, ensure_direct_conversation, load_participants, user_group
+from .models import Conversation, ConversationMember, Message
+
+
+logger = logging.getLogger(__name__)
+
+
+def _newer_than(message):
+    return (
+        Q(last_message_time__isnull=True)
+        | Q(last_message_time__lt=message.message_time)
+        | Q(last_message_time=message.message_time, last_message_id__lt=message.pk)
+    )
+
+
+def record_messages(messages):
+    """
+    Fold newly saved messages into their conversations' inbox summaries.
+
+    Each conversation in the batch costs two UPDATEs: one moves its last message forward and
+    one adds to every member's unread count (except for what they sent themselves).
+    """
+    by_conversation = defaultdict(list)
+    for message in messages:
+        by_conversation[message.conversation_key].append(message)
+
+    for key, batch in by_conversation.items():
+        last = max(batch, key=lambda message: (message.message_time, message.pk))
+        conversations = Conversation.objects.filter(key=key)
+        updated = conversations.filter(_newer_than(last)).update(last_message=last, last_message_time=last.message_time)
+        if not updated and not conversations.exists():
+            # A direct conversation whose messages were saved before anyone connected to it
+            pair = Conversation.direct_participants(key)
+            if pair is None:
+                continue
+            ensure_direct_conversation(*pair)
+            conversations.update(last_message=last, last_message_time=last.message_time)
+
+        sent = Counter(message.sender_id for message in batch)
+        ConversationMember.objects.filter(conversation__key=key).update(
+            unread_count=F('unread_count') + Case(
+                *[When(user_id=user_id, then=Value(len(batch) - count)) for user_id, count in sent.items()],
+                default=Value(len(batch)),
+                output_field=IntegerField(),
+            ),
+            last_message_time=Greatest('last_message_time', Value(last.message_time, output_field=DateTimeField())),
+        )
+
+
+def mark_read(user_id, key, message_id):
+    """
+    Mark conversation ``key`` read by ``user_id`` up to and including ``message_id``.
+
+    The unread count is recomputed from the messages after that one, found by a range scan
+    of the conversation index, in the same UPDATE. Marks only move forward. Returns the new
+    unread count, or ``None`` if the user is not a member or the message is not in ``key``.
+    """
+    position = Message.objects.filter(pk=message_id, conversation_key=key).values_list('message_time', flat=True).first()
+    if position is None:
+        return None
+
+    unread = (
+        Message.objects.filter(conversation_key=key)
+        .filter(Q(message_time__gt=position) | Q(message_time=position, pk__gt=message_id))
+        .exclude(sender_id=user_id)
+        .order_by().values('conversation_key').annotate(total=Count('*')).values('total')
+    )
+    member = ConversationMember.objects.filter(conversation__key=key, user_id=user_id)
+    member.filter(last_read_message_id__lt=message_id).update(
+        last_read_message_id=message_id,
+        unread_count=Coalesce(Subquery(unread), 0),
+    )
+    return member.values_list('unread_count', flat=True).first()
+
+
+def send_to_participants(events):
+    """
+    Send each ``(key, event)`` in ``events`` to every device of the participants of conversation
+    ``key``, from synchronous code. Best effort: a channel layer error is only logged.
+    """
+    sends = []
+    for key, event in events:
+        participants = cached_participants(key) or load_participants(key) or ()
+        sends += [(user_group(user_id), event) for user_id in participants]
+
+    async def send_all():
+        channel_layer = get_channel_layer()
+        for group, event in sends:
+            await channel_layer.group_send(group, event)
+
+    if sends:
+        try:
+            async_to_sync(send_all)()
+        except Exception:
+            logger.exception('Could not send %s events', sends[0][1]['type'])
+
+
+def send_read_receipts(user, marks):
+    """
+    Tell every device of the participants of each ``(key, message_id)`` in ``marks`` how far
+    ``user`` has read.
+    """
+    send_to_participants([
+        (key, {'type': 'chat_read', 'conversation': key, 'user': user.username, 'message_id': message_id})
+        for key, message_id in marks
+    ])
+
+
+def send_saved_ids(messages):
+    """
+    Tell the participants' devices the ids of write-behind messages that were delivered before
+    they were saved, by the ``ref`` their live frame carried.
+    """
+    by_conversation = defaultdict(list)
+    for message in messages:
+        ref = getattr(message, 'ref', None)
+        if ref is not None:
+            by_conversation[message.conversation_key].append({'ref': ref, 'id': message.pk})
+    send_to_participants([
+        (key, {'type': 'chat_saved', 'conversation': key, 'messages': saved})
+        for key, saved in by_conversation.items()
+    ])
@@ -0,0 +1,321 @@
+import asyncio
+import bisect
+import copy
+import hashlib
+import random
+import re
+import string
+import threading
+import time
+from collections import deque
+
+from django.utils.module_loading import import_string
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+from channels_redis.core import RedisChannelLayer
+
+from OnlineLearning_Platform import metrics
+
+
+class _Queue:
+    __slots__ = ('messages', 'waiters')
+
+    def __init__(self):
+        # (expires, message) in arrival order, so expired messages are always at the front
+        self.messages = deque()
+        self.waiters = deque()
+
+
+class MemoryChannelLayer(BaseChannelLayer):
+    """
+    In-process channel layer for single-node deployments, tests and benchmarks.
+
+    Unlike ``channels.layers.InMemoryChannelLayer`` no operation scans every channel: expired
+    messages are dropped from the front of the queue being used, and expired group memberships
+    are swept at most every ``sweep_interval`` seconds. A channel whose message expired unread
+    is treated as gone and leaves its groups. ``capacity``/``channel_capacity`` bound each
+    channel's queue and ``group_capacity`` bounds the members of a group. A message is copied
+    once when it is sent; each receiver gets its own top-level dict.
+    """
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, expiry=60, group_expiry=86400, capacity=100, channel_capacity=None,
+                 group_capacity=None, sweep_interval=60, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.channel_capacity = self.compile_capacities(self.channel_capacity)
+        self.group_expiry = group_expiry
+        self.group_capacity = group_capacity
+        self.sweep_interval = sweep_interval
+        self._lock = threading.Lock()
+        self._last_sweep = time.time()
+        self.channels = {}
+        # group -> {channel: join time}, and the reverse index to drop a dead channel quickly
+        self.groups = {}
+        self.channel_groups = {}
+
+    # Channels
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        assert "__asgi_channel__" not in message
+        with self._lock:
+            self._deliver(channel, copy.deepcopy(message), time.time(), strict=True)
+
+    async def receive(self, channel):
+        """
+        Wait for the next message on ``channel``. Each message goes to one receiver.
+        """
+        assert self.valid_channel_name(channel)
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                now = time.time()
+                queue = self.channels.get(channel)
+                if queue is not None:
+                    self._expire(channel, queue, now)
+                    if queue.messages:
+                        message = queue.messages.popleft()[1]
+                        if not queue.messages and not queue.waiters:
+                            del self.channels[channel]
+                        return message
+                else:
+                    queue = self.channels[channel] = _Queue()
+                waiter = loop.create_future()
+                queue.waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                with self._lock:
+                    if waiter in queue.waiters:
+                        queue.waiters.remove(waiter)
+                    if not queue.messages and not queue.waiters and self.channels.get(channel) is queue:
+                        del self.channels[channel]
+
+    async def new_channel(self, prefix='specific.'):
+        suffix = ''.join(random.choice(string.ascii_letters) for _ in range(12))
+        return f'{prefix}.memory!{suffix}'
+
+    def _deliver(self, channel, message, now, strict):
+        queue = self.channels.get(channel)
+        if queue is None:
+            queue = self.channels[channel] = _Queue()
+        else:
+            self._expire(channel, queue, now)
+        if len(queue.messages) >= self.get_capacity(channel):
+            if strict:
+                raise ChannelFull(channel)
+            metrics.incr('channel_layer_dropped_total')
+            return
+        queue.messages.append((now + self.expiry, message))
+        while queue.waiters:
+            waiter = queue.waiters.popleft()
+            if not waiter.done():
+                self._wake(waiter)
+                break
+
+    @staticmethod
+    def _wake(waiter):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if waiter.get_loop() is running:
+            waiter.set_result(None)
+        else:
+            # Sent from another thread's loop (e.g. async_to_sync in a view)
+            waiter.get_loop().call_soon_threadsafe(lambda: waiter.done() or waiter.set_result(None))
+
+    def _expire(self, channel, queue, now):
+        expired = False
+        while queue.messages and queue.messages[0][0] <= now:
+            queue.messages.popleft()
+            expired = True
+        if expired:
+            self._remove_from_groups(channel)
+
+    # Groups
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        with self._lock:
+            members = self.groups.setdefault(group, {})
+            if channel not in members and self.group_capacity and len(members) >= self.group_capacity:
+                raise ChannelFull(group)
+            members[channel] = time.time()
+            self.channel_groups.setdefault(channel, set()).add(group)
+
+    async def group_discard(self, group, channel):
+        assert self.valid_channel_name(channel), "Invalid channel name"
+        assert self.valid_group_name(group), "Invalid group name"
+        with self._lock:
+            self._discard(group, channel)
+
+    async def group_send(self, group, message):
+        """
+        Send to every member of ``group``; members whose queue is full miss the message.
+        """
+        assert isinstance(message, dict), "Message is not a dict"
+        assert self.valid_group_name(group), "Invalid group name"
+        message = copy.deepcopy(message)
+        with self._lock:
+            now = time.time()
+            if now - self._last_sweep >= self.sweep_interval:
+                self._sweep(now)
+            for channel in list(self.groups.get(group, ())):
+                self._deliver(channel, dict(message), now, strict=False)
+
+    async def group_channels(self, group):
+        """
+        Current members of ``group``; lets the layer serve as a ``ShardedChannelLayer`` shard.
+        """
+        cutoff = time.time() - self.group_expiry
+        with self._lock:
+            return [channel for channel, joined in self.groups.get(group, {}).items() if joined >= cutoff]
+
+    def _discard(self, group, channel):
+        members = self.groups.get(group)
+        if members is not None:
+            members.pop(channel, None)
+            if not members:
+                del self.groups[group]
+        groups = self.channel_groups.get(channel)
+        if groups is not None:
+            groups.discard(group)
+            if not groups:
+                del self.channel_groups[channel]
+
+    def _remove_from_groups(self, channel):
+        for group in list(self.channel_groups.get(channel, ())):
+            self._discard(group, channel)
+
+    def _sweep(self, now):
+        self._last_sweep = now
+        for channel, queue in list(self.channels.items()):
+            self._expire(channel, queue, now)
+            if not queue.messages and not queue.waiters:
+                del self.channels[channel]
+        cutoff = now - self.group_expiry
+        for group, members in list(self.groups.items()):
+            for channel, joined in list(members.items()):
+                if joined < cutoff:
+                    self._discard(group, channel)
+
+    # Flush extension
+
+    async def flush(self):
+        with self._lock:
+            self.channels = {}
+            self.groups = {}
+            self.channel_groups = {}
+
+    async def close(self):
+        pass
+
+
+class HashRing:
+    """
+    Consistent hash ring: each node owns ``replicas`` points, and a key belongs to the first
+    point after its hash. Adding or removing a node only moves the keys next to its points.
+    """
+
+    def __init__(self, nodes, replicas=160):
+        self.points = sorted(
+            (self._hash(f'{node}:{replica}'), node) for node in nodes for replica in range(replicas)
+        )
+        self.hashes = [point for point, _ in self.points]
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+    def get(self, key):
+        index = bisect.bisect(self.hashes, self._hash(key)) % len(self.hashes)
+        return self.points[index][1]
+
+
+class RedisShardLayer(RedisChannelLayer):
+    """
+    channels_redis layer that can serve as a ``ShardedChannelLayer`` shard.
+    """
+
+    async def group_channels(self, group):
+        key = self._group_key(group)
+        connection = self.connection(self.consistent_hash(group))
+        await connection.zremrangebyscore(key, min=0, max=int(time.time()) - self.group_expiry)
+        return [channel.decode() for channel in await connection.zrange(key, 0, -1)]
+
+
+class ShardedChannelLayer(BaseChannelLayer):
+    """
+    Spread channels and groups over several channel layers ("shards").
+
+    ``shards`` is a list of ``{'BACKEND': ..., 'CONFIG': ...}`` dicts, like ``CHANNEL_LAYERS``
+    entries, whose layers provide ``group_channels(group)`` (``MemoryChannelLayer``,
+    ``RedisShardLayer``). A new channel is placed on a shard picked from the hash ring and
+    carries its shard in its name (``shard-<n>.``), so any process can route to it. Other
+    channel names are routed by consistent hashing of their non-local part. A group lives on
+    the shard its name hashes to: a group_send reads the members there and sends to each on
+    its own shard, so only the shards involved see the message.
+    """
+
+    extensions = ['groups', 'flush']
+    shard_name_re = re.compile(r'^shard-(\d+)\.(.+)$')
+
+    def __init__(self, shards, replicas=160, **kwargs):
+        super().__init__(**kwargs)
+        self.shards = [import_string(shard['BACKEND'])(**shard.get('CONFIG', {})) for shard in shards]
+        self.ring = HashRing(range(len(self.shards)), replicas)
+
+    def route(self, channel):
+        """
+        Return ``(shard index, channel name on that shard)`` for ``channel``.
+        """
+        match = self.shard_name_re.match(channel)
+        if match and int(match.group(1)) < len(self.shards):
+            return int(match.group(1)), match.group(2)
+        return self.ring.get(self.non_local_name(channel)), channel
+
+    async def send(self, channel, message):
+        index, name = self.route(channel)
+        await self.shards[index].send(name, message)
+
+    async def receive(self, channel):
+        index, name = self.route(channel)
+        return await self.shards[index].receive(name)
+
+    async def new_channel(self, prefix='specific.'):
+        index = self.ring.get(''.join(random.choice(string.ascii_letters) for _ in range(12)))
+        name = await self.shards[index].new_channel(prefix)
+        return f'shard-{index}.{name}'
+
+    def group_shard(self, group):
+        return self.shards[self.ring.get(group)]
+
+    async def group_add(self, group, channel):
+        await self.group_shard(group).group_add(group, channel)
+
+    async def group_discard(self, group, channel):
+        await self.group_shard(group).group_discard(group, channel)
+
+    async def group_send(self, group, message):
+        """
+        Send to every member of ``group``; members whose channel is full miss the message.
+        """
+        members = await self.group_shard(group).group_channels(group)
+        await asyncio.gather(*(self._send_member(channel, message) for channel in members))
+
+    async def _send_member(self, channel, message):
+        try:
+            await self.send(channel, message)
+        except ChannelFull:
+            metrics.incr('channel_layer_dropped_total')
+
+    async def flush(self):
+        await asyncio.gather(*(shard.flush() for shard in self.shards))
+
+    async def close(self):
+        await asyncio.gather(*(shard.close() for shard in self.shards if hasattr(shard, 'close')))
@@ -0,0 +1,156 @@
+import asyncio
+import functools
+import math
+import time
+from collections import deque
+
+from django.core.cache import cache
+
+
+class TokenBucket:
+    """
+    ``burst`` tokens refilled at ``rate`` per second; each allowed frame takes one.
+    """
+
+    __slots__ = ('rate', 'burst', 'tokens', 'stamp')
+
+    def __init__(self, rate, burst, tokens=None, stamp=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst if tokens is None else tokens
+        self.stamp = time.monotonic() if stamp is None else stamp
+
+    def take(self, now=None):
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + max(now - self.stamp, 0) * self.rate)
+        self.stamp = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    @property
+    def retry_after(self):
+        """
+        Seconds until the next token, as of the last ``take``.
+        """
+        return max(1 - self.tokens, 0) / self.rate
+
+
+async def take_user_token(user_id, rate, burst):
+    """
+    Take a token from a user's bucket shared by all their devices (and processes) through the
+    cache. Returns ``(allowed, bucket)``.
+
+    Like presence, the entry is read and written without a lock, so two devices sending at the
+    same moment may both be allowed one frame more than the limit.
+    """
+    key = f'chat-rate:{user_id}'
+    now = time.time()
+    # The async cache API keeps a network cache round trip off the event loop
+    tokens, stamp = await cache.aget(key) or (burst, now)
+    bucket = TokenBucket(rate, burst, tokens, stamp)
+    allowed = bucket.take(now)
+    # A bucket left alone this long is full again, which is what a missing entry means
+    await cache.aset(key, (bucket.tokens, bucket.stamp), math.ceil(burst / rate) + 1)
+    return allowed, bucket
+
+
+def transport_buffer(send):
+    """
+    Return a function giving the bytes of a connection that were sent but not yet written to
+    the socket, or ``None`` when the server does not expose them.
+
+    Daphne accepts every frame at once and buffers it in its Twisted transport without limit.
+    Its ASGI ``send`` is ``partial(server.handle_reply, protocol)``, possibly wrapped by the
+    session middleware, which leads to that transport.
+    """
+    while not isinstance(send, functools.partial):
+        send = getattr(getattr(send, '__self__', None), 'real_send', None)
+        if send is None:
+            return None
+
+    transport = getattr(send.args[0], 'transport', None) if send.args else None
+    # A TLS transport wraps the TCP one, which holds the unwritten bytes
+    while transport is not None and not hasattr(transport, 'dataBuffer'):
+        transport = getattr(transport, 'transport', None)
+    if transport is None:
+        return None
+
+    def buffered():
+        return len(transport.dataBuffer) - transport.offset + transport._tempDataLen
+    return buffered
+
+
+class Outbox:
+    """
+    Bounded queue of frames waiting to be written to one connection by a single task.
+
+    A frame put with a ``coalesce`` key replaces a queued frame with the same key instead of
+    queueing behind it. When the queue is full, ``put`` returns ``False``; with ``drop_oldest``
+    it first makes room by dropping the oldest frame, otherwise the new frame is not queued.
+
+    The queue only fills if the writer waits for the client. Servers that apply backpressure
+    (e.g. uvicorn) make ``send`` itself wait; for servers that buffer instead, ``buffered``
+    reports the unwritten bytes and the writer holds frames back while there are more than
+    ``max_buffered``. A writer that has waited longer than ``send_timeout`` counts as full too.
+    """
+    drain_interval = 0.05
+
+    def __init__(self, send, size, drop_oldest=False, buffered=None, max_buffered=0, send_timeout=None):
+        self.send = send
+        self.size = size
+        self.drop_oldest = drop_oldest
+        self.buffered = buffered
+        self.max_buffered = max_buffered
+        self.send_timeout = send_timeout
+        # [coalesce key, frame] cells, so a coalesced frame keeps its place
+        self.frames = deque()
+        self.coalescing = {}
+        self.ready = asyncio.Event()
+        # When the writer started waiting for the client, None while it is idle
+        self.waiting_since = None
+
+    def __len__(self):
+        return len(self.frames)
+
+    def put(self, frame, coalesce=None):
+        if coalesce is not None and coalesce in self.coalescing:
+            self.coalescing[coalesce][1] = frame
+            return True
+        complete = True
+        if len(self.frames) >= self.size or (self.stalled() and self.frames):
+            if not self.drop_oldest:
+                return False
+            self._forget(self.frames.popleft())
+            complete = False
+        cell = [coalesce, frame]
+        self.frames.append(cell)
+        if coalesce is not None:
+            self.coalescing[coalesce] = cell
+        self.ready.set()
+        return complete
+
+    def stalled(self):
+        return (
+            self.send_timeout is not None and self.waiting_since is not None
+            and time.monotonic() - self.waiting_since > self.send_timeout
+        )
+
+    def _forget(self, cell):
+        if cell[0] is not None and self.coalescing.get(cell[0]) is cell:
+            del self.coalescing[cell[0]]
+
+    async def run(self):
+        while True:
+            while not self.frames:
+                self.ready.clear()
+                await self.ready.wait()
+            self.waiting_since = time.monotonic()
+            while self.buffered is not None and self.buffered() > self.max_buffered:
+                await asyncio.sleep(self.drain_interval)
+            cell = self.frames.popleft()
+            self._forget(cell)
+            # Servers that apply backpressure (e.g. uvicorn) make this wait for a slow client
+            await self.send(text_data=cell[1])
+            self.waiting_since = None
@@ -0,0 +1,157 @@
+import json
+import threading
+import uuid
+from contextlib import ExitStack
+
+from asgiref.sync import async_to_sync
+from rest_framework_simplejwt.tokens import AccessToken
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from OnlineLearning_Platform import metrics
+
+from chats.benchmark import ChatBenchmark
+from chats.models import Conversation, Message
+from users.models import CustomUser
+
+
+class WriteCounter:
+    """
+    Database execute wrapper counting INSERT/UPDATE/DELETE statements.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip()[:6].upper() in ('INSERT', 'UPDATE', 'DELETE'):
+            with self._lock:
+                self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark ChatConsumer with sender/receiver pairs and print connect latency, delivery '
+        'latency percentiles, messages/sec and DB writes/sec as JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pairs', type=int, default=10, help='Number of sender/receiver pairs.')
+        parser.add_argument('--messages', type=int, default=100, help='Messages each sender sends.')
+        parser.add_argument(
+            '--rate', type=float, default=0, help='Messages per second per sender (default: as fast as possible).'
+        )
+        parser.add_argument(
+            '--url', help='WebSocket URL of a running server, e.g. ws://127.0.0.1:8000/ws/chat/ '
+                          '(default: drive the ASGI application in this process).'
+        )
+        parser.add_argument(
+            '--layer', choices=('memory', 'settings'), default='memory',
+            help='In-process runs: use an in-memory channel layer or the configured CHANNEL_LAYERS.'
+        )
+        parser.add_argument('--write-behind', action='store_true', help='In-process runs: enable CHAT_WRITE_BEHIND.')
+        parser.add_argument(
+            '--rate-limits', action='store_true', help='In-process runs: keep the chat rate limits (off by default).'
+        )
+        parser.add_argument('--timeout', type=float, default=10.0, help='Seconds to wait for a connect or a message.')
+        parser.add_argument('--keep-data', action='store_true', help='Keep the benchmark users and their messages.')
+        parser.add_argument('--output', help='Also write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        url = options['url']
+        run_id = uuid.uuid4().hex[:8]
+        senders, receivers = self.create_users(run_id, options['pairs'])
+        users = [
+            (str(AccessToken.for_user(sender)), sender.username, str(AccessToken.for_user(receiver)), receiver.username)
+            for sender, receiver in zip(senders, receivers)
+        ]
+
+        overrides = {}
+        if not url:
+            if options['layer'] == 'memory':
+                overrides['CHANNEL_LAYERS'] = {'default': {
+                    'BACKEND': 'chats.layers.MemoryChannelLayer',
+                    'CONFIG': {'capacity': max(1000, options['messages'] * 2)},
+                }}
+            if options['write_behind']:
+                overrides['CHAT_WRITE_BEHIND'] = True
+            if not options['rate_limits']:
+                overrides['CHAT_CONNECTION_RATE'] = overrides['CHAT_USER_RATE'] = 0
+
+        writes = WriteCounter()
+        throttled, dropped = self.frames_lost()
+        try:
+            with ExitStack() as stack:
+                if overrides:
+                    stack.enter_context(override_settings(**overrides))
+                # In-process, database_sync_to_async runs on this thread and its connection
+                stack.enter_context(connection.execute_wrapper(writes))
+                application = None
+                if not url:
+                    from OnlineLearning_Platform.asgi import application
+                benchmark = ChatBenchmark(
+                    options['pairs'], options['messages'], rate=options['rate'], url=url,
+                    application=application, timeout=options['timeout'],
+                )
+                try:
+                    report = async_to_sync(benchmark.run)(users, writes)
+                except (OSError, RuntimeError) as error:
+                    raise CommandError(f'Benchmark failed: {error}')
+                write_behind = settings.CHAT_WRITE_BEHIND
+
+            persisted = Message.objects.filter(sender__in=senders).count()
+            throttled_after, dropped_after = self.frames_lost()
+        finally:
+            if not options['keep_data']:
+                self.delete_users(senders, receivers)
+
+        write_seconds = report.pop('write_duration_s')
+        report = {
+            'mode': 'socket' if url else 'in-process',
+            'pairs': options['pairs'],
+            'messages_per_sender': options['messages'],
+            'rate_per_sender': options['rate'] or None,
+            'write_behind': None if url else write_behind,
+            **report,
+            'messages_persisted': persisted,
+            'frames_throttled': None if url else throttled_after - throttled,
+            'frames_dropped': None if url else dropped_after - dropped,
+            'db_writes': None if url else report['db_writes'],
+            'db_writes_per_sec': round(report['db_writes'] / write_seconds, 1) if not url and write_seconds else None,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        self.stdout.write(output)
+
+    @staticmethod
+    def frames_lost():
+        return (
+            int(sum(metrics.get_value('chat_frames_throttled_total', scope=scope) for scope in ('connection', 'user'))),
+            int(sum(
+                metrics.get_value('chat_frames_dropped_total', reason=reason)
+                for reason in ('binary', 'too_large', 'slow_consumer')
+            )),
+        )
+
+    def create_users(self, run_id, pairs):
+        users = []
+        for role in ('sender', 'receiver'):
+            for i in range(pairs):
+                user = CustomUser(username=f'bench-{run_id}-{role}-{i}', email=f'bench-{run_id}-{role}-{i}@example.com')
+                user.set_unusable_password()
+                users.append(user)
+        CustomUser.objects.bulk_create(users)
+        users = list(CustomUser.objects.filter(username__startswith=f'bench-{run_id}-').order_by('id'))
+        return users[:pairs], users[pairs:]
+
+    def delete_users(self, senders, receivers):
+        keys = [Conversation.direct_key(sender.pk, receiver.pk) for sender, receiver in zip(senders, receivers)]
+        Conversation.objects.filter(key__in=keys).delete()
+        CustomUser.objects.filter(pk__in=[user.pk for user in senders + receivers]).delete()
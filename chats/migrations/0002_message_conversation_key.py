@@ -0,0 +1,32 @@
+# Generated by Django 4.2 on 2026-10-18 16:02
+
+from django.db import migrations, models
+
+
+def backfill_conversation_keys(apps, schema_editor):
+    Message = apps.get_model('chats', 'Message')
+    pairs = Message.objects.order_by().values_list('sender_id', 'receiver_id').distinct()
+    for sender_id, receiver_id in pairs:
+        key = f'{min(sender_id, receiver_id)}:{max(sender_id, receiver_id)}'
+        Message.objects.filter(sender_id=sender_id, receiver_id=receiver_id).update(conversation_key=key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='conversation_key',
+            field=models.CharField(default='', editable=False, max_length=41),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_conversation_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation_key', 'message_time', 'id'], name='messages_conversation_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2 on 2026-10-18 14:49
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0002_message_conversation_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='message_time',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 4.2 on 2026-10-18 14:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def backfill_inbox(apps, schema_editor):
+    """
+    Create the direct conversations of existing messages and summarize them; history
+    from before the inbox counts as read.
+    """
+    Conversation = apps.get_model('chats', 'Conversation')
+    ConversationMember = apps.get_model('chats', 'ConversationMember')
+    Message = apps.get_model('chats', 'Message')
+
+    keys = Message.objects.order_by().values_list('conversation_key', flat=True).distinct()
+    for key in keys:
+        last = Message.objects.filter(conversation_key=key).order_by('-message_time', '-id').first()
+        conversation = Conversation.objects.filter(key=key).first()
+        if conversation is None:
+            if key.startswith('room:'):
+                continue
+            conversation = Conversation.objects.create(key=key, kind='direct')
+            ConversationMember.objects.bulk_create([
+                ConversationMember(conversation=conversation, user_id=user_id)
+                for user_id in {int(part) for part in key.split(':')}
+            ])
+        Conversation.objects.filter(pk=conversation.pk).update(last_message=last, last_message_time=last.message_time)
+        ConversationMember.objects.filter(conversation=conversation).update(
+            last_message_time=last.message_time, last_read_message_id=last.pk, unread_count=0
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0004_conversations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chats.message'),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_time',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversationmember',
+            name='last_message_time',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='conversationmember',
+            name='last_read_message_id',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='conversationmember',
+            name='unread_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='conversationmember',
+            index=models.Index(fields=['user', 'last_message_time', 'id'], name='chat_members_inbox_idx'),
+        ),
+        migrations.RunPython(backfill_inbox, migrations.RunPython.noop),
+    ]
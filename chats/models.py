@@ -1,13 +1,105 @@
+import uuid
+
 from django.db import models
+from django.utils import timezone
 
 from users.models import CustomUser
 
 
+class Conversation(models.Model):
+    """
+    A direct conversation between two users or a room with any number of members.
+
+    ``key`` is the stable id clients and messages use: ``"<low id>:<high id>"`` for a pair,
+    ``"room:<hex>"`` for a room.
+    """
+    KIND_DIRECT = 'direct'
+    KIND_ROOM = 'room'
+    KIND_CHOICES = (
+        (KIND_DIRECT, 'Direct'),
+        (KIND_ROOM, 'Room'),
+    )
+
+    key = models.CharField(max_length=41, unique=True, editable=False)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default=KIND_ROOM)
+    title = models.CharField(max_length=200, blank=True)
+    members = models.ManyToManyField(CustomUser, through='ConversationMember', related_name='conversations')
+    # Inbox summary, kept up to date as messages are saved
+    last_message = models.ForeignKey(
+        'Message', null=True, blank=True, related_name='+', on_delete=models.SET_NULL, editable=False
+    )
+    last_message_time = models.DateTimeField(null=True, blank=True, editable=False)
+    created_time = models.DateTimeField(auto_now_add=True)
+
+    @staticmethod
+    def direct_key(user_id, other_id):
+        return f'{min(user_id, other_id)}:{max(user_id, other_id)}'
+
+    @staticmethod
+    def direct_participants(key):
+        """
+        The two user ids of a direct conversation key, ``None`` for a room key.
+        """
+        low, sep, high = key.partition(':')
+        if not sep or not low.isdigit() or not high.isdigit():
+            return None
+        return int(low), int(high)
+
+    def save(self, *args, **kwargs):
+        if not self.key:
+            self.key = f'room:{uuid.uuid4().hex}'
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.title or self.key
+
+
+class ConversationMember(models.Model):
+    """
+    A user's entry in a conversation, which is also their inbox row for it.
+
+    ``last_message_time`` copies the conversation's so the inbox is one range scan of
+    ``chat_members_inbox_idx``; it starts at the join time so new conversations sort too.
+    """
+    conversation = models.ForeignKey(Conversation, related_name='memberships', on_delete=models.CASCADE)
+    user = models.ForeignKey(CustomUser, related_name='chat_memberships', on_delete=models.CASCADE)
+    unread_count = models.PositiveIntegerField(default=0, editable=False)
+    last_read_message_id = models.PositiveBigIntegerField(default=0, editable=False)
+    last_message_time = models.DateTimeField(default=timezone.now, editable=False)
+    joined_time = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['conversation', 'user'], name='unique_conversation_member'),
+        ]
+        indexes = [models.Index(fields=['user', 'last_message_time', 'id'], name='chat_members_inbox_idx')]
+
+
 class Message(models.Model):
     sender = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
-    receiver = models.ForeignKey(CustomUser, related_name='messages_received', on_delete=models.CASCADE)
+    # Empty for messages sent to a room
+    receiver = models.ForeignKey(
+        CustomUser, null=True, blank=True, related_name='messages_received', on_delete=models.CASCADE
+    )
+    # The key of the conversation, e.g. "3:8" for both directions of a pair, so history is one index range
+    conversation_key = models.CharField(max_length=41, editable=False)
     content = models.TextField()
-    message_time = models.DateTimeField(auto_now_add=True)
+    # Stamped when the message is received, not when a write-behind batch is saved
+    message_time = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversation_key', 'message_time', 'id'], name='messages_conversation_idx'),
+        ]
+
+    @staticmethod
+    def conversation_key_for(user_id, other_id):
+        return Conversation.direct_key(user_id, other_id)
+
+    def save(self, *args, **kwargs):
+        if self.receiver_id is not None:
+            self.conversation_key = self.conversation_key_for(self.sender_id, self.receiver_id)
+        super().save(*args, **kwargs)
 
     def __str__(self):
-        return f'{self.sender} to {self.receiver}: {self.content[:10]}'
+        return f'{self.sender} to {self.receiver or self.conversation_key}: {self.content[:10]}'
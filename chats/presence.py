@@ -0,0 +1,49 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+def _presence_key(user_id):
+    return f'chat-presence:{user_id}'
+
+
+def _live(devices, now):
+    return {channel: expires for channel, expires in devices.items() if expires > now}
+
+
+def touch(user_id, channel_name):
+    """
+    Mark one device of a user online until ``CHAT_PRESENCE_TIMEOUT`` seconds from now.
+
+    Devices are kept in a single entry per user. Two devices updating it at the same moment
+    can drop one of them, which reappears with that device's next heartbeat.
+    """
+    now = time.time()
+    timeout = settings.CHAT_PRESENCE_TIMEOUT
+    devices = _live(cache.get(_presence_key(user_id)) or {}, now)
+    devices[channel_name] = now + timeout
+    cache.set(_presence_key(user_id), devices, timeout)
+
+
+def leave(user_id, channel_name):
+    now = time.time()
+    devices = _live(cache.get(_presence_key(user_id)) or {}, now)
+    devices.pop(channel_name, None)
+    if devices:
+        cache.set(_presence_key(user_id), devices, max(devices.values()) - now)
+    else:
+        cache.delete(_presence_key(user_id))
+
+
+def online_devices(user_id):
+    """
+    Channel names of a user's devices whose last heartbeat has not expired.
+    """
+    return sorted(_live(cache.get(_presence_key(user_id)) or {}, time.time()))
+
+
+def online_user_ids(user_ids):
+    now = time.time()
+    entries = cache.get_many([_presence_key(user_id) for user_id in user_ids])
+    return {user_id for user_id in user_ids if _live(entries.get(_presence_key(user_id)) or {}, now)}
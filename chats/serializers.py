@@ -0,0 +1,39 @@
+from rest_framework import serializers
+
+from .models import Conversation, ConversationMember, Message
+
+
+class MessageSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Message
+        fields = ('id', 'sender', 'receiver', 'content', 'message_time')
+
+
+class InboxEntrySerializer(serializers.ModelSerializer):
+    conversation = serializers.CharField(source='conversation.key')
+    kind = serializers.CharField(source='conversation.kind')
+    title = serializers.CharField(source='conversation.title')
+    peer = serializers.SerializerMethodField()
+    last_message = MessageSerializer(source='conversation.last_message', allow_null=True)
+
+    class Meta:
+        model = ConversationMember
+        fields = (
+            'conversation', 'kind', 'title', 'peer', 'last_message', 'last_message_time',
+            'unread_count', 'last_read_message_id',
+        )
+
+    def get_peer(self, member):
+        """
+        The other user of a direct conversation, from the ``peers`` the view loaded for the page.
+        """
+        pair = Conversation.direct_participants(member.conversation.key)
+        if pair is None:
+            return None
+        peer = self.context.get('peers', {}).get(pair[1] if pair[0] == member.user_id else pair[0])
+        return {'id': peer.id, 'username': peer.username} if peer else None
+
+
+class ReadMarkSerializer(serializers.Serializer):
+    conversation = serializers.CharField(max_length=41)
+    message_id = serializers.IntegerField(min_value=1)
@@ -0,0 +1,59 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from users.models import CustomUser
+
+from .conversations import invalidate_participants
+from .identity import invalidate_chat_user
+from .inbox import record_messages
+from .models import Conversation, ConversationMember, Message
+
+
+@receiver([post_save, post_delete], sender=CustomUser, dispatch_uid='chats.invalidate_chat_user')
+def user_changed(sender, instance, **kwargs):
+    # Again on commit, so a connect racing the open transaction cannot re-cache the old name
+    user_id = instance.pk
+    invalidate_chat_user(user_id)
+    transaction.on_commit(lambda: invalidate_chat_user(user_id))
+
+
+def _invalidate_participants(key):
+    invalidate_participants(key)
+    transaction.on_commit(lambda: invalidate_participants(key))
+
+
+@receiver(post_save, sender=ConversationMember, dispatch_uid='chats.member_saved')
+@receiver(pre_delete, sender=ConversationMember, dispatch_uid='chats.member_deleted')
+def member_changed(sender, instance, **kwargs):
+    _invalidate_participants(instance.conversation.key)
+
+
+@receiver(m2m_changed, sender=Conversation.members.through, dispatch_uid='chats.members_changed')
+def members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # members.add()/remove()/clear() bypass ConversationMember's save and delete signals
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            _invalidate_participants(instance.key)
+        return
+    # user.conversations.*: pk_set holds conversation ids, except for clear
+    if action == 'pre_clear':
+        instance._cleared_conversation_keys = list(instance.conversations.values_list('key', flat=True))
+    elif action == 'post_clear':
+        for key in getattr(instance, '_cleared_conversation_keys', ()):
+            _invalidate_participants(key)
+    elif action in ('post_add', 'post_remove') and pk_set:
+        for key in Conversation.objects.filter(pk__in=pk_set).values_list('key', flat=True):
+            _invalidate_participants(key)
+
+
+@receiver(pre_delete, sender=Conversation, dispatch_uid='chats.conversation_deleted')
+def conversation_deleted(sender, instance, **kwargs):
+    _invalidate_participants(instance.key)
+
+
+@receiver(post_save, sender=Message, dispatch_uid='chats.message_saved')
+def message_saved(sender, instance, created, **kwargs):
+    # bulk_create sends no signal, so the write-behind buffer records its batches itself
+    if created:
+        record_messages([instance])
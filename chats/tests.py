@@ -1,3 +1,896 @@
-from django.test import TestCase
+import asyncio
+import functools
+import io
+import json
+import time
+from unittest import mock
+from datetime import timedelta
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from rest_framework_simplejwt.tokens import AccessToken
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from OnlineLearning_Platform import metrics
+
+from . import presence
+from .benchmark import percentiles
+from .buffer import message_buffer
+from .conversations import cached_participants, load_participants, user_group
+from .layers import HashRing, MemoryChannelLayer, ShardedChannelLayer
+from .limits import Outbox, TokenBucket, transport_buffer
+from .models import Conversation, ConversationMember, Message
+from .routing import websocket_urlpatterns
+from users.models import CustomUser
+
+
+IN_MEMORY_LAYERS = {'default': {'BACKEND': 'chats.layers.MemoryChannelLayer'}}
+SHARDED_LAYERS = {'default': {
+    'BACKEND': 'chats.layers.ShardedChannelLayer',
+    'CONFIG': {'shards': [{'BACKEND': 'chats.layers.MemoryChannelLayer'} for _ in range(3)]},
+}}
+
+
+def chat_communicator(user, username, token=None):
+    token = token or str(AccessToken.for_user(user))
+    return WebsocketCommunicator(
+        URLRouter(websocket_urlpatterns), f'/ws/chat/?username={username}',
+        headers=[(b'authorization', f'Bearer {token}'.encode())],
+    )
+
+
+class ConversationHistoryTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(username='alice', email='alice@gmail.com', password='testpassword')
+        self.other = CustomUser.objects.create_user(username='bob', email='bob@gmail.com', password='testpassword')
+        self.third = CustomUser.objects.create_user(username='carol', email='carol@gmail.com', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        self.url = '/chats/bob/messages/'
+
+        start = timezone.now() - timedelta(hours=1)
+        for i in range(7):
+            sender, receiver = (self.user, self.other) if i % 2 == 0 else (self.other, self.user)
+            message = Message.objects.create(sender=sender, receiver=receiver, content=f'Message {i}')
+            # Two messages share each timestamp so the id has to break ties
+            Message.objects.filter(pk=message.pk).update(message_time=start + timedelta(minutes=i // 2))
+        Message.objects.create(sender=self.user, receiver=self.third, content='Elsewhere')
+
+    def test_conversation_key_is_symmetric(self):
+        print('Testing conversation key')
+        keys = set(Message.objects.filter(content__startswith='Message').values_list('conversation_key', flat=True))
+        self.assertEqual(keys, {Message.conversation_key_for(self.other.pk, self.user.pk)})
+
+    def test_pages_newest_first(self):
+        print('Testing chat history pages')
+        seen = []
+        url = f'{self.url}?page_size=3'
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append(response.json())
+            seen += [item['content'] for item in pages[-1]['results']]
+            url = pages[-1]['next']
+
+        self.assertEqual(seen, [f'Message {i}' for i in reversed(range(7))])
+        self.assertIn('before=', pages[0]['next'])
+        response = self.client.get(pages[2]['previous'])
+        self.assertEqual([item['content'] for item in response.json()['results']], ['Message 3', 'Message 2', 'Message 1'])
+
+    def test_same_history_from_both_sides(self):
+        print('Testing chat history from the other side')
+        self.client.force_authenticate(user=self.other)
+        response = self.client.get('/chats/alice/messages/')
+        self.assertEqual(len(response.json()['results']), 7)
+
+    def test_page_uses_conversation_index(self):
+        print('Testing chat history query plan')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+        sql = next(query['sql'] for query in queries if 'chats_message' in query['sql'])
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+        self.assertIn('messages_conversation_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_unknown_user(self):
+        print('Testing chat history with an unknown user')
+        response = self.client.get('/chats/nobody/messages/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS, CHAT_WRITE_BEHIND=True, CHAT_WRITE_BEHIND_BATCH_SIZE=3, CHAT_WRITE_BEHIND_INTERVAL=60)
+class WriteBehindTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.sender = CustomUser.objects.create_user(username='alice', email='alice@gmail.com', password='testpassword')
+        self.receiver = CustomUser.objects.create_user(username='bob', email='bob@gmail.com', password='testpassword')
+        self.refs = []
+        self.saved = []
+
+    @async_to_sync
+    async def chat(self, count, check=None):
+        listener = chat_communicator(self.receiver, 'bob')
+        talker = chat_communicator(self.sender, 'bob')
+        self.assertTrue((await listener.connect())[0])
+        self.assertTrue((await talker.connect())[0])
+
+        for i in range(count):
+            await talker.send_to(text_data=json.dumps({'message': f'Hello {i}'}))
+            received = json.loads(await listener.receive_from())
+            while received.get('type') == 'saved':
+                self.saved.append(received)
+                received = json.loads(await listener.receive_from())
+            self.assertEqual(received, {
+                'id': None, 'ref': received['ref'], 'message': f'Hello {i}', 'sender': 'alice',
+                'conversation': Message.conversation_key_for(self.sender.pk, self.receiver.pk),
+                'message_time': received['message_time'],
+            })
+            self.refs.append(received['ref'])
+        if check:
+            await check()
+
+        await talker.disconnect()
+        await listener.disconnect()
+
+    def test_delivers_before_persisting_and_flushes_on_disconnect(self):
+        print('Testing chat write-behind flush on disconnect')
+
+        async def nothing_saved_yet():
+            self.assertEqual(message_buffer.depth, 2)
+            self.assertEqual(metrics.get_value('chat_write_buffer_depth'), 2)
+            self.assertEqual(await Message.objects.acount(), 0)
+
+        self.chat(2, check=nothing_saved_yet)
+        self.assertEqual(message_buffer.depth, 0)
+        self.assertEqual(
+            list(Message.objects.order_by('id').values_list('content', flat=True)), ['Hello 0', 'Hello 1']
+        )
+        self.assertEqual(metrics.get_value('chat_messages_persisted_total'), 2)
+
+    def test_flushes_full_batches(self):
+        print('Testing chat write-behind batch size')
+
+        async def first_batch_saved():
+            self.assertEqual(await Message.objects.acount(), 3)
+            self.assertEqual(message_buffer.depth, 1)
+
+        self.chat(4, check=first_batch_saved)
+        self.assertEqual(metrics.get_value('chat_write_batch_size_count'), 2)
+        # Devices that got the first batch without ids learn them once it is saved
+        ids = list(Message.objects.order_by('id').values_list('id', flat=True)[:3])
+        self.assertEqual(len(self.saved), 1)
+        self.assertEqual(self.saved[0]['messages'], [{'ref': ref, 'id': pk} for ref, pk in zip(self.refs, ids)])
+        message = Message.objects.first()
+        self.assertEqual(message.conversation_key, Message.conversation_key_for(self.sender.pk, self.receiver.pk))
+
+    def test_flushes_after_interval(self):
+        print('Testing chat write-behind interval')
+
+        async def saved_by_timer():
+            await asyncio.sleep(0.1)
+            self.assertEqual(await Message.objects.acount(), 1)
+
+        with self.settings(CHAT_WRITE_BEHIND_INTERVAL=0.01):
+            self.chat(1, check=saved_by_timer)
+
+    def test_failed_batch_is_kept(self):
+        print('Testing chat write-behind retry after a failed batch')
+        message_buffer._pending.append(Message(sender=self.sender, receiver=self.receiver, content='Kept'))
+        with mock.patch.object(Message.objects, 'bulk_create', side_effect=OperationalError('database is locked')), \
+                self.assertLogs('chats.buffer', 'ERROR'):
+            message_buffer.flush_sync()
+        self.assertEqual(message_buffer.depth, 1)
+        self.assertEqual(metrics.get_value('chat_write_failures_total'), 1)
+
+        message_buffer.flush_sync()
+        self.assertEqual(Message.objects.get().content, 'Kept')
+
+    def test_unwritable_message_is_dropped(self):
+        print('Testing chat write-behind with a message that cannot be written')
+        bulk_create = Message.objects.bulk_create
+
+        def reject_bad(messages):
+            if any(message.content == 'Bad' for message in messages):
+                raise IntegrityError('FOREIGN KEY constraint failed')
+            return bulk_create(messages)
+
+        message_buffer._pending.extend(
+            Message(sender=self.sender, receiver=self.receiver, content=content) for content in ('One', 'Bad', 'Two')
+        )
+        with mock.patch.object(Message.objects, 'bulk_create', side_effect=reject_bad), \
+                self.assertLogs('chats.buffer', 'ERROR'):
+            message_buffer.flush_sync()
+        self.assertEqual(message_buffer.depth, 0)
+        self.assertEqual(list(Message.objects.order_by('id').values_list('content', flat=True)), ['One', 'Two'])
+        self.assertEqual(metrics.get_value('chat_messages_dropped_total'), 1)
+        self.assertEqual(metrics.get_value('chat_messages_persisted_total'), 2)
+
+    @override_settings(CHAT_WRITE_BEHIND_MAX_DEPTH=2)
+    def test_requeued_messages_are_capped(self):
+        print('Testing chat write-behind buffer cap')
+        message_buffer._pending.extend(
+            Message(sender=self.sender, receiver=self.receiver, content=str(i)) for i in range(3)
+        )
+        with mock.patch.object(Message.objects, 'bulk_create', side_effect=OperationalError), \
+                self.assertLogs('chats.buffer', 'ERROR'):
+            message_buffer.flush_sync()
+        self.assertEqual([message.content for message in message_buffer._pending], ['1', '2'])
+        self.assertEqual(metrics.get_value('chat_messages_dropped_total'), 1)
+        message_buffer.flush_sync()
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class ConnectTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='alice', email='alice@gmail.com', password='testpassword')
+        self.other = CustomUser.objects.create_user(username='bob', email='bob@gmail.com', password='testpassword')
+        self.token = str(AccessToken.for_user(self.user))
+
+    @async_to_sync
+    async def connect(self, username='bob', token=None):
+        communicator = chat_communicator(self.user, username, token=token or self.token)
+        connected, _ = await communicator.connect()
+        await communicator.disconnect()
+        return connected
+
+    def test_warm_reconnect_makes_no_queries(self):
+        print('Testing chat reconnect without queries')
+        self.assertTrue(self.connect())
+        with CaptureQueriesContext(connection) as queries, mock.patch('chats.identity.jwt.decode') as decode:
+            self.assertTrue(self.connect())
+        self.assertEqual(len(queries), 0)
+        decode.assert_not_called()
+
+    def test_renamed_user_is_not_found_by_old_name(self):
+        print('Testing chat identity cache invalidation')
+        self.assertTrue(self.connect())
+        self.other.username = 'robert'
+        self.other.save()
+
+        self.assertFalse(self.connect('bob'))
+        self.assertTrue(self.connect('robert'))
+
+    def test_deleted_user_cannot_connect(self):
+        print('Testing chat connect after the user is deleted')
+        self.assertTrue(self.connect())
+        self.user.delete()
+        self.assertFalse(self.connect())
+
+    def test_invalid_token(self):
+        print('Testing chat connect with an invalid token')
+        self.assertFalse(self.connect(token='not-a-token'))
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class ConversationDeliveryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = CustomUser.objects.create_user(username='alice', email='alice@gmail.com', password='testpassword')
+        self.bob = CustomUser.objects.create_user(username='bob', email='bob@gmail.com', password='testpassword')
+        self.carol = CustomUser.objects.create_user(username='carol', email='carol@gmail.com', password='testpassword')
+
+    @async_to_sync
+    async def run_devices(self, devices, scenario):
+        for device in devices:
+            connected, _ = await device.connect()
+            self.assertTrue(connected)
+        try:
+            await scenario()
+        finally:
+            for device in devices:
+                await device.disconnect()
+
+    def test_each_device_gets_a_message_once(self):
+        print('Testing chat delivery to every device once')
+        phone, laptop = chat_communicator(self.alice, 'bob'), chat_communicator(self.alice, 'bob')
+        bob = chat_communicator(self.bob, 'alice')
+        carol = chat_communicator(self.carol, 'alice')
+
+        frames = []
+
+        async def scenario():
+            await phone.send_to(text_data=json.dumps({'message': 'Hi Bob'}))
+            for device in (phone, laptop, bob):
+                received = json.loads(await device.receive_from())
+                self.assertEqual(received['message'], 'Hi Bob')
+                self.assertEqual(received['conversation'], Conversation.direct_key(self.alice.pk, self.bob.pk))
+                self.assertTrue(await device.receive_nothing())
+                frames.append(received)
+            self.assertTrue(await carol.receive_nothing())
+
+        self.run_devices([phone, laptop, bob, carol], scenario)
+        message = Message.objects.get()
+        self.assertEqual(message.receiver, self.bob)
+        # Live frames carry what the read receipts and history are keyed by
+        self.assertEqual({(frame['id'], frame['message_time']) for frame in frames}, {(message.pk, message.message_time.isoformat())})
+        conversation = Conversation.objects.get(key=Conversation.direct_key(self.alice.pk, self.bob.pk))
+        self.assertEqual(set(conversation.members.all()), {self.alice, self.bob})
+
+    def test_delivery_over_sharded_layer(self):
+        print('Testing chat delivery over a sharded channel layer')
+        with self.settings(CHANNEL_LAYERS=SHARDED_LAYERS):
+            devices = [chat_communicator(self.alice, 'bob') for _ in range(4)] + [chat_communicator(self.bob, 'alice')]
+
+            async def scenario():
+                self.assertIsInstance(get_channel_layer(), ShardedChannelLayer)
+                await devices[0].send_to(text_data=json.dumps({'message': 'Sharded'}))
+                for device in devices:
+                    self.assertEqual(json.loads(await device.receive_from())['message'], 'Sharded')
+                    self.assertTrue(await device.receive_nothing())
+
+            self.run_devices(devices, scenario)
+
+    def test_room_conversation(self):
+        print('Testing chat room delivery')
+        room = Conversation.objects.create(title='Study group')
+        for user in (self.alice, self.bob):
+            ConversationMember.objects.create(conversation=room, user=user)
+
+        alice = chat_communicator(self.alice, '')
+        alice.scope['query_string'] = f'conversation={room.key}'.encode()
+        bob = chat_communicator(self.bob, 'carol')
+
+        async def scenario():
+            # Bob's device talks to Carol by default but still receives the room
+            await alice.send_to(text_data=json.dumps({'message': 'Hello room'}))
+            for device in (alice, bob):
+                self.assertEqual(json.loads(await device.receive_from())['conversation'], room.key)
+            await bob.send_to(text_data=json.dumps({'message': 'Hi', 'conversation': room.key}))
+            self.assertEqual(json.loads(await alice.receive_from())['message'], 'Hi')
+
+        self.run_devices([alice, bob], scenario)
+        self.assertEqual(Message.objects.filter(conversation_key=room.key, receiver__isnull=True).count(), 2)
+
+    def test_non_member_cannot_use_room(self):
+        print('Testing chat room membership')
+        room = Conversation.objects.create(title='Private')
+        ConversationMember.objects.create(conversation=room, user=self.alice)
+        carol = chat_communicator(self.carol, '')
+        carol.scope['query_string'] = f'conversation={room.key}'.encode()
+
+        @async_to_sync
+        async def connect():
+            connected, _ = await carol.connect()
+            await carol.disconnect()
+            return connected
+
+        self.assertFalse(connect())
+
+    def test_members_add_and_remove_clear_participants(self):
+        print('Testing participant cache after members.add/remove')
+        room = Conversation.objects.create(title='Study group')
+        room.members.add(self.alice)
+        self.assertEqual(load_participants(room.key), (self.alice.pk,))
+        room.members.add(self.bob)
+        self.assertIsNone(cached_participants(room.key))
+        self.assertEqual(load_participants(room.key), (self.alice.pk, self.bob.pk))
+        self.bob.conversations.remove(room)
+        self.assertIsNone(cached_participants(room.key))
+        load_participants(room.key)
+        self.alice.conversations.clear()
+        self.assertIsNone(cached_participants(room.key))
+
+    def test_membership_changes_apply_to_open_connections(self):
+        print('Testing room membership changes while connected')
+        room = Conversation.objects.create(title='Study group')
+        room.members.add(self.alice, self.bob)
+        alice = chat_communicator(self.alice, '')
+        alice.scope['query_string'] = f'conversation={room.key}'.encode()
+        bob = chat_communicator(self.bob, '')
+        bob.scope['query_string'] = f'conversation={room.key}'.encode()
+        carol = chat_communicator(self.carol, 'alice')
+
+        async def scenario():
+            await sync_to_async(room.members.add)(self.carol)
+            await sync_to_async(room.members.remove)(self.bob)
+            await alice.send_to(text_data=json.dumps({'message': 'Welcome Carol'}))
+            self.assertEqual(json.loads(await alice.receive_from())['message'], 'Welcome Carol')
+            self.assertEqual(json.loads(await carol.receive_from())['conversation'], room.key)
+            self.assertTrue(await bob.receive_nothing())
+            await bob.send_to(text_data=json.dumps({'message': 'Still here?'}))
+            self.assertEqual(json.loads(await bob.receive_from())['error'], 'Unknown conversation.')
+
+        self.run_devices([alice, bob, carol], scenario)
+
+    def test_invalid_conversation_in_frame(self):
+        print('Testing chat frame with an invalid conversation')
+        alice = chat_communicator(self.alice, 'bob')
+
+        async def scenario():
+            for key in ([], {'a': 1}, 5):
+                await alice.send_to(text_data=json.dumps({'message': 'Hi', 'conversation': key}))
+                self.assertEqual(json.loads(await alice.receive_from())['error'], 'Unknown conversation.')
+            # The connection is still usable
+            await alice.send_to(text_data=json.dumps({'message': 'Hi'}))
+            self.assertEqual(json.loads(await alice.receive_from())['message'], 'Hi')
+
+        self.run_devices([alice], scenario)
+        self.assertEqual(Message.objects.count(), 1)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class PresenceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = CustomUser.objects.create_user(username='alice', email='alice@gmail.com', password='testpassword')
+        self.bob = CustomUser.objects.create_user(username='bob', email='bob@gmail.com', password='testpassword')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.bob)
+
+    def test_presence_follows_connections(self):
+        print('Testing chat presence')
+        device = chat_communicator(self.alice, 'bob')
+
+        @async_to_sync
+        async def connect_and_leave():
+            self.assertTrue((await device.connect())[0])
+            devices = presence.online_devices(self.alice.pk)
+            await device.disconnect()
+            return devices
+
+        self.assertEqual(len(connect_and_leave()), 1)
+        self.assertEqual(presence.online_devices(self.alice.pk), [])
+
+    def test_presence_endpoint(self):
+        print('Testing chat presence endpoint')
+        presence.touch(self.alice.pk, 'device-1')
+        response = self.client.get('/chats/presence/', {'username': ['alice', 'bob', 'nobody']})
+        self.assertEqual(response.json(), {'alice': True, 'bob': False, 'nobody': False})
+
+    def test_presence_expires_without_heartbeat(self):
+        print('Testing chat presence expiry')
+        presence.touch(self.alice.pk, 'device-1')
+        self.assertEqual(presence.online_user_ids([self.alice.pk]), {self.alice.pk})
+        with mock.patch('chats.presence.time.time', return_value=time.time() + settings.CHAT_PRESENCE_TIMEOUT + 1):
+            self.assertEqual(presence.online_user_ids([self.alice.pk]), set())
+
+
+class MemoryChannelLayerTests(TestCase):
+    def setUp(self):
+        self.layer = MemoryChannelLayer(expiry=60, capacity=2, group_capacity=3)
+
+    @async_to_sync
+    async def test_send_and_receive(self):
+        print('Testing memory channel layer send and receive')
+        channel = await self.layer.new_channel()
+        waiting = asyncio.ensure_future(self.layer.receive(channel))
+        await asyncio.sleep(0)
+        await self.layer.send(channel, {'type': 'test.message', 'n': 1})
+        self.assertEqual(await waiting, {'type': 'test.message', 'n': 1})
+
+        await self.layer.send(channel, {'type': 'test.message', 'n': 2})
+        await self.layer.send(channel, {'type': 'test.message', 'n': 3})
+        with self.assertRaises(ChannelFull):
+            await self.layer.send(channel, {'type': 'test.message', 'n': 4})
+        self.assertEqual((await self.layer.receive(channel))['n'], 2)
+
+    @async_to_sync
+    async def test_expiry_drops_messages_and_memberships(self):
+        print('Testing memory channel layer expiry')
+        await self.layer.group_add('room', 'one')
+        await self.layer.group_send('room', {'type': 'test.message'})
+        with mock.patch('chats.layers.time.time', return_value=time.time() + 61):
+            await self.layer.group_send('room', {'type': 'test.message', 'late': True})
+        # The unread message expired, so the channel left the group and missed the second one
+        self.assertEqual(self.layer.groups, {})
+        self.assertNotIn('one', self.layer.channels)
+
+    @async_to_sync
+    async def test_group_capacity(self):
+        print('Testing memory channel layer group capacity')
+        for name in ('one', 'two', 'three'):
+            await self.layer.group_add('room', name)
+        with self.assertRaises(ChannelFull):
+            await self.layer.group_add('room', 'four')
+        await self.layer.group_add('room', 'one')
+
+    @async_to_sync
+    async def test_group_send_skips_full_channels(self):
+        print('Testing memory channel layer group send to a full channel')
+        metrics.reset()
+        await self.layer.group_add('room', 'one')
+        await self.layer.group_add('room', 'two')
+        for _ in range(2):
+            await self.layer.send('one', {'type': 'test.message'})
+        await self.layer.group_send('room', {'type': 'test.message', 'group': True})
+        self.assertTrue((await self.layer.receive('two'))['group'])
+        self.assertEqual(metrics.get_value('channel_layer_dropped_total'), 1)
+
+
+class ShardedChannelLayerTests(TestCase):
+    def setUp(self):
+        self.layer = ShardedChannelLayer(shards=[{'BACKEND': 'chats.layers.MemoryChannelLayer'} for _ in range(4)])
+
+    @async_to_sync
+    async def test_channels_are_spread_and_routed(self):
+        print('Testing sharded channel layer routing')
+        channels = [await self.layer.new_channel() for _ in range(40)]
+        self.assertEqual(len({self.layer.route(channel)[0] for channel in channels}), 4)
+
+        for channel in channels[:5]:
+            await self.layer.send(channel, {'type': 'test.message', 'to': channel})
+            self.assertEqual((await self.layer.receive(channel))['to'], channel)
+
+        # Named channels always land on the same shard
+        self.assertEqual(self.layer.route('thumbnails')[0], self.layer.route('thumbnails')[0])
+
+    @async_to_sync
+    async def test_group_send_reaches_members_on_every_shard(self):
+        print('Testing sharded channel layer groups')
+        channels = [await self.layer.new_channel() for _ in range(12)]
+        for channel in channels:
+            await self.layer.group_add('room', channel)
+        await self.layer.group_discard('room', channels[0])
+        await self.layer.group_send('room', {'type': 'test.message'})
+
+        for channel in channels[1:]:
+            self.assertEqual(await self.layer.receive(channel), {'type': 'test.message'})
+        shard, name = self.layer.route(channels[0])
+        self.assertNotIn(name, self.layer.shards[shard].channels)
+
+    @async_to_sync
+    async def test_group_lives_on_one_shard(self):
+        print('Testing sharded channel layer group placement')
+        channels = [await self.layer.new_channel() for _ in range(12)]
+        for channel in channels:
+            await self.layer.group_add('room', channel)
+        home = self.layer.group_shard('room')
+        for shard in self.layer.shards:
+            self.assertEqual('room' in shard.groups, shard is home)
+
+        # Only the group's shard is asked for members; the rest just receive the messages
+        with mock.patch.object(MemoryChannelLayer, 'group_channels', autospec=True,
+                               side_effect=MemoryChannelLayer.group_channels) as lookup:
+            await self.layer.group_send('room', {'type': 'test.message'})
+        self.assertEqual([call.args[0] for call in lookup.call_args_list], [home])
+        for channel in channels:
+            self.assertEqual(await self.layer.receive(channel), {'type': 'test.message'})
+
+    def test_hash_ring_moves_few_keys(self):
+        print('Testing consistent hash ring')
+        keys = [f'group-{i}' for i in range(2000)]
+        before = HashRing(range(4))
+        after = HashRing(range(5))
+        moved = sum(before.get(key) != after.get(key) for key in keys)
+        self.assertLess(moved, len(keys) * 0.35)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class InboxTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.alice = CustomUser.objects.create_user(username='alice', email='alice@gmail.com', password='testpassword')
+        self.bob = CustomUser.objects.create_user(username='bob', email='bob@gmail.com', password='testpassword')
+        self.carol = CustomUser.objects.create_user(username='carol', email='carol@gmail.com', password='testpassword')
+        self.client.force_authenticate(user=self.bob)
+
+        self.from_alice = [
+            Message.objects.create(sender=self.alice, receiver=self.bob, content=f'Hi {i}') for i in range(3)
+        ]
+        self.from_carol = Message.objects.create(sender=self.carol, receiver=self.bob, content='Hey')
+        self.alice_key = Conversation.direct_key(self.alice.pk, self.bob.pk)
+        self.carol_key = Conversation.direct_key(self.carol.pk, self.bob.pk)
+
+    def unread(self, user, key):
+        return ConversationMember.objects.get(user=user, conversation__key=key).unread_count
+
+    def test_summary_is_maintained_on_save(self):
+        print('Testing inbox summary on message save')
+        conversation = Conversation.objects.get(key=self.alice_key)
+        self.assertEqual(conversation.last_message, self.from_alice[-1])
+        self.assertEqual(self.unread(self.bob, self.alice_key), 3)
+        self.assertEqual(self.unread(self.alice, self.alice_key), 0)
+
+        reply = Message.objects.create(sender=self.bob, receiver=self.alice, content='Hello')
+        self.assertEqual(self.unread(self.bob, self.alice_key), 3)
+        self.assertEqual(self.unread(self.alice, self.alice_key), 1)
+        self.assertEqual(Conversation.objects.get(key=self.alice_key).last_message, reply)
+
+    def test_inbox_lists_latest_first(self):
+        print('Testing inbox list')
+        self.client.get('/chats/inbox/')
+        with self.assertNumQueries(1):
+            response = self.client.get('/chats/inbox/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        results = response.json()['results']
+        self.assertEqual([entry['conversation'] for entry in results], [self.carol_key, self.alice_key])
+        self.assertEqual(results[0]['peer'], {'id': self.carol.pk, 'username': 'carol'})
+        self.assertEqual(results[0]['last_message']['content'], 'Hey')
+        self.assertEqual(results[1]['unread_count'], 3)
+
+    def test_inbox_uses_index(self):
+        print('Testing inbox query plan')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/chats/inbox/')
+        sql = next(query['sql'] for query in queries if 'chats_conversationmember' in query['sql'])
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+        self.assertIn('chat_members_inbox_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_mark_read_in_batches(self):
+        print('Testing batched mark read')
+        response = self.client.post('/chats/inbox/read/', [
+            {'conversation': self.alice_key, 'message_id': self.from_alice[1].pk},
+            {'conversation': self.carol_key, 'message_id': self.from_carol.pk},
+            {'conversation': self.alice_key, 'message_id': self.from_alice[0].pk},
+            {'conversation': 'room:unknown', 'message_id': self.from_carol.pk},
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['unread'], {self.alice_key: 1, self.carol_key: 0, 'room:unknown': None})
+
+        # Marks only move forward
+        self.client.post('/chats/inbox/read/', {'conversation': self.alice_key, 'message_id': self.from_alice[0].pk}, format='json')
+        self.assertEqual(self.unread(self.bob, self.alice_key), 1)
+        member = ConversationMember.objects.get(user=self.bob, conversation__key=self.alice_key)
+        self.assertEqual(member.last_read_message_id, self.from_alice[1].pk)
+
+    def test_cannot_mark_other_conversations(self):
+        print('Testing mark read outside your conversations')
+        self.client.force_authenticate(user=self.carol)
+        response = self.client.post(
+            '/chats/inbox/read/', {'conversation': self.alice_key, 'message_id': self.from_alice[2].pk}, format='json'
+        )
+        self.assertEqual(response.json()['unread'], {self.alice_key: None})
+        self.assertEqual(self.unread(self.bob, self.alice_key), 3)
+
+    def test_write_behind_batches_update_the_inbox(self):
+        print('Testing inbox with write-behind batches')
+        for i in range(2):
+            message_buffer._pending.append(Message(
+                sender=self.carol, receiver=self.bob, conversation_key=self.carol_key, content=f'Later {i}'
+            ))
+        message_buffer.flush_sync()
+        self.assertEqual(self.unread(self.bob, self.carol_key), 3)
+        self.assertEqual(Conversation.objects.get(key=self.carol_key).last_message.content, 'Later 1')
+
+    def test_read_receipt_reaches_sender_devices(self):
+        print('Testing read receipts')
+        device = chat_communicator(self.alice, 'bob')
+
+        @async_to_sync
+        async def scenario():
+            self.assertTrue((await device.connect())[0])
+            await sync_to_async(self.client.post)(
+                '/chats/inbox/read/', {'conversation': self.alice_key, 'message_id': self.from_alice[2].pk}, format='json'
+            )
+            receipt = json.loads(await device.receive_from())
+            await device.disconnect()
+            return receipt
+
+        self.assertEqual(scenario(), {
+            'type': 'read', 'conversation': self.alice_key, 'user': 'bob', 'message_id': self.from_alice[2].pk,
+        })
+
+
+class BenchmarkTests(TestCase):
+
+    def run_benchmark(self, **options):
+        out = io.StringIO()
+        call_command('chat_benchmark', stdout=out, **options)
+        return json.loads(out.getvalue())
+
+    def test_percentiles(self):
+        print('Testing benchmark percentiles')
+        self.assertEqual(percentiles([]), {'p50': None, 'p95': None, 'p99': None, 'max': None})
+        result = percentiles([i / 1000 for i in range(1, 101)])
+        self.assertEqual(result, {'p50': 50.0, 'p95': 95.0, 'p99': 99.0, 'max': 100.0})
+
+    def test_in_process_benchmark(self):
+        print('Testing chat benchmark command')
+        report = self.run_benchmark(pairs=2, messages=5)
+        self.assertEqual(report['mode'], 'in-process')
+        self.assertEqual((report['sent'], report['delivered'], report['lost']), (10, 10, 0))
+        self.assertEqual(report['messages_persisted'], 10)
+        self.assertIsNotNone(report['delivery_latency_ms']['p99'])
+        self.assertIsNotNone(report['connect_latency_ms']['p50'])
+        self.assertGreaterEqual(report['db_writes'], 10)
+        # The benchmark users are removed afterwards
+        self.assertFalse(CustomUser.objects.filter(username__startswith='bench-').exists())
+        self.assertFalse(Message.objects.exists())
+
+    def test_benchmark_with_write_behind(self):
+        print('Testing chat benchmark command with write-behind')
+        report = self.run_benchmark(pairs=2, messages=5, write_behind=True, rate=500)
+        self.assertTrue(report['write_behind'])
+        self.assertEqual(report['delivered'], 10)
+        self.assertEqual(report['messages_persisted'], 10)
+        # One batch instead of a write (and an inbox update) per message
+        self.assertLess(report['db_writes'], 10)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class RateLimitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.alice = CustomUser.objects.create_user(username='alice', email='alice@gmail.com', password='testpassword')
+        self.bob = CustomUser.objects.create_user(username='bob', email='bob@gmail.com', password='testpassword')
+
+    def test_token_bucket(self):
+        print('Testing token bucket')
+        bucket = TokenBucket(2, 3, stamp=0)
+        self.assertEqual([bucket.take(0) for _ in range(4)], [True, True, True, False])
+        self.assertEqual(bucket.retry_after, 0.5)
+        self.assertTrue(bucket.take(0.5))
+        self.assertFalse(bucket.take(0.5))
+
+    def test_outbox_coalesces_and_bounds_frames(self):
+        print('Testing bounded outbox')
+        outbox = Outbox(None, 2)
+        self.assertTrue(outbox.put('a'))
+        self.assertTrue(outbox.put('read 1', coalesce='read'))
+        self.assertTrue(outbox.put('read 2', coalesce='read'))
+        self.assertFalse(outbox.put('b'))
+        self.assertEqual([frame for _, frame in outbox.frames], ['a', 'read 2'])
+
+        outbox = Outbox(None, 2, drop_oldest=True)
+        outbox.put('read 1', coalesce='read')
+        outbox.put('a')
+        self.assertFalse(outbox.put('b'))
+        self.assertEqual([frame for _, frame in outbox.frames], ['a', 'b'])
+        # The dropped receipt no longer absorbs newer ones
+        outbox.put('read 2', coalesce='read')
+        self.assertEqual([frame for _, frame in outbox.frames], ['b', 'read 2'])
+
+    def test_outbox_waits_for_the_transport(self):
+        print('Testing outbox holds frames while the transport is backed up')
+        sent, backlog = [], [1000]
+
+        async def send(text_data):
+            sent.append(text_data)
+
+        @async_to_sync
+        async def scenario():
+            outbox = Outbox(send, 2, buffered=lambda: backlog[0], max_buffered=100)
+            writer = asyncio.ensure_future(outbox.run())
+            results = [outbox.put(frame) for frame in 'abc']
+            await asyncio.sleep(0.1)
+            held = list(sent)
+            backlog[0] = 0
+            await asyncio.sleep(0.1)
+            writer.cancel()
+            return results, held
+
+        results, held = scenario()
+        self.assertEqual((results, held, sent), ([True, True, False], [], ['a', 'b']))
+
+    def test_outbox_send_timeout(self):
+        print('Testing outbox counts a blocked send as a slow client')
+        blocked = asyncio.Event()
+
+        async def send(text_data):
+            await blocked.wait()
+
+        @async_to_sync
+        async def scenario():
+            outbox = Outbox(send, 10, send_timeout=0.05)
+            writer = asyncio.ensure_future(outbox.run())
+            results = [outbox.put('a'), outbox.put('b')]
+            await asyncio.sleep(0.1)
+            results.append(outbox.put('c'))
+            writer.cancel()
+            return results
+
+        self.assertEqual(scenario(), [True, True, False])
+
+    def test_transport_buffer(self):
+        print('Testing unwritten bytes are read from the Daphne transport')
+        transport = mock.Mock(spec=['dataBuffer', 'offset', '_tempDataLen'], dataBuffer=b'x' * 10, offset=4, _tempDataLen=3)
+        protocol = mock.Mock(transport=mock.Mock(spec=['transport'], transport=transport))
+
+        class Session:
+            # Like channels' session middleware wrapper
+            def __init__(self, send):
+                self.real_send = send
+
+            async def send(self, message):
+                await self.real_send(message)
+
+        send = Session(functools.partial(lambda protocol, message: None, protocol)).send
+        self.assertEqual(transport_buffer(send)(), 9)
+        self.assertIsNone(transport_buffer(Session(lambda message: None).send))
+
+    @override_settings(CHAT_CONNECTION_RATE=1, CHAT_CONNECTION_BURST=2)
+    def test_connection_rate_limit(self):
+        print('Testing per-connection rate limit')
+        communicator = chat_communicator(self.alice, 'bob')
+
+        @async_to_sync
+        async def scenario():
+            await communicator.connect()
+            for _ in range(3):
+                await communicator.send_to(text_data=json.dumps({'type': 'heartbeat'}))
+            frame = json.loads(await communicator.receive_from())
+            self.assertTrue(await communicator.receive_nothing())
+            await communicator.disconnect()
+            return frame
+
+        frame = scenario()
+        self.assertEqual(frame['error'], 'Rate limit exceeded.')
+        self.assertGreater(frame['retry_after'], 0)
+        self.assertEqual(metrics.get_value('chat_frames_throttled_total', scope='connection'), 1)
+
+    @override_settings(CHAT_USER_RATE=0.01, CHAT_USER_BURST=2)
+    def test_user_rate_limit_is_shared_by_devices(self):
+        print('Testing per-user rate limit across devices')
+        phone, laptop = chat_communicator(self.alice, 'bob'), chat_communicator(self.alice, 'bob')
+
+        @async_to_sync
+        async def scenario():
+            await phone.connect()
+            await laptop.connect()
+            for text in ('one', 'two'):
+                await phone.send_to(text_data=json.dumps({'message': text}))
+                await phone.receive_from()
+            await laptop.send_to(text_data=json.dumps({'message': 'three'}))
+            frames = [json.loads(await laptop.receive_from()) for _ in range(3)]
+            await phone.disconnect()
+            await laptop.disconnect()
+            return frames
+
+        frames = scenario()
+        self.assertEqual([frame.get('message') for frame in frames[:2]], ['one', 'two'])
+        self.assertEqual(frames[2]['error'], 'Rate limit exceeded.')
+        self.assertEqual(Message.objects.count(), 2)
+        self.assertEqual(metrics.get_value('chat_frames_throttled_total', scope='user'), 1)
+
+    @override_settings(CHAT_MAX_FRAME_SIZE=64)
+    def test_oversized_frame_is_rejected(self):
+        print('Testing maximum frame size')
+        communicator = chat_communicator(self.alice, 'bob')
+
+        @async_to_sync
+        async def scenario():
+            await communicator.connect()
+            await communicator.send_to(text_data=json.dumps({'message': 'x' * 64}))
+            frame = json.loads(await communicator.receive_from())
+            await communicator.disconnect()
+            return frame
+
+        self.assertEqual(scenario(), {'error': 'Frame too large.', 'max_size': 64})
+        self.assertFalse(Message.objects.exists())
+        self.assertEqual(metrics.get_value('chat_frames_dropped_total', reason='too_large'), 1)
+
+    @override_settings(CHAT_SEND_QUEUE_SIZE=2)
+    def test_slow_consumer_is_closed(self):
+        print('Testing slow consumer disconnect')
+        communicator = chat_communicator(self.alice, 'bob')
+
+        @async_to_sync
+        async def scenario():
+            await communicator.connect()
+            layer = get_channel_layer()
+            for i in range(3):
+                await layer.group_send(user_group(self.alice.id), {
+                    'type': 'chat_message', 'message': str(i), 'sender': 'bob', 'conversation': 'key', 'id': i, 'message_time': '',
+                })
+            output = await communicator.receive_output()
+            await communicator.disconnect()
+            return output
+
+        # A client that never reads: the server's socket buffer stays full
+        with mock.patch('chats.consumers.transport_buffer', return_value=lambda: 10 ** 9):
+            self.assertEqual(scenario(), {'type': 'websocket.close', 'code': 4008})
+        self.assertEqual(metrics.get_value('chat_frames_dropped_total', reason='slow_consumer'), 1)
@@ -0,0 +1,11 @@
+from django.urls import path
+
+from .views import ConversationMessagesView, InboxView, MarkReadView, PresenceView
+
+
+urlpatterns = [
+    path('chats/inbox/', InboxView.as_view()),
+    path('chats/inbox/read/', MarkReadView.as_view()),
+    path('chats/presence/', PresenceView.as_view()),
+    path('chats/<str:username>/messages/', ConversationMessagesView.as_view()),
+]
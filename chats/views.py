@@ -1,3 +1,115 @@
-from django.shortcuts import render
+from django.db import transaction
 
-# Create your views here.
+from rest_framework import generics
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from OnlineLearning_Platform.pagination import KeysetPagination
+
+from users.models import CustomUser
+from .identity import get_chat_users
+from .inbox import mark_read, send_read_receipts
+from .models import Conversation, ConversationMember, Message
+from .presence import online_user_ids
+from .serializers import InboxEntrySerializer, MessageSerializer, ReadMarkSerializer
+
+
+class MessageHistoryPagination(KeysetPagination):
+    cursor_query_param = 'before'
+
+
+class ConversationMessagesView(generics.ListAPIView):
+    """
+    The conversation between the current user and ``username``, newest messages first.
+
+    ``next`` pages back in time; each page is a range scan of ``messages_conversation_idx``.
+    """
+    serializer_class = MessageSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = MessageHistoryPagination
+    cursor_ordering = ('-message_time', '-id')
+
+    def get_queryset(self):
+        other_id = CustomUser.objects.filter(username=self.kwargs['username']).values_list('pk', flat=True).first()
+        if other_id is None:
+            raise NotFound("User not found.")
+        return Message.objects.filter(conversation_key=Message.conversation_key_for(self.request.user.pk, other_id))
+
+
+class PresenceView(APIView):
+    """
+    Which of the users named by ``?username=`` (repeatable) have a connected chat device.
+    """
+    permission_classes = [IsAuthenticated]
+    max_usernames = 100
+
+    def get(self, request):
+        usernames = request.query_params.getlist('username')[:self.max_usernames]
+        users = dict(CustomUser.objects.filter(username__in=usernames).values_list('username', 'pk'))
+        online = online_user_ids(list(users.values()))
+        return Response({username: users.get(username) in online for username in usernames})
+
+
+class InboxView(generics.ListAPIView):
+    """
+    The current user's conversations, most recently active first, with unread counts.
+
+    A page is one range scan of ``chat_members_inbox_idx`` joined to each conversation and
+    its last message; the other users of direct conversations come from the identity cache.
+    """
+    serializer_class = InboxEntrySerializer
+    permission_classes = [IsAuthenticated]
+    cursor_ordering = ('-last_message_time', '-id')
+
+    def get_queryset(self):
+        return (
+            ConversationMember.objects.filter(user=self.request.user)
+            .select_related('conversation', 'conversation__last_message')
+        )
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        peer_ids = set()
+        for member in page:
+            pair = Conversation.direct_participants(member.conversation.key)
+            if pair:
+                peer_ids.add(pair[1] if pair[0] == member.user_id else pair[0])
+        self.peers = get_chat_users(peer_ids) if peer_ids else {}
+        return page
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['peers'] = getattr(self, 'peers', {})
+        return context
+
+
+class MarkReadView(APIView):
+    """
+    Mark conversations read up to a message id.
+
+    Takes one ``{"conversation": <key>, "message_id": <id>}`` or a list of them, and returns
+    the new unread count of each conversation (``null`` where the user is not a member or the
+    message is not in the conversation). The other participants' devices get a read receipt.
+    """
+    permission_classes = [IsAuthenticated]
+    max_marks = 100
+
+    def post(self, request):
+        many = isinstance(request.data, list)
+        serializer = ReadMarkSerializer(data=request.data, many=many)
+        serializer.is_valid(raise_exception=True)
+        marks = serializer.validated_data if many else [serializer.validated_data]
+        if len(marks) > self.max_marks:
+            raise ValidationError(f'At most {self.max_marks} conversations can be marked at once.')
+
+        latest = {}
+        for mark in marks:
+            latest[mark['conversation']] = max(latest.get(mark['conversation'], 0), mark['message_id'])
+
+        with transaction.atomic():
+            unread = {key: mark_read(request.user.pk, key, message_id) for key, message_id in latest.items()}
+
+        send_read_receipts(request.user, [(key, latest[key]) for key, count in unread.items() if count is not None])
+        return Response({'unread': unread})
@@ -0,0 +1,68 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from OnlineLearning_Platform import metrics
+
+from .models import Course
+
+
+def _access_cache_key(user_id):
+    return f'course-access:{user_id}'
+
+
+def get_course_access(user):
+    """
+    Return ``(enrolled_course_ids, instructed_course_ids)`` for a user.
+
+    The pair is cached per user and dropped by the signal handlers whenever enrollment or
+    a course's instructor changes, so warm access checks do not touch the database.
+    """
+    key = _access_cache_key(user.pk)
+    access = cache.get(key)
+    if access is not None:
+        metrics.incr('course_access_cache_hits_total')
+        return access
+
+    metrics.incr('course_access_cache_misses_total')
+    enrolled = frozenset(
+        Course.students.through.objects.filter(customuser_id=user.pk).values_list('course_id', flat=True)
+    )
+    instructed = frozenset(Course.objects.filter(instructor_id=user.pk).values_list('pk', flat=True))
+    access = (enrolled, instructed)
+    cache.set(key, access, getattr(settings, 'COURSE_ACCESS_CACHE_TIMEOUT', 60 * 60))
+    return access
+
+
+def invalidate_course_access(user_ids):
+    keys = [_access_cache_key(user_id) for user_id in user_ids if user_id is not None]
+    if not keys:
+        return
+    cache.delete_many(keys)
+    # Drop it again once the change is visible to other requests, in case one of them
+    # re-cached the old state while the transaction was still open.
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def user_can_access_course(user, course, enrolled=None):
+    """
+    Check if the user can access the course
+
+    ``enrolled`` may be passed when the caller already knows it (e.g. from an annotated
+    query); the course must then have ``instructor_id`` loaded and no cache lookup is made.
+    """
+    if enrolled is not None:
+        is_course_instructor = course.instructor_id == user.pk and not user.is_student
+        return enrolled or is_course_instructor
+
+    return user_can_access_course_pk(user, course.pk)
+
+
+def user_can_access_course_pk(user, course_pk):
+    """
+    Access check by course id alone, answered from the cached access sets.
+    """
+    enrolled_ids, instructed_ids = get_course_access(user)
+    has_enrolled = course_pk in enrolled_ids
+    is_course_instructor = course_pk in instructed_ids and not user.is_student
+    return has_enrolled or is_course_instructor
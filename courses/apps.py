@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class CoursesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'courses'
+
+    def ready(self):
+        from OnlineLearning_Platform.images import track_image_field
+
+        from . import signals  # noqa: F401
+        from .models import Category, Course
+
+        track_image_field(Category, 'avatar')
+        track_image_field(Course, 'avatar')
@@ -0,0 +1,74 @@
+import time
+
+from django.core.cache import cache
+
+
+VERSION_TIMEOUT = None
+
+
+def _version_key(namespace, pk):
+    return f'version:{namespace}:{pk}'
+
+
+def _fresh_version():
+    # Seed from the clock so a counter that was evicted never restarts at a value
+    # that older cache entries were stored under.
+    return int(time.time() * 1000)
+
+
+def get_version(namespace, pk=''):
+    """
+    Return the current version counter for ``namespace``/``pk``, creating it if missing.
+    """
+    key = _version_key(namespace, pk)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _fresh_version(), VERSION_TIMEOUT)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(namespace, pk=''):
+    """
+    Move ``namespace``/``pk`` to a new version so everything cached under the old one is ignored.
+    """
+    key = _version_key(namespace, pk)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = _fresh_version()
+        cache.set(key, version, VERSION_TIMEOUT)
+        return version
+
+
+def single_flight(key, compute, timeout, lock_timeout=10, wait=5.0, poll=0.05):
+    """
+    Return the cached value for ``key``, letting only one caller at a time compute a miss.
+
+    The lock is a ``cache.add`` so it works the same on LocMemCache and on a shared backend.
+    Callers that lose the race poll for the winner's value and compute it themselves only
+    if it does not show up within ``wait`` seconds. ``compute`` returning ``None`` is not cached.
+    """
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, lock_timeout):
+        try:
+            value = compute()
+            if value is not None:
+                cache.set(key, value, timeout)
+            return value
+        finally:
+            cache.delete(lock_key)
+
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        time.sleep(poll)
+        value = cache.get(key)
+        if value is not None:
+            return value
+        if cache.get(lock_key) is None:
+            break
+    return compute()
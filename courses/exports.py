@@ -0,0 +1,270 @@
+import csv
+import hashlib
+import io
+import os
+import struct
+import zlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+
+CHUNK_SIZE = 64 * 1024
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+
+# General purpose flags: sizes/CRC follow the data in a descriptor (bit 3), UTF-8 names (bit 11)
+FLAGS = 0x0008 | 0x0800
+UNIX_FILE_ATTRS = 0o100644 << 16
+MADE_BY_UNIX = 3 << 8
+
+
+def dos_datetime(value):
+    value = timezone.localtime(value) if timezone.is_aware(value) else value
+    if value.year < 1980:
+        return 0, (1 << 5) | 1
+    time = (value.hour << 11) | (value.minute << 5) | (value.second // 2)
+    date = ((value.year - 1980) << 9) | (value.month << 5) | value.day
+    return time, date
+
+
+class ZipEntry:
+    """
+    One STORED (uncompressed) member of a ZipStream.
+
+    The content comes either from ``data`` or from ``storage``/``name``. Every header has a
+    length known up front, so the archive size and the offset of each byte are computable
+    before any file is read. The CRC, which only the data descriptor and the central
+    directory need, is computed while the file streams, or on demand when a Range request
+    skips the start of the file, and is cached under ``crc_key``.
+    """
+
+    def __init__(self, arcname, size, modified, data=None, storage=None, name=None, crc_key=None):
+        self.arcname = arcname.encode('utf-8')
+        self.size = size
+        self.dos_time, self.dos_date = dos_datetime(modified)
+        self.data = data
+        self.storage = storage
+        self.name = name
+        self.crc_key = crc_key
+        self.crc = zlib.crc32(data) if data is not None else None
+        self.offset = 0
+
+    @property
+    def zip64(self):
+        return self.size >= ZIP64_LIMIT
+
+    @property
+    def version(self):
+        return 45 if self.zip64 or self.offset >= ZIP64_LIMIT else 20
+
+    def local_header(self):
+        extra = b''
+        size_field = 0
+        if self.zip64:
+            extra = struct.pack('<HHQQ', 0x0001, 16, 0, 0)
+            size_field = 0xFFFFFFFF
+        return struct.pack(
+            '<IHHHHHIIIHH', 0x04034b50, self.version, FLAGS, 0, self.dos_time, self.dos_date,
+            0, size_field, size_field, len(self.arcname), len(extra)
+        ) + self.arcname + extra
+
+    @property
+    def descriptor_length(self):
+        return 24 if self.zip64 else 16
+
+    def descriptor(self):
+        if self.zip64:
+            return struct.pack('<IIQQ', 0x08074b50, self.get_crc(), self.size, self.size)
+        return struct.pack('<IIII', 0x08074b50, self.get_crc(), self.size, self.size)
+
+    def central_header(self):
+        extra_values = []
+        size_field = offset_field = None
+        if self.zip64:
+            extra_values += [self.size, self.size]
+            size_field = 0xFFFFFFFF
+        if self.offset >= ZIP64_LIMIT:
+            extra_values.append(self.offset)
+            offset_field = 0xFFFFFFFF
+        extra = b''
+        if extra_values:
+            extra = struct.pack(f'<HH{len(extra_values)}Q', 0x0001, 8 * len(extra_values), *extra_values)
+        size = self.size if size_field is None else size_field
+        return struct.pack(
+            '<IHHHHHHIIIHHHHHII', 0x02014b50, MADE_BY_UNIX | self.version, self.version, FLAGS, 0,
+            self.dos_time, self.dos_date, self.get_crc(), size, size, len(self.arcname), len(extra),
+            0, 0, 0, UNIX_FILE_ATTRS, self.offset if offset_field is None else offset_field
+        ) + self.arcname + extra
+
+    def central_header_length(self):
+        extra_count = (2 if self.zip64 else 0) + (1 if self.offset >= ZIP64_LIMIT else 0)
+        return 46 + len(self.arcname) + (4 + 8 * extra_count if extra_count else 0)
+
+    def get_crc(self):
+        if self.crc is None:
+            crc = 0
+            for chunk in self._read(0, self.size):
+                crc = zlib.crc32(chunk, crc)
+            self._set_crc(crc)
+        return self.crc
+
+    def _set_crc(self, crc):
+        self.crc = crc
+        if self.crc_key:
+            cache.set(self.crc_key, crc, settings.SUBMISSION_EXPORT_CRC_CACHE_TIMEOUT)
+
+    def _read(self, start, end):
+        if self.data is not None:
+            yield self.data[start:end]
+            return
+        with self.storage.open(self.name, 'rb') as file:
+            file.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = file.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def iter_data(self, start, end):
+        if start != 0 or end != self.size or self.crc is not None:
+            yield from self._read(start, end)
+            return
+
+        # Streaming the whole file: compute its CRC on the way for the descriptor that follows
+        crc = 0
+        for chunk in self._read(start, end):
+            crc = zlib.crc32(chunk, crc)
+            yield chunk
+        self._set_crc(crc)
+
+
+class ZipStream:
+    """
+    A ZIP archive of STORED entries that is generated on the fly and supports byte ranges.
+
+    The archive is laid out as segments (headers, file data, descriptors, central directory)
+    whose lengths are known in advance, so ``iter_range`` can start anywhere without building
+    the preceding bytes.
+    """
+
+    def __init__(self, entries):
+        self.entries = list(entries)
+        crcs = cache.get_many([entry.crc_key for entry in self.entries if entry.crc_key and entry.crc is None])
+        for entry in self.entries:
+            if entry.crc is None and entry.crc_key in crcs:
+                entry.crc = crcs[entry.crc_key]
+
+        self.segments = []
+        offset = 0
+        for entry in self.entries:
+            entry.offset = offset
+            header = entry.local_header()
+            self.segments.append((len(header), header))
+            self.segments.append((entry.size, entry))
+            self.segments.append((entry.descriptor_length, entry.descriptor))
+            offset += len(header) + entry.size + entry.descriptor_length
+
+        self.central_offset = offset
+        self.central_size = sum(entry.central_header_length() for entry in self.entries)
+        self.zip64 = (
+            self.central_offset >= ZIP64_LIMIT or self.central_size >= ZIP64_LIMIT
+            or len(self.entries) >= ZIP64_COUNT_LIMIT
+        )
+        tail_length = self.central_size + 22 + (56 + 20 if self.zip64 else 0)
+        self.segments.append((tail_length, self.central_directory))
+        self.size = offset + tail_length
+
+    def central_directory(self):
+        parts = [entry.central_header() for entry in self.entries]
+        count = len(self.entries)
+        end_offset = self.central_offset + self.central_size
+        if self.zip64:
+            parts.append(struct.pack(
+                '<IQHHIIQQQQ', 0x06064b50, 44, MADE_BY_UNIX | 45, 45, 0, 0,
+                count, count, self.central_size, self.central_offset
+            ))
+            parts.append(struct.pack('<IIQI', 0x07064b50, 0, end_offset, 1))
+        parts.append(struct.pack(
+            '<IHHHHIIH', 0x06054b50, 0, 0, min(count, ZIP64_COUNT_LIMIT), min(count, ZIP64_COUNT_LIMIT),
+            min(self.central_size, ZIP64_LIMIT), min(self.central_offset, ZIP64_LIMIT), 0
+        ))
+        return b''.join(parts)
+
+    def iter_range(self, start=0, end=None):
+        """
+        Yield the archive bytes ``start`` to ``end`` inclusive (the whole archive by default).
+        """
+        end = self.size - 1 if end is None else end
+        position = 0
+        for length, payload in self.segments:
+            segment_start, position = position, position + length
+            if position <= start:
+                continue
+            if segment_start > end:
+                break
+            low = max(start, segment_start) - segment_start
+            high = min(end + 1, position) - segment_start
+            if isinstance(payload, ZipEntry):
+                yield from payload.iter_data(low, high)
+            else:
+                data = payload() if callable(payload) else payload
+                yield data[low:high]
+
+
+def build_submission_export(assignment, submissions):
+    """
+    Return ``(stream, etag)`` for a ZIP of an assignment's submission files plus ``manifest.csv``.
+
+    The ETag covers everything the archive bytes depend on, so a resumed download with a
+    matching ``If-Range`` is guaranteed to continue the same archive.
+    """
+    members = []
+    manifest = io.StringIO()
+    writer = csv.writer(manifest)
+    writer.writerow(['submission_id', 'student_id', 'username', 'submitted_at', 'due_time', 'late', 'file'])
+
+    for submission in submissions:
+        arcname = ''
+        name = submission.content.name if submission.content else ''
+        if name:
+            storage = submission.content.storage
+            try:
+                size = storage.size(name)
+            except OSError:
+                size = None
+            if size is not None:
+                username = submission.student.username if submission.student else 'unknown'
+                arcname = f'{username}/{submission.pk}_{os.path.basename(name)}'
+                digest = storage.digest(name) if hasattr(storage, 'digest') else None
+                if not digest:
+                    modified = storage.get_modified_time(name).timestamp()
+                    digest = hashlib.sha1(f'{name}:{size}:{modified}'.encode()).hexdigest()
+                members.append(ZipEntry(
+                    arcname, size, submission.submitted_at, storage=storage, name=name, crc_key=f'zip-crc:{digest}'
+                ))
+
+        due_time = assignment.due_time
+        late = bool(due_time and submission.submitted_at > due_time)
+        writer.writerow([
+            submission.pk,
+            submission.student_id or '',
+            submission.student.username if submission.student else '',
+            submission.submitted_at.isoformat(),
+            due_time.isoformat() if due_time else '',
+            'yes' if late else 'no',
+            arcname,
+        ])
+
+    manifest_data = manifest.getvalue().encode('utf-8')
+    modified = max((submission.submitted_at for submission in submissions), default=assignment.created_time)
+    entries = [ZipEntry('manifest.csv', len(manifest_data), modified, data=manifest_data)] + members
+
+    fingerprint = hashlib.sha1(manifest_data)
+    for entry in members:
+        fingerprint.update(f'{entry.name}:{entry.crc_key}'.encode())
+    etag = f'"{fingerprint.hexdigest()}"'
+    return ZipStream(entries), etag
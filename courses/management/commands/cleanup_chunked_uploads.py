@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from courses.models import ChunkedUpload
+from courses.uploads import delete_upload_file
+
+
+class Command(BaseCommand):
+    help = 'Delete unfinished chunked uploads, and their partial files, that have not progressed in CHUNKED_UPLOAD_EXPIRATION seconds.'
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=settings.CHUNKED_UPLOAD_EXPIRATION)
+        expired = ChunkedUpload.objects.filter(status=ChunkedUpload.STATUS_UPLOADING, updated_time__lt=cutoff)
+
+        count = 0
+        for upload in expired.iterator():
+            delete_upload_file(upload)
+            upload.delete()
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Deleted {count} expired uploads.'))
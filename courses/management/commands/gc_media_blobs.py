@@ -0,0 +1,123 @@
+import os
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from courses.models import Lession, Assignment, Submission, StoredBlob
+from courses.storage import get_content_storage
+
+
+class Command(BaseCommand):
+    help = 'Delete content-addressed media blobs that no lession, assignment or submission references.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recount', action='store_true',
+            help='Recompute reference counts from the content columns first (repairs drift from bulk updates).'
+        )
+        parser.add_argument(
+            '--grace', type=int, default=60 * 60,
+            help='Keep unreferenced blobs written in the last GRACE seconds, e.g. uploads whose row is not saved yet.'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be deleted without deleting it.')
+
+    def handle(self, *args, **options):
+        storage = get_content_storage()
+        dry_run = options['dry_run']
+        cutoff = time.time() - options['grace']
+
+        if options['recount']:
+            self.recount(storage)
+
+        deleted = freed = 0
+        stale = StoredBlob.objects.filter(
+            refcount__lte=0, updated_time__lt=timezone.now() - timedelta(seconds=options['grace'])
+        )
+        for blob in stale.iterator():
+            path = storage.blob_path(blob.digest)
+            if os.path.exists(path) and os.path.getmtime(path) >= cutoff:
+                continue
+            if dry_run:
+                deleted, freed = deleted + 1, freed + self.remove(path, dry_run)
+                continue
+            with transaction.atomic():
+                # Hold the row so a new reference to the digest waits until the blob is gone
+                if not StoredBlob.objects.select_for_update().filter(pk=blob.pk, refcount__lte=0).exists():
+                    continue
+                StoredBlob.objects.filter(pk=blob.pk, refcount__lte=0).delete()
+                size = self.remove_blob(path, cutoff)
+                if size is None:
+                    transaction.set_rollback(True)
+                    continue
+            deleted, freed = deleted + 1, freed + size
+
+        # Blobs written by the storage whose row was never saved have no StoredBlob at all
+        blob_root = storage.path(storage.blob_dir)
+        for directory, _, filenames in os.walk(blob_root):
+            known = set(StoredBlob.objects.filter(digest__in=filenames).values_list('digest', flat=True))
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                if filename not in known and os.path.getmtime(path) < cutoff:
+                    deleted, freed = deleted + 1, freed + self.remove(path, dry_run)
+
+        tmp_root = storage.path(storage.tmp_dir)
+        if os.path.isdir(tmp_root):
+            for filename in os.listdir(tmp_root):
+                path = os.path.join(tmp_root, filename)
+                if os.path.getmtime(path) < cutoff:
+                    self.remove(path, dry_run)
+
+        verb = 'Would delete' if dry_run else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {deleted} blobs ({freed} bytes).'))
+
+    def remove(self, path, dry_run):
+        try:
+            size = os.path.getsize(path)
+            if not dry_run:
+                os.unlink(path)
+        except FileNotFoundError:
+            return 0
+        return size
+
+    def remove_blob(self, path, cutoff):
+        """
+        Delete a blob unless an ingest reused it; returns its size, or ``None`` if it was kept.
+
+        The blob is moved aside before its mtime is checked, so an ingest of the same content
+        either refreshed the mtime before (and the blob is restored) or finds no blob and
+        writes it again.
+        """
+        doomed = f'{path}.deleting'
+        try:
+            os.replace(path, doomed)
+        except FileNotFoundError:
+            return 0
+        if os.path.getmtime(doomed) >= cutoff:
+            os.replace(doomed, path)
+            return None
+        return self.remove(doomed, dry_run=False)
+
+    def recount(self, storage):
+        counts = Counter()
+        for model in (Lession, Assignment, Submission):
+            for name in model.objects.exclude(content='').exclude(content=None).values_list('content', flat=True).iterator():
+                digest = storage.digest(name)
+                if digest:
+                    counts[digest] += 1
+
+        now = timezone.now()
+        existing = dict(StoredBlob.objects.values_list('digest', 'refcount'))
+        for digest, refcount in existing.items():
+            if counts.get(digest, 0) != refcount:
+                StoredBlob.objects.filter(pk=digest).update(refcount=counts.get(digest, 0), updated_time=now)
+        missing = [
+            StoredBlob(digest=digest, refcount=count, size=os.path.getsize(storage.blob_path(digest)))
+            for digest, count in counts.items()
+            if digest not in existing and os.path.exists(storage.blob_path(digest))
+        ]
+        StoredBlob.objects.bulk_create(missing, ignore_conflicts=True)
+        self.stdout.write(f'Recounted references of {len(counts)} blobs.')
@@ -0,0 +1,40 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from OnlineLearning_Platform.images import generate_variants
+from courses.models import Category, Course
+from users.models import CustomUser
+
+
+MODELS = {
+    'category': Category,
+    'course': Course,
+    'user': CustomUser,
+}
+
+
+class Command(BaseCommand):
+    help = 'Generate missing thumbnail variants of existing Course, Category and user avatars.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=sorted(MODELS), action='append', help='Only process these models (repeatable).')
+        parser.add_argument('--force', action='store_true', help='Regenerate variants that already exist.')
+        parser.add_argument('--workers', type=int, default=settings.IMAGE_VARIANT_WORKERS)
+
+    def handle(self, *args, **options):
+        models = [MODELS[name] for name in options['model'] or sorted(MODELS)]
+        force = options['force']
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for model in models:
+                storage = model._meta.get_field('avatar').storage
+                names = (
+                    model.objects.exclude(avatar='').exclude(avatar=None)
+                    .order_by('pk').values_list('avatar', flat=True).iterator()
+                )
+                written = sum(executor.map(lambda name: generate_variants(storage, name, force=force), names))
+                self.stdout.write(f'{model._meta.verbose_name_plural}: {written} variants written.')
+
+        self.stdout.write(self.style.SUCCESS('Image variants are up to date.'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from courses.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the course full-text search index from the courses table.'
+
+    def handle(self, *args, **options):
+        get_search_backend().rebuild()
+        self.stdout.write(self.style.SUCCESS('Course search index rebuilt.'))
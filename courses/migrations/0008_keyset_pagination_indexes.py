@@ -0,0 +1,41 @@
+# Generated by Django 4.2 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0007_alter_submission_content'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='assignment',
+            index=models.Index(fields=['module', 'created_time', 'id'], name='assignments_module_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['created_time', 'id'], name='categories_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['created_time', 'id'], name='courses_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='enrollment',
+            index=models.Index(fields=['user', 'enroll_time', 'id'], name='enrollments_user_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lession',
+            index=models.Index(fields=['module', 'created_time', 'id'], name='lessions_module_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='module',
+            index=models.Index(fields=['course', 'created_time', 'id'], name='modules_course_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='submission',
+            index=models.Index(fields=['assignment', 'submitted_at', 'id'], name='submissions_assign_sub_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+def backfill_student_count(apps, schema_editor):
+    Course = apps.get_model('courses', 'Course')
+    for course in Course.objects.annotate(total=models.Count('students')).iterator():
+        Course.objects.filter(pk=course.pk).update(student_count=course.total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0008_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='student_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_student_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2 on 2026-10-18 14:21
+
+from django.db import migrations, models
+
+
+def backfill_category_paths(apps, schema_editor):
+    Category = apps.get_model('courses', 'Category')
+    paths = {}
+    level = list(Category.objects.filter(parent__isnull=True).values_list('pk', 'parent_id'))
+    depth = 0
+    while level:
+        for pk, parent_pk in level:
+            paths[pk] = paths.get(parent_pk, '') + f'{pk:010d}/'
+            Category.objects.filter(pk=pk).update(path=paths[pk], depth=depth)
+        level = list(Category.objects.filter(parent_id__in=[pk for pk, _ in level]).values_list('pk', 'parent_id'))
+        depth += 1
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0009_course_student_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(backfill_category_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS courses_fts USING fts5("
+        "title, description, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+    schema_editor.execute(
+        "INSERT INTO courses_fts (rowid, title, description) "
+        "SELECT id, title, coalesce(description, '') FROM courses"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS courses_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0010_category_materialized_path'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2 on 2026-10-18 14:32
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('courses', '0011_course_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChunkedUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('target', models.CharField(choices=[('lession', 'Lession'), ('assignment', 'Assignment'), ('submission', 'Submission')], max_length=20)),
+                ('object_id', models.PositiveIntegerField()),
+                ('filename', models.CharField(max_length=255)),
+                ('file', models.CharField(blank=True, default='', editable=False, max_length=255)),
+                ('size', models.PositiveBigIntegerField()),
+                ('offset', models.PositiveBigIntegerField(default=0, editable=False)),
+                ('sha256', models.CharField(blank=True, default='', max_length=64)),
+                ('status', models.CharField(choices=[('uploading', 'Uploading'), ('complete', 'Complete')], default='uploading', editable=False, max_length=20)),
+                ('created_time', models.DateTimeField(auto_now_add=True)),
+                ('updated_time', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunked_uploads', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'chunked upload',
+                'verbose_name_plural': 'chunked uploads',
+                'db_table': 'chunked_uploads',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='chunkedupload',
+            index=models.Index(fields=['status', 'updated_time'], name='chunked_uploads_status_idx'),
+        ),
+    ]
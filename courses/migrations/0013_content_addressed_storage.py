@@ -0,0 +1,49 @@
+# Generated by Django 4.2 on 2026-10-18 14:35
+
+import courses.models
+import courses.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0012_chunked_upload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredBlob',
+            fields=[
+                ('digest', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('size', models.PositiveBigIntegerField(default=0)),
+                ('refcount', models.IntegerField(default=0)),
+                ('created_time', models.DateTimeField(auto_now_add=True)),
+                ('updated_time', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'stored blob',
+                'verbose_name_plural': 'stored blobs',
+                'db_table': 'stored_blobs',
+            },
+        ),
+        migrations.AlterField(
+            model_name='assignment',
+            name='content',
+            field=models.FileField(blank=True, max_length=255, null=True, storage=courses.storage.get_content_storage, upload_to=courses.models.get_upload_to_assignments),
+        ),
+        migrations.AlterField(
+            model_name='lession',
+            name='content',
+            field=models.FileField(blank=True, max_length=255, null=True, storage=courses.storage.get_content_storage, upload_to=courses.models.get_upload_to_lession),
+        ),
+        migrations.AlterField(
+            model_name='submission',
+            name='content',
+            field=models.FileField(blank=True, max_length=255, null=True, storage=courses.storage.get_content_storage, upload_to=courses.models.get_upload_to_submissions),
+        ),
+        migrations.AddIndex(
+            model_name='storedblob',
+            index=models.Index(fields=['refcount', 'updated_time'], name='stored_blobs_refcount_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 14:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0013_content_addressed_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='max_upload_size',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0014_course_max_upload_size'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chunkedupload',
+            name='locked_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
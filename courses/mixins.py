@@ -0,0 +1,277 @@
+import hashlib
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import Count, Exists, Max, OuterRef
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from rest_framework import serializers
+from rest_framework.exceptions import NotFound, PermissionDenied
+from rest_framework.response import Response
+
+from .access import user_can_access_course
+from .cache import get_version, single_flight
+from .models import Course
+from .uploads import ValidatingUploadHandler, get_upload_limit
+
+
+def get_query_plan(serializer_class, prefix=''):
+    """
+    Collect the relations a serializer needs from its Meta and from any nested serializers.
+
+    Serializers declare ``select_related`` / ``prefetch_related`` on their Meta. Nested
+    serializers are walked so their own declarations are applied under the parent's path.
+    Returns a ``(select_related, prefetch_related)`` pair of lists.
+    """
+    meta = getattr(serializer_class, 'Meta', None)
+    select_related = [prefix + name for name in getattr(meta, 'select_related', ())]
+    prefetch_related = [prefix + name for name in getattr(meta, 'prefetch_related', ())]
+
+    for field_name, field in serializer_class().fields.items():
+        many = isinstance(field, serializers.ListSerializer)
+        nested = field.child if many else field
+        if not isinstance(nested, serializers.ModelSerializer):
+            continue
+
+        source = field.source if field.source != '*' else field_name
+        path = prefix + source.replace('.', '__')
+        nested_select, nested_prefetch = get_query_plan(type(nested), prefix=path + '__')
+
+        if many or path in prefetch_related:
+            # Anything below a prefetched relation has to be prefetched as well.
+            prefetch_related += nested_select + nested_prefetch
+        else:
+            select_related += nested_select
+            prefetch_related += nested_prefetch
+
+    return list(dict.fromkeys(select_related)), list(dict.fromkeys(prefetch_related))
+
+
+def get_deferred_fields(serializer_class, prefix=''):
+    """
+    Columns of rows joined with ``select_related`` that their nested serializer never reads.
+
+    Deferring them keeps a compact nested projection (e.g. an embedded user) from loading
+    the whole row. Nested serializers with fields sourced from the whole object are skipped.
+    """
+    select_related, _ = get_query_plan(serializer_class, prefix)
+    deferred = []
+    for field_name, field in serializer_class().fields.items():
+        if not isinstance(field, serializers.ModelSerializer) or field.write_only:
+            continue
+        source = field.source if field.source != '*' else field_name
+        path = prefix + source.replace('.', '__')
+        if path not in select_related:
+            continue
+
+        sources = {nested.source.split('.')[0] for nested in field.fields.values() if not nested.write_only}
+        if '*' in sources:
+            continue
+        deferred += [
+            f'{path}__{model_field.name}' for model_field in field.Meta.model._meta.concrete_fields
+            if not model_field.primary_key and model_field.name not in sources
+        ]
+        deferred += get_deferred_fields(type(field), prefix=path + '__')
+    return deferred
+
+
+class QueryPlanMixin:
+    """
+    Apply the serializer's declared ``select_related`` / ``prefetch_related`` to the queryset,
+    so list and detail views run a fixed number of queries regardless of row count.
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        select_related, prefetch_related = get_query_plan(self.get_serializer_class())
+
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        deferred = get_deferred_fields(self.get_serializer_class())
+        if deferred:
+            queryset = queryset.defer(*deferred)
+        return queryset
+
+
+class CourseObjectMixin:
+    """
+    Resolve a course-owned object, its course chain and the access decision in one query.
+
+    ``course_path`` is the lookup from the model to its course (e.g. ``'module__course'``).
+    The chain is joined with ``select_related`` and enrollment is annotated as an EXISTS
+    subquery, so the loaded instance can be checked and serialized without further queries.
+    """
+    course_path = 'course'
+    not_found_message = 'Not found.'
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        enrolled = Course.students.through.objects.filter(
+            course_id=OuterRef(self.course_path),
+            customuser_id=self.request.user.pk,
+        )
+        return queryset.select_related(self.course_path).annotate(user_is_enrolled=Exists(enrolled))
+
+    def get_course(self, obj):
+        course = obj
+        for name in self.course_path.split('__'):
+            course = getattr(course, name)
+        return course
+
+    def get_object(self):
+        if hasattr(self, '_course_object'):
+            return self._course_object
+
+        try:
+            obj = self.get_queryset().get(pk=self.kwargs['pk'])
+        except ObjectDoesNotExist:
+            raise NotFound(self.not_found_message)
+
+        if not user_can_access_course(self.request.user, self.get_course(obj), enrolled=obj.user_is_enrolled):
+            raise PermissionDenied("You do not have permission to access this course.")
+
+        self.check_object_permissions(self.request, obj)
+        self._course_object = obj
+        return obj
+
+
+class ConditionalGetMixin:
+    """
+    Answer ``If-None-Match`` / ``If-Modified-Since`` with 304 before serializing anything.
+
+    Validators are derived from ``count`` and ``max(updated_field)`` of the response's
+    queryset (or the loaded object on detail views), plus any querysets returned by
+    ``get_conditional_dependencies`` for related rows that are embedded in the payload.
+
+    Removing a row does not move ``max(updated_field)`` forward, so only a lone object sends
+    ``Last-Modified``; anything aggregated is validated by the ETag, which includes the counts.
+    """
+    updated_field = 'updated_time'
+
+    def get(self, request, *args, **kwargs):
+        etag, last_modified = self.get_validators()
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+            patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def get_object(self):
+        if not hasattr(self, '_conditional_object'):
+            self._conditional_object = super().get_object()
+        return self._conditional_object
+
+    def get_conditional_dependencies(self, obj=None):
+        return []
+
+    def get_validators(self):
+        if (self.lookup_url_kwarg or self.lookup_field) in self.kwargs:
+            obj = self.get_object()
+            states = [(1, getattr(obj, self.updated_field))]
+        else:
+            obj = None
+            states = [self._aggregate_state(self.filter_queryset(self.get_queryset()))]
+        states += [self._aggregate_state(queryset) for queryset in self.get_conditional_dependencies(obj)]
+
+        last_modified = None
+        if obj is not None and len(states) == 1 and states[0][1] is not None:
+            last_modified = states[0][1].timestamp()
+
+        fingerprint = repr((
+            self.request.get_full_path(),
+            self.request.user.pk,
+            [(count, last.isoformat() if last else None) for count, last in states],
+        ))
+        etag = quote_etag(hashlib.sha1(fingerprint.encode()).hexdigest())
+        return etag, last_modified
+
+    def _aggregate_state(self, queryset):
+        state = queryset.order_by().aggregate(total=Count('pk'), last=Max(self.updated_field))
+        return state['total'], state['last']
+
+
+class CachedResponseMixin:
+    """
+    Cache successful GET responses under the versions returned by ``get_cache_versions``.
+
+    Signal handlers bump the versions when the underlying rows change, so entries never
+    need to be deleted; the TTL from ``CATALOG_CACHE_TIMEOUTS[cache_namespace]`` only bounds
+    staleness for data the signals do not cover. Validators are cached with the body, so a
+    warm hit (including a 304) runs no queries.
+    """
+    cache_namespace = None
+
+    def get_cache_versions(self):
+        raise NotImplementedError
+
+    def get_cache_timeout(self):
+        return getattr(settings, 'CATALOG_CACHE_TIMEOUTS', {}).get(self.cache_namespace, 300)
+
+    def get_cache_key(self, request):
+        versions = [get_version(*version) for version in self.get_cache_versions()]
+        fingerprint = repr((type(self).__name__, request.get_host(), request.get_full_path(), versions))
+        return f'response:{hashlib.sha1(fingerprint.encode()).hexdigest()}'
+
+    def get(self, request, *args, **kwargs):
+        computed = []
+
+        def compute():
+            response = super(CachedResponseMixin, self).get(request, *args, **kwargs)
+            computed.append(response)
+            if response.status_code != 200:
+                return None
+            return {
+                'data': response.data,
+                'etag': response.get('ETag'),
+                'last_modified': response.get('Last-Modified'),
+            }
+
+        entry = single_flight(self.get_cache_key(request), compute, self.get_cache_timeout())
+        if computed:
+            return computed[-1]
+
+        last_modified = parse_http_date_safe(entry['last_modified']) if entry['last_modified'] else None
+        response = get_conditional_response(request, etag=entry['etag'], last_modified=last_modified)
+        if response is None:
+            response = Response(entry['data'])
+        if entry['etag']:
+            response['ETag'] = entry['etag']
+        if entry['last_modified']:
+            response['Last-Modified'] = entry['last_modified']
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+
+class UploadValidationMixin:
+    """
+    Validate ``content`` uploads while the request body streams in.
+
+    ``upload_target`` selects the allowed types; ``get_upload_course_filter`` returns a
+    ``Course`` filter when the course is known from the URL or query string, so its own size
+    limit applies before the body is parsed (otherwise MAX_UPLOAD_SIZE does, and the
+    serializer checks the course limit afterwards).
+    """
+    upload_target = None
+
+    def get_upload_course_filter(self):
+        return None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if not request.content_type.startswith('multipart/form-data'):
+            return
+
+        course = None
+        course_filter = self.get_upload_course_filter()
+        if course_filter is not None:
+            course = Course.objects.filter(course_filter).only('max_upload_size').first()
+        handler = ValidatingUploadHandler(request._request, get_upload_limit(course), self.upload_target)
+        request.upload_handlers.insert(0, handler)
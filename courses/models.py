@@ -1,18 +1,64 @@
 import os
+import uuid
+
 from django.db import models
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Substr
+
+from .storage import get_content_storage
+
 
 class Category(models.Model):
     parent = models.ForeignKey('self', blank=True, null=True, on_delete=models.CASCADE)
     title = models.CharField(max_length=200, blank=False, null=False)
     avatar = models.ImageField(blank=True, upload_to='categories/')
+    # Materialized path: zero-padded ids from the root down to this category, e.g. "0000000001/0000000007/"
+    path = models.CharField(max_length=255, blank=True, default='', editable=False, db_index=True)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
     created_time = models.DateTimeField(auto_now_add=True)
     updated_time = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'categories'
+        indexes = [models.Index(fields=['created_time', 'id'], name='categories_created_id_idx')]
         verbose_name = 'category'
         verbose_name_plural = 'categories'
 
+    @staticmethod
+    def path_segment(pk):
+        return f'{pk:010d}/'
+
+    @property
+    def ancestor_ids(self):
+        return [int(segment) for segment in self.path.split('/') if segment][:-1]
+
+    def save(self, *args, **kwargs):
+        """
+        Keep ``path`` and ``depth`` in sync, rewriting the whole subtree in one UPDATE on a move.
+        """
+        old_path, old_depth = self.path, self.depth
+
+        parent_path = ''
+        if self.parent_id:
+            parent_path = Category.objects.filter(pk=self.parent_id).values_list('path', flat=True).get()
+            if old_path and parent_path.startswith(old_path):
+                raise ValueError('A category cannot be moved under itself or one of its descendants.')
+
+        super().save(*args, **kwargs)
+
+        new_path = parent_path + self.path_segment(self.pk)
+        if new_path == old_path:
+            return
+
+        new_depth = new_path.count('/') - 1
+        Category.objects.filter(pk=self.pk).update(path=new_path, depth=new_depth)
+        if old_path:
+            Category.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                path=Concat(Value(new_path), Substr('path', len(old_path) + 1)),
+                depth=F('depth') + (new_depth - old_depth),
+            )
+        self.path, self.depth = new_path, new_depth
+
 
 class Course(models.Model):
     category = models.ManyToManyField(Category, blank=True, related_name='courses')
@@ -21,12 +67,16 @@ class Course(models.Model):
     avatar = models.ImageField(blank=True, null=True)
     instructor = models.ForeignKey('users.CustomUser', related_name='instructed_courses', on_delete=models.CASCADE, blank=True, null=True)
     students = models.ManyToManyField('users.CustomUser', related_name='enrolled_courses', blank=True)
+    student_count = models.PositiveIntegerField(default=0, editable=False)
+    # Largest lession/assignment/submission file accepted for this course; MAX_UPLOAD_SIZE when empty
+    max_upload_size = models.PositiveBigIntegerField(blank=True, null=True)
     price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     created_time = models.DateTimeField(auto_now_add=True)
     updated_time = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'courses'
+        indexes = [models.Index(fields=['created_time', 'id'], name='courses_created_id_idx')]
         verbose_name = 'course'
         verbose_name_plural = 'courses'
 
@@ -39,6 +89,7 @@ class Module(models.Model):
 
     class Meta:
         db_table = 'modules'
+        indexes = [models.Index(fields=['course', 'created_time', 'id'], name='modules_course_created_idx')]
         verbose_name = 'module'
         verbose_name_plural = 'modules'
 
@@ -52,12 +103,13 @@ def get_upload_to_lession(instance, filename):
 class Lession(models.Model):
     module = models.ForeignKey(Module, blank=False, null=False, related_name='lessions', on_delete=models.CASCADE)
     title = models.CharField(max_length=200, blank=False, null=False)
-    content = models.FileField(blank=True, null=True, upload_to=get_upload_to_lession)
+    content = models.FileField(blank=True, null=True, max_length=255, upload_to=get_upload_to_lession, storage=get_content_storage)
     created_time = models.DateTimeField(auto_now_add=True)
     updated_time = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'lessions'
+        indexes = [models.Index(fields=['module', 'created_time', 'id'], name='lessions_module_created_idx')]
         verbose_name = 'lession'
         verbose_name_plural = 'lessions'
 
@@ -71,13 +123,14 @@ def get_upload_to_assignments(instance, filename):
 class Assignment(models.Model):
     module = models.ForeignKey(Module, blank=False, null=False, related_name='assignments', on_delete=models.CASCADE)
     title = models.CharField(max_length=200, blank=False, null=False)
-    content = models.FileField(blank=True, null=True, upload_to=get_upload_to_assignments)
+    content = models.FileField(blank=True, null=True, max_length=255, upload_to=get_upload_to_assignments, storage=get_content_storage)
     created_time = models.DateTimeField(auto_now_add=True)
     updated_time = models.DateTimeField(auto_now=True)
     due_time = models.DateTimeField(blank=True, null=True)
 
     class Meta:
         db_table = 'assignments'
+        indexes = [models.Index(fields=['module', 'created_time', 'id'], name='assignments_module_created_idx')]
         verbose_name = 'assignment'
         verbose_name_plural = 'assignments'
 
@@ -91,15 +144,78 @@ def get_upload_to_submissions(instance, filename):
 class Submission(models.Model):
     student = models.ForeignKey('users.CustomUser', blank=True, null=True, related_name='submissions', on_delete=models.CASCADE)
     assignment = models.ForeignKey(Assignment, blank=False, null=False, on_delete=models.CASCADE)
-    content = models.FileField(blank=True, null=True, upload_to=get_upload_to_submissions)
+    content = models.FileField(blank=True, null=True, max_length=255, upload_to=get_upload_to_submissions, storage=get_content_storage)
     submitted_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         db_table = 'submissions'
+        indexes = [models.Index(fields=['assignment', 'submitted_at', 'id'], name='submissions_assign_sub_idx')]
         verbose_name = 'submission'
         verbose_name_plural = 'submissions'
 
 
+class StoredBlob(models.Model):
+    """
+    Reference count of a content-addressed media blob across lession, assignment and submission rows.
+    """
+    digest = models.CharField(max_length=64, primary_key=True)
+    size = models.PositiveBigIntegerField(default=0)
+    refcount = models.IntegerField(default=0)
+    created_time = models.DateTimeField(auto_now_add=True)
+    updated_time = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'stored_blobs'
+        indexes = [models.Index(fields=['refcount', 'updated_time'], name='stored_blobs_refcount_idx')]
+        verbose_name = 'stored blob'
+        verbose_name_plural = 'stored blobs'
+
+
+class ChunkedUpload(models.Model):
+    """
+    A resumable upload of a lession/assignment/submission ``content`` file.
+
+    Chunks are written straight into ``file``, a storage name reserved under the target's
+    ``upload_to`` path, and the target's FileField is pointed at it once ``offset`` reaches ``size``.
+    A request writing a chunk holds ``locked_at`` so no other request writes into the file meanwhile.
+    """
+    TARGET_LESSION = 'lession'
+    TARGET_ASSIGNMENT = 'assignment'
+    TARGET_SUBMISSION = 'submission'
+    TARGET_CHOICES = (
+        (TARGET_LESSION, 'Lession'),
+        (TARGET_ASSIGNMENT, 'Assignment'),
+        (TARGET_SUBMISSION, 'Submission'),
+    )
+
+    STATUS_UPLOADING = 'uploading'
+    STATUS_COMPLETE = 'complete'
+    STATUS_CHOICES = (
+        (STATUS_UPLOADING, 'Uploading'),
+        (STATUS_COMPLETE, 'Complete'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey('users.CustomUser', related_name='chunked_uploads', on_delete=models.CASCADE)
+    target = models.CharField(max_length=20, choices=TARGET_CHOICES)
+    object_id = models.PositiveIntegerField()
+    filename = models.CharField(max_length=255)
+    file = models.CharField(max_length=255, blank=True, default='', editable=False)
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0, editable=False)
+    locked_at = models.DateTimeField(null=True, blank=True, editable=False)
+    sha256 = models.CharField(max_length=64, blank=True, default='')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_UPLOADING, editable=False)
+    created_time = models.DateTimeField(auto_now_add=True)
+    updated_time = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'chunked_uploads'
+        indexes = [models.Index(fields=['status', 'updated_time'], name='chunked_uploads_status_idx')]
+        verbose_name = 'chunked upload'
+        verbose_name_plural = 'chunked uploads'
+
+
 class Enrollment(models.Model):
     course = models.ForeignKey(Course, blank=False, null=False, related_name='course_enrollments', on_delete=models.CASCADE)
     user = models.ForeignKey('users.CustomUser', blank=False, null=False, related_name='user_enrollments', on_delete=models.CASCADE)
@@ -107,5 +223,6 @@ class Enrollment(models.Model):
 
     class Meta:
         db_table = 'enrollments'
+        indexes = [models.Index(fields=['user', 'enroll_time', 'id'], name='enrollments_user_time_idx')]
         verbose_name = 'enrollment'
         verbose_name_plural = 'enrollments'
\ No newline at end of file
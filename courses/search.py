@@ -0,0 +1,152 @@
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from .models import Category, Course
+
+
+class BaseSearchBackend:
+    """
+    Course search index.
+
+    ``search`` returns a list of ``(course_id, score)`` pairs ordered by relevance (lower
+    score is better) and accepts an ``after`` position of the last hit of the previous page.
+    With ``reverse`` it returns the hits before ``after`` instead, nearest first.
+    """
+
+    def index(self, course):
+        raise NotImplementedError
+
+    def remove(self, course_id):
+        raise NotImplementedError
+
+    def rebuild(self):
+        raise NotImplementedError
+
+    def search(self, text, category=None, min_price=None, max_price=None, limit=20, after=None, reverse=False):
+        raise NotImplementedError
+
+    @staticmethod
+    def tokenize(text):
+        return re.findall(r'\w+', text.lower())
+
+
+class SQLiteFTS5Backend(BaseSearchBackend):
+    """
+    Inverted index in an FTS5 virtual table whose rowid is the course id.
+    """
+    table = 'courses_fts'
+    # bm25 column weights: a title hit counts more than a description hit
+    weights = (10.0, 1.0)
+
+    def index(self, course):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [course.pk])
+            cursor.execute(
+                f'INSERT INTO {self.table} (rowid, title, description) VALUES (%s, %s, %s)',
+                [course.pk, course.title, course.description or '']
+            )
+
+    def remove(self, course_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [course_id])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            cursor.execute(
+                f'INSERT INTO {self.table} (rowid, title, description) '
+                f'SELECT id, title, coalesce(description, \'\') FROM {Course._meta.db_table}'
+            )
+
+    def build_match(self, text):
+        # Quote every term so user input cannot use FTS5 syntax, and prefix-match each one
+        return ' '.join(f'"{term}"*' for term in self.tokenize(text))
+
+    def search(self, text, category=None, min_price=None, max_price=None, limit=20, after=None, reverse=False):
+        match = self.build_match(text)
+        if not match:
+            return []
+
+        courses = Course._meta.db_table
+        course_categories = Course.category.through._meta.db_table
+        categories = Category._meta.db_table
+
+        where = [f'{self.table} MATCH %s']
+        params = [match]
+        if min_price is not None:
+            where.append('c.price >= %s')
+            params.append(min_price)
+        if max_price is not None:
+            where.append('c.price <= %s')
+            params.append(max_price)
+        if category is not None:
+            # Matches the category and all of its descendants through the materialized path
+            where.append(
+                f'EXISTS (SELECT 1 FROM {course_categories} cc JOIN {categories} cat ON cat.id = cc.category_id '
+                f'WHERE cc.course_id = c.id AND cat.path LIKE '
+                f'(SELECT path FROM {categories} WHERE id = %s) || \'%%\')'
+            )
+            params.append(category)
+
+        weights = ', '.join(str(weight) for weight in self.weights)
+        sql = (
+            f'SELECT c.id, bm25({self.table}, {weights}) AS score FROM {self.table} '
+            f'JOIN {courses} c ON c.id = {self.table}.rowid '
+            f'WHERE {" AND ".join(where)}'
+        )
+        seek, order = ('<', 'DESC') if reverse else ('>', 'ASC')
+        if after is not None:
+            sql = f'SELECT id, score FROM ({sql}) WHERE score {seek} %s OR (score = %s AND id {seek} %s)'
+            params += [after[0], after[0], after[1]]
+        sql += f' ORDER BY score {order}, id {order} LIMIT %s'
+        params.append(limit)
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [(course_id, score) for course_id, score in cursor.fetchall()]
+
+
+class DatabaseSearchBackend(BaseSearchBackend):
+    """
+    Unindexed ``icontains`` fallback for databases without a dedicated backend.
+
+    A Postgres backend would subclass BaseSearchBackend and use a ``tsvector`` column.
+    """
+
+    def index(self, course):
+        pass
+
+    def remove(self, course_id):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def search(self, text, category=None, min_price=None, max_price=None, limit=20, after=None, reverse=False):
+        queryset = Course.objects.all()
+        for term in self.tokenize(text):
+            queryset = queryset.filter(Q(title__icontains=term) | Q(description__icontains=term))
+        if min_price is not None:
+            queryset = queryset.filter(price__gte=min_price)
+        if max_price is not None:
+            queryset = queryset.filter(price__lte=max_price)
+        if category is not None:
+            path = Category.objects.filter(pk=category).values_list('path', flat=True).first() or ''
+            queryset = queryset.filter(category__path__startswith=path).distinct()
+        if after is not None:
+            queryset = queryset.filter(pk__lt=after[1]) if reverse else queryset.filter(pk__gt=after[1])
+        ordering = '-pk' if reverse else 'pk'
+        return [(course_id, 0.0) for course_id in queryset.order_by(ordering).values_list('pk', flat=True)[:limit]]
+
+
+def get_search_backend():
+    backend = getattr(settings, 'COURSE_SEARCH_BACKEND', None)
+    if backend:
+        return import_string(backend)()
+    if connection.vendor == 'sqlite':
+        return SQLiteFTS5Backend()
+    return DatabaseSearchBackend()
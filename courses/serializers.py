@@ -1,36 +1,92 @@
+import re
+
+from django.conf import settings
+from django.urls import reverse
+
 from rest_framework import serializers
 from rest_framework.exceptions import PermissionDenied, ValidationError
 
-from .models import Category, Course, Module, Lession, Assignment, Submission, Enrollment
-from users.serializers import CustomUserSerializer
+from OnlineLearning_Platform.images import ImageVariantsField
+
+from .uploads import validate_upload
+from .models import Category, ChunkedUpload, Course, Module, Lession, Assignment, Submission, Enrollment
 from users.models import CustomUser
 
 
 
+class ContentUrlField(serializers.SerializerMethodField):
+    """
+    Absolute URL of the access-checked download view for an object's ``content`` file.
+    """
+
+    def __init__(self, view_name, **kwargs):
+        self.view_name = view_name
+        super().__init__(**kwargs)
+
+    def to_representation(self, obj):
+        if not obj.content:
+            return None
+        url = reverse(self.view_name, args=[obj.pk])
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+
 class CategorySerializer(serializers.ModelSerializer):
+    avatar_variants = ImageVariantsField(source='avatar')
+
     class Meta:
         model = Category
-        fields = ('id', 'parent', 'title', 'avatar', 'created_time', 'updated_time')
+        fields = ('id', 'parent', 'title', 'avatar', 'avatar_variants', 'created_time', 'updated_time')
+
+    def validate_parent(self, parent):
+        category = self.instance
+        if parent is not None and category is not None and category.path and parent.path.startswith(category.path):
+            raise ValidationError("A category cannot be moved under itself or one of its descendants.")
+        return parent
+
+
+class CategoryListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        # Load every ancestor of the page in one query instead of walking up per category
+        categories = list(data.all() if hasattr(data, 'all') else data)
+        ancestor_ids = {pk for category in categories for pk in category.ancestor_ids}
+        ancestors = self.context.setdefault('category_ancestors', {})
+        missing = ancestor_ids - ancestors.keys()
+        if missing:
+            ancestors.update(Category.objects.in_bulk(missing))
+        return super().to_representation(categories)
 
 
 class CategoryDetailSerializer(serializers.ModelSerializer):
     parent = serializers.SerializerMethodField()
+    avatar_variants = ImageVariantsField(source='avatar')
 
     class Meta:
         model = Category
-        fields = ('id', 'parent', 'title', 'avatar', 'created_time', 'updated_time')
+        fields = ('id', 'parent', 'title', 'avatar', 'avatar_variants', 'created_time', 'updated_time')
+        list_serializer_class = CategoryListSerializer
 
     def get_parent(self, obj):
-        if obj.parent:
-            return CategoryDetailSerializer(obj.parent).data
-        return None
+        if not obj.parent_id:
+            return None
+
+        ancestors = self.context.setdefault('category_ancestors', {})
+        if obj.parent_id not in ancestors:
+            ancestors.update(Category.objects.in_bulk(obj.ancestor_ids or [obj.parent_id]))
+        return CategoryDetailSerializer(ancestors[obj.parent_id], context=self.context).data
 
 
 class CourseSerializer(serializers.ModelSerializer):
+    avatar_variants = ImageVariantsField(source='avatar')
 
     class Meta:
         model = Course
-        fields = ('id', 'category', 'title', 'description', 'avatar', 'price', 'instructor', 'students')
+        fields = ('id', 'category', 'title', 'description', 'avatar', 'avatar_variants', 'price', 'instructor', 'students', 'student_count')
+        read_only_fields = ('student_count',)
+        extra_kwargs = {
+            'students': {'write_only': True},
+        }
 
     def create(self, validated_data):
         request = self.context.get('request')
@@ -45,20 +101,32 @@ class CourseSerializer(serializers.ModelSerializer):
     def update(self, instance, validated_data):
         request = self.context.get('request')
         user = request.user
-        instructor = instance.instructor
 
-        if (user.is_student) or (user.username != instructor.username):
+        if (user.is_student) or (instance.instructor_id != user.pk):
             raise PermissionDenied('You do not have permission to update this submission.')
         return super().update(instance, validated_data)
 
+class CourseStudentSerializer(serializers.ModelSerializer):
+    """
+    Compact projection of a user for course rosters and course instructors.
+    """
+    avatar_variants = ImageVariantsField(source='avatar')
+
+    class Meta:
+        model = CustomUser
+        fields = ('id', 'username', 'first_name', 'last_name', 'avatar', 'avatar_variants')
+
+
 class CourseDetailSerializer(serializers.ModelSerializer):
     category = CategorySerializer(many=True)
-    instructor = CustomUserSerializer()
-    students = CustomUserSerializer(many=True)
+    instructor = CourseStudentSerializer()
+    avatar_variants = ImageVariantsField(source='avatar')
 
     class Meta:
         model = Course
-        fields = ('id', 'category', 'title', 'description', 'avatar', 'price', 'instructor', 'students', 'created_time', 'updated_time')
+        fields = ('id', 'category', 'title', 'description', 'avatar', 'avatar_variants', 'price', 'instructor', 'student_count', 'created_time', 'updated_time')
+        select_related = ('instructor',)
+        prefetch_related = ('category',)
 
 
 class ModuleSerializer(serializers.ModelSerializer):
@@ -67,64 +135,88 @@ class ModuleSerializer(serializers.ModelSerializer):
     class Meta:
         model = Module
         fields = ('id', 'course', 'title', 'lessions', 'created_time', 'updated_time')
+        prefetch_related = ('lessions',)
 
     def get_lessions(self, obj):
-        serializer = LessionSerializer(obj.lessions.all(), many=True)
-        data = serializer.data
-        return [id_['id'] for id_ in data]
+        return [lession.pk for lession in obj.lessions.all()]
     
     def update(self, instance, validated_data):
         request = self.context.get('request')
         user = request.user
         course = instance.course
-        instructor = course.instructor
 
-        if (user.is_student) or (user.username != instructor.username):
+        if (user.is_student) or (course.instructor_id != user.pk):
             raise PermissionDenied('You do not have permission to update this submission.')
         return super().update(instance, validated_data)
 
 
 class LessionSerializer(serializers.ModelSerializer):
+    content_url = ContentUrlField('lession-content')
 
     class Meta:
         model = Lession
-        fields = ('id', 'module', 'title', 'content', 'created_time', 'updated_time')
+        fields = ('id', 'module', 'title', 'content', 'content_url', 'created_time', 'updated_time')
+        # Files are downloaded from content_url; the stored name would reveal the blob digest
+        extra_kwargs = {'content': {'write_only': True}}
+
+    def validate(self, attrs):
+        content = attrs.get('content')
+        if content:
+            module = attrs.get('module') or self.instance.module
+            validate_upload(content, module.course, 'lession')
+        return attrs
 
     def update(self, instance, validated_data):
         request = self.context.get('request')
         user = request.user
         module = instance.module
         course = module.course
-        instructor = course.instructor
 
-        if (user.is_student) or (user.username != instructor.username):
+        if (user.is_student) or (course.instructor_id != user.pk):
             raise PermissionDenied('You do not have permission to update this submission.')
         return super().update(instance, validated_data)
     
 
 class AssignmentSerializer(serializers.ModelSerializer):
+    content_url = ContentUrlField('assignment-content')
 
     class Meta:
         model = Assignment
-        fields = ('id', 'module', 'title', 'content', 'created_time', 'updated_time', 'due_time')
+        fields = ('id', 'module', 'title', 'content', 'content_url', 'created_time', 'updated_time', 'due_time')
+        extra_kwargs = {'content': {'write_only': True}}
+
+    def validate(self, attrs):
+        content = attrs.get('content')
+        if content:
+            module = attrs.get('module') or self.instance.module
+            validate_upload(content, module.course, 'assignment')
+        return attrs
 
     def update(self, instance, validated_data):
         request = self.context.get('request')
         user = request.user
         module = instance.module
         course = module.course
-        instructor = course.instructor
 
-        if (user.is_student) or (user.username != instructor.username):
+        if (user.is_student) or (course.instructor_id != user.pk):
             raise PermissionDenied('You do not have permission to update this submission.')
         return super().update(instance, validated_data)
 
 
 class SubmissionSerializer(serializers.ModelSerializer):
+    content_url = ContentUrlField('submission-content')
 
     class Meta:
         model = Submission
-        fields = ('id', 'student', 'assignment', 'content', 'submitted_at')
+        fields = ('id', 'student', 'assignment', 'content', 'content_url', 'submitted_at')
+        extra_kwargs = {'content': {'write_only': True}}
+
+    def validate(self, attrs):
+        content = attrs.get('content')
+        if content:
+            assignment = attrs.get('assignment') or self.instance.assignment
+            validate_upload(content, assignment.module.course, 'submission')
+        return attrs
 
     def create(self, validated_data):
         request = self.context.get('request')
@@ -138,14 +230,68 @@ class SubmissionSerializer(serializers.ModelSerializer):
     def update(self, instance, validated_data):
         request = self.context.get('request')
         user = request.user
-        student = instance.student
 
-        if (student.username != user.username):
+        if (instance.student_id != user.pk):
             raise PermissionDenied("You do not have permission to update this submission.")
         
         return super().update(instance, validated_data)
         
 
+class OutlineLessionSerializer(serializers.ModelSerializer):
+    content_url = ContentUrlField('lession-content')
+
+    class Meta:
+        model = Lession
+        fields = ('id', 'title', 'content_url', 'created_time', 'updated_time')
+
+
+class OutlineAssignmentSerializer(serializers.ModelSerializer):
+    content_url = ContentUrlField('assignment-content')
+
+    class Meta:
+        model = Assignment
+        fields = ('id', 'title', 'content_url', 'due_time', 'created_time', 'updated_time')
+
+
+class OutlineModuleSerializer(serializers.ModelSerializer):
+    lessions = OutlineLessionSerializer(many=True)
+    assignments = OutlineAssignmentSerializer(many=True)
+
+    class Meta:
+        model = Module
+        fields = ('id', 'title', 'lessions', 'assignments', 'created_time', 'updated_time')
+
+
+class CourseOutlineSerializer(serializers.ModelSerializer):
+    """
+    The whole module -> lession/assignment tree of a course, for rendering a course page at once.
+    """
+    modules = OutlineModuleSerializer(many=True)
+
+    class Meta:
+        model = Course
+        fields = ('id', 'title', 'description', 'modules', 'updated_time')
+
+
+class ChunkedUploadSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = ChunkedUpload
+        fields = ('id', 'target', 'object_id', 'filename', 'size', 'offset', 'sha256', 'status', 'created_time', 'updated_time')
+        read_only_fields = ('offset', 'status')
+
+    def validate_size(self, size):
+        if size > settings.CHUNKED_UPLOAD_MAX_SIZE:
+            raise ValidationError(f'Uploads are limited to {settings.CHUNKED_UPLOAD_MAX_SIZE} bytes.')
+        return size
+
+    def validate_sha256(self, sha256):
+        sha256 = sha256.lower()
+        if sha256 and not re.fullmatch(r'[0-9a-f]{64}', sha256):
+            raise ValidationError('Expected a hex encoded SHA-256 digest.')
+        return sha256
+
+
 class EnrollSerializer(serializers.ModelSerializer):
 
     class Meta:
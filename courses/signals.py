@@ -0,0 +1,241 @@
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from users.models import CustomUser
+
+from .access import invalidate_course_access
+from .cache import bump_version
+from .models import Category, Course, Module, Lession, Assignment, Submission, Enrollment, StoredBlob
+from .search import get_search_backend
+
+
+def bump_course_content_version(course_id):
+    """
+    Invalidate cached course content (e.g. the outline) now and again on commit, so a read
+    racing the open transaction cannot keep old data under the new version.
+    """
+    if course_id is None:
+        return
+    bump_version('course-content', course_id)
+    transaction.on_commit(lambda: bump_version('course-content', course_id))
+
+
+def refresh_student_counts(course_ids):
+    """
+    Recompute the denormalized ``Course.student_count`` for the given courses in one UPDATE.
+    """
+    if not course_ids:
+        return
+    Enrolled = Course.students.through
+    counts = (
+        Enrolled.objects.filter(course_id=OuterRef('pk'))
+        .order_by().values('course_id')
+        .annotate(total=Count('*')).values('total')
+    )
+    Course.objects.filter(pk__in=course_ids).update(
+        student_count=Coalesce(Subquery(counts), 0),
+        updated_time=timezone.now(),
+    )
+    bump_catalog_versions(course_ids=course_ids)
+
+
+def bump_catalog_versions(course_ids=(), category_ids=()):
+    """
+    Invalidate cached catalog responses for the given courses/categories and their lists.
+    """
+    def bump():
+        for course_id in course_ids:
+            bump_version('course', course_id)
+        for category_id in category_ids:
+            bump_version('category', category_id)
+        if course_ids:
+            bump_version('course-list')
+        if category_ids:
+            bump_version('category-list')
+
+    bump()
+    transaction.on_commit(bump)
+
+
+@receiver(m2m_changed, sender=Course.students.through)
+def course_students_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action == 'pre_clear':
+            instance._cleared_student_ids = list(instance.students.values_list('pk', flat=True))
+        elif action == 'post_clear':
+            refresh_student_counts([instance.pk])
+            invalidate_course_access(getattr(instance, '_cleared_student_ids', []))
+        elif action in ('post_add', 'post_remove'):
+            refresh_student_counts([instance.pk])
+            invalidate_course_access(pk_set)
+        return
+
+    # Reverse side: ``instance`` is a user and ``pk_set`` holds course ids.
+    if action == 'pre_clear':
+        instance._cleared_course_ids = list(instance.enrolled_courses.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        refresh_student_counts(getattr(instance, '_cleared_course_ids', []))
+        invalidate_course_access([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        refresh_student_counts(pk_set)
+        invalidate_course_access([instance.pk])
+
+
+@receiver(pre_save, sender=Course)
+def remember_course_instructor(sender, instance, **kwargs):
+    if instance.pk is not None:
+        instance._previous_instructor_id = (
+            Course.objects.filter(pk=instance.pk).values_list('instructor_id', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Course)
+def course_instructor_changed(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_instructor_id', None)
+    if created or previous != instance.instructor_id:
+        invalidate_course_access({previous, instance.instructor_id})
+
+
+@receiver(post_delete, sender=Course)
+def course_deleted(sender, instance, **kwargs):
+    invalidate_course_access([instance.instructor_id])
+
+
+@receiver(post_save, sender=Enrollment)
+@receiver(post_delete, sender=Enrollment)
+def enrollment_changed(sender, instance, **kwargs):
+    invalidate_course_access([instance.user_id])
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def course_content_changed(sender, instance, **kwargs):
+    bump_course_content_version(instance.pk)
+
+
+@receiver(post_save, sender=Module)
+@receiver(post_delete, sender=Module)
+def module_changed(sender, instance, **kwargs):
+    bump_course_content_version(instance.course_id)
+
+
+@receiver(post_save, sender=Lession)
+@receiver(post_delete, sender=Lession)
+@receiver(post_save, sender=Assignment)
+@receiver(post_delete, sender=Assignment)
+def module_item_changed(sender, instance, **kwargs):
+    course_id = Module.objects.filter(pk=instance.module_id).values_list('course_id', flat=True).first()
+    bump_course_content_version(course_id)
+
+
+@receiver(post_save, sender=Course)
+def index_course(sender, instance, **kwargs):
+    get_search_backend().index(instance)
+
+
+@receiver(post_delete, sender=Course)
+def unindex_course(sender, instance, **kwargs):
+    get_search_backend().remove(instance.pk)
+
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def course_catalog_changed(sender, instance, **kwargs):
+    bump_catalog_versions(course_ids=[instance.pk])
+
+
+@receiver(m2m_changed, sender=Course.category.through)
+def course_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # category.courses.clear() sends no ids, so remember which courses lose the category
+        instance._cleared_course_ids = list(instance.courses.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        bump_catalog_versions(course_ids=[instance.pk])
+    elif action == 'post_clear':
+        bump_catalog_versions(course_ids=getattr(instance, '_cleared_course_ids', []))
+    elif pk_set:
+        bump_catalog_versions(course_ids=pk_set)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_catalog_changed(sender, instance, **kwargs):
+    # Descendants embed this category in their parent chain. A new category has no path
+    # yet at this point, and no descendants either.
+    descendant_ids = []
+    if instance.path:
+        descendant_ids = Category.objects.filter(path__startswith=instance.path).values_list('pk', flat=True)
+    bump_catalog_versions(category_ids={instance.pk, *descendant_ids})
+
+
+@receiver(post_save, sender=CustomUser)
+def instructor_changed(sender, instance, **kwargs):
+    # Course payloads embed the instructor
+    course_ids = list(Course.objects.filter(instructor=instance).values_list('pk', flat=True))
+    if course_ids:
+        bump_catalog_versions(course_ids=course_ids)
+
+
+def update_blob_refcounts(storage, added=(), removed=()):
+    """
+    Count references to content-addressed blobs; names outside the blob store are ignored.
+    """
+    now = timezone.now()
+    for name in added:
+        digest = storage.digest(name) if hasattr(storage, 'digest') else None
+        if digest:
+            StoredBlob.objects.get_or_create(digest=digest, defaults={'size': storage.size(name)})
+            StoredBlob.objects.filter(digest=digest).update(refcount=F('refcount') + 1, updated_time=now)
+    for name in removed:
+        digest = storage.digest(name) if hasattr(storage, 'digest') else None
+        if digest:
+            StoredBlob.objects.filter(digest=digest).update(refcount=F('refcount') - 1, updated_time=now)
+
+
+def _content_name(value):
+    return getattr(value, 'name', value) or ''
+
+
+@receiver(post_init, sender=Lession)
+@receiver(post_init, sender=Assignment)
+@receiver(post_init, sender=Submission)
+def remember_loaded_content(sender, instance, **kwargs):
+    # Read the raw attribute so a deferred ``content`` is not loaded here
+    if 'content' in instance.__dict__:
+        instance._loaded_content_name = _content_name(instance.__dict__['content'])
+
+
+@receiver(pre_save, sender=Lession)
+@receiver(pre_save, sender=Assignment)
+@receiver(pre_save, sender=Submission)
+def remember_previous_content(sender, instance, **kwargs):
+    if instance.pk is not None and not hasattr(instance, '_loaded_content_name'):
+        instance._loaded_content_name = (
+            sender.objects.filter(pk=instance.pk).values_list('content', flat=True).first() or ''
+        )
+
+
+@receiver(post_save, sender=Lession)
+@receiver(post_save, sender=Assignment)
+@receiver(post_save, sender=Submission)
+def content_blob_changed(sender, instance, created, **kwargs):
+    previous = '' if created else getattr(instance, '_loaded_content_name', '')
+    current = instance.content.name or ''
+    if current != previous:
+        update_blob_refcounts(instance.content.storage, added=[current], removed=[previous])
+    instance._loaded_content_name = current
+
+
+@receiver(post_delete, sender=Lession)
+@receiver(post_delete, sender=Assignment)
+@receiver(post_delete, sender=Submission)
+def content_blob_released(sender, instance, **kwargs):
+    name = getattr(instance, '_loaded_content_name', instance.content.name)
+    update_blob_refcounts(instance.content.storage, removed=[name])
@@ -0,0 +1,103 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, storages
+
+from OnlineLearning_Platform import metrics
+
+
+CHUNK_SIZE = 64 * 1024
+BLOB_NAME_RE = re.compile(r'^cas/([0-9a-f]{64})/')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Store every distinct file once, under the SHA-256 of its content.
+
+    A saved file is named ``cas/<digest>/<original filename>`` so downloads keep their
+    filename and type, while all names with the same digest share the single blob at
+    ``cas/blobs/<d0d1>/<d2d3>/<digest>``. Blobs are never deleted through the storage:
+    references are counted in ``StoredBlob`` and ``gc_media_blobs`` removes unreferenced ones.
+    Names that are not content addressed (files saved before this storage) work as usual.
+    """
+    blob_dir = os.path.join('cas', 'blobs')
+    tmp_dir = os.path.join('cas', 'tmp')
+
+    @staticmethod
+    def digest(name):
+        match = BLOB_NAME_RE.match(name or '')
+        return match.group(1) if match else None
+
+    def blob_path(self, digest):
+        return super().path(os.path.join(self.blob_dir, digest[:2], digest[2:4], digest))
+
+    def blob_name(self, digest, filename, max_length=None):
+        prefix = f'cas/{digest}/'
+        filename = os.path.basename(filename) or 'file'
+        if max_length is not None and len(prefix) + len(filename) > max_length:
+            stem, ext = os.path.splitext(filename)
+            filename = stem[:max(max_length - len(prefix) - len(ext), 1)] + ext
+        return prefix + filename
+
+    def path(self, name):
+        digest = self.digest(name)
+        if digest:
+            return self.blob_path(digest)
+        return super().path(name)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        tmp_root = super().path(self.tmp_dir)
+        os.makedirs(tmp_root, exist_ok=True)
+        digest = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=tmp_root, delete=False) as tmp:
+            try:
+                for chunk in content.chunks(CHUNK_SIZE):
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    digest.update(chunk)
+                    tmp.write(chunk)
+            except BaseException:
+                os.unlink(tmp.name)
+                raise
+        return self.ingest(tmp.name, digest.hexdigest(), name, max_length)
+
+    def ingest(self, path, digest, filename, max_length=None):
+        """
+        Move an already hashed local file into the blob store and return its name.
+
+        The file is dropped instead when a blob with the same digest exists.
+        """
+        blob_path = self.blob_path(digest)
+        try:
+            # Refresh the mtime so garbage collection treats the blob as just written. Touching
+            # instead of checking for the file means a blob being collected right now is not
+            # mistaken for an existing one.
+            os.utime(blob_path)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            if self.file_permissions_mode is not None:
+                os.chmod(path, self.file_permissions_mode)
+            os.replace(path, blob_path)
+            metrics.incr('media_blob_writes_total')
+        else:
+            os.unlink(path)
+            metrics.incr('media_blob_dedup_hits_total')
+        return self.blob_name(digest, filename, max_length)
+
+    def delete(self, name):
+        # Shared blobs are only removed by garbage collection
+        if self.digest(name):
+            return
+        super().delete(name)
+
+
+def get_content_storage():
+    return storages['course_content']
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe, quote_etag
+
+from rest_framework.renderers import BaseRenderer
+
+
+CHUNK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class PassthroughRenderer(BaseRenderer):
+    """
+    Accept any media type so file views are not rejected by DRF content negotiation
+    (e.g. ``Accept: video/*`` from a media element). Error payloads are rendered as JSON.
+    """
+    media_type = '*/*'
+    format = None
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return json.dumps(data).encode()
+
+
+def file_etag(name, size, modified_time):
+    return quote_etag(hashlib.sha1(f'{name}:{size}:{modified_time}'.encode()).hexdigest())
+
+
+def parse_range(header, size):
+    """
+    Parse a single ``bytes=`` range into ``(start, end)`` inclusive offsets.
+
+    Returns ``None`` when the header should be ignored (missing, malformed or multi-range)
+    and raises ``ValueError`` when it is well-formed but not satisfiable.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match:
+        return None
+
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError('Unsatisfiable range.')
+        return max(size - length, 0), size - 1
+
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError('Unsatisfiable range.')
+    return start, min(end, size - 1)
+
+
+def iter_file_range(file, start, length, chunk_size=CHUNK_SIZE):
+    try:
+        file.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = file.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def accel_response(fieldfile, content_type, filename):
+    """
+    Let the front proxy send the file: nginx ``X-Accel-Redirect`` or ``X-Sendfile``.
+    """
+    response = HttpResponse(content_type=content_type)
+    if settings.PROTECTED_MEDIA_SERVER == 'nginx':
+        # Location relative to MEDIA_ROOT, which differs from the name for content-addressed files
+        path = os.path.relpath(fieldfile.storage.path(fieldfile.name), fieldfile.storage.location)
+        response['X-Accel-Redirect'] = settings.PROTECTED_MEDIA_INTERNAL_URL + path.replace(os.sep, '/')
+    else:
+        response['X-Sendfile'] = fieldfile.storage.path(fieldfile.name)
+    response['Content-Disposition'] = content_disposition_header(False, filename)
+    return response
+
+
+def evaluate_range(request, size, etag, last_modified=None):
+    """
+    Apply conditional GET and ``Range``/``If-Range`` to a representation of ``size`` bytes.
+
+    Returns ``(response, byte_range)``: ``response`` is a finished 304/412/416 response to
+    return as-is, otherwise ``byte_range`` is an inclusive ``(start, end)`` or ``None`` for
+    the whole representation.
+    """
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        return response, None
+
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range and if_range != etag and (
+        last_modified is None or parse_http_date_safe(if_range) != int(last_modified)
+    ):
+        return None, None
+
+    try:
+        return None, parse_range(request.META.get('HTTP_RANGE'), size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response, None
+
+
+def partial_response(chunks, byte_range, size, content_type):
+    start, end = byte_range
+    response = StreamingHttpResponse(chunks, status=206, content_type=content_type)
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = str(end - start + 1)
+    return response
+
+
+def serve_protected_file(request, fieldfile):
+    """
+    Stream an access-checked FileField with ETag, conditional GET and single Range support.
+    """
+    filename = os.path.basename(fieldfile.name)
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    if getattr(settings, 'PROTECTED_MEDIA_SERVER', None):
+        return accel_response(fieldfile, content_type, filename)
+
+    storage = fieldfile.storage
+    size = storage.size(fieldfile.name)
+    modified_time = storage.get_modified_time(fieldfile.name)
+    etag = file_etag(fieldfile.name, size, modified_time.timestamp())
+    last_modified = modified_time.timestamp()
+
+    response, byte_range = evaluate_range(request, size, etag, last_modified)
+    if response is not None:
+        return response
+
+    file = storage.open(fieldfile.name, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type, filename=filename)
+    else:
+        start, end = byte_range
+        response = partial_response(iter_file_range(file, start, end - start + 1), byte_range, size, content_type)
+        response['Content-Disposition'] = content_disposition_header(False, filename)
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
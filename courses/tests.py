@@ -1,16 +1,45 @@
 # myapp/tests.py
 
-from django.test import TestCase
+import base64
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+import zipfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import Resolver404, URLResolver
+from django.urls.resolvers import RegexPattern
+from unittest import mock
+from django.utils import timezone
+from django.utils.http import http_date
+from PIL import Image
 
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from .models import Category, Course
+from . import uploads, urls
+from .access import user_can_access_course
+from .cache import single_flight
+from .streaming import serve_protected_file
+from .uploads import ValidatingUploadHandler, sniff_content_type
+from .models import Category, ChunkedUpload, Course, StoredBlob, Enrollment, Module, Lession, Assignment, Submission
 from users.models import CustomUser
 
 
 class CategoryListViewTests(TestCase):
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
         self.user = CustomUser.objects.create_user(username='testuser', email='testuser@gmail.com', password='testpassword')
         self.client.force_authenticate(user=self.user)
@@ -24,7 +53,7 @@ class CategoryListViewTests(TestCase):
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
-        data = response.json()
+        data = response.json()['results']
         self.assertEqual(len(data), 2)
         self.assertEqual(data[0]['title'], 'Category 1')
         self.assertEqual(data[1]['title'], 'Category 2')
@@ -53,6 +82,7 @@ class CategoryListViewTests(TestCase):
 
 class CategoryDetailViewTests(TestCase):
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
         self.user = CustomUser.objects.create_user(username='testuser', email='testuser@gmail.com', password='testpassword')
         self.client.force_authenticate(user=self.user)
@@ -83,4 +113,1159 @@ class CategoryDetailViewTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
 
-# Other apis
\ No newline at end of file
+# Other apis
+
+class CourseListViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.instructor = CustomUser.objects.create_user(username='instructor', email='instructor@gmail.com', password='testpassword', is_student=False)
+        self.user = CustomUser.objects.create_user(username='testuser', email='testuser@gmail.com', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        self.url = '/courses/'
+
+        self.category = Category.objects.create(title='Category 1')
+        for i in range(5):
+            course = Course.objects.create(title=f'Course {i}', instructor=self.instructor)
+            course.category.add(self.category)
+            course.students.add(self.user)
+
+    def test_list_courses_query_count(self):
+        print('Testing list courses query count')
+        with self.assertNumQueries(5):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()['results']), 5)
+
+    def test_filter_courses_by_category_query_count(self):
+        print('Testing filter courses by category query count')
+        with self.assertNumQueries(5):
+            response = self.client.get(self.url, {'category': self.category.pk})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()['results']), 5)
+
+    def test_instructor_is_a_compact_projection(self):
+        print('Testing course payloads embed a compact instructor')
+        with self.assertNumQueries(5) as queries:
+            response = self.client.get(self.url)
+        instructor = response.json()['results'][0]['instructor']
+        self.assertEqual(set(instructor), {'id', 'username', 'first_name', 'last_name', 'avatar', 'avatar_variants'})
+        self.assertFalse(any('"password"' in query['sql'] for query in queries.captured_queries))
+
+    def test_my_courses_query_count(self):
+        print('Testing my courses query count')
+        Course.objects.create(title='Not enrolled', instructor=self.instructor)
+        with self.assertNumQueries(5):
+            response = self.client.get('/my-courses/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()['results']), 5)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(username='testuser', email='testuser@gmail.com', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        self.url = '/categories/'
+
+        for i in range(7):
+            Category.objects.create(title=f'Category {i}')
+
+    def test_walk_pages_forward_and_back(self):
+        print('Testing keyset pagination forward and back')
+        seen = []
+        url = f'{self.url}?page_size=3'
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            data = response.json()
+            pages.append(data)
+            seen += [item['title'] for item in data['results']]
+            url = data['next']
+
+        self.assertEqual(seen, [f'Category {i}' for i in range(7)])
+        self.assertEqual([len(page['results']) for page in pages], [3, 3, 1])
+        self.assertIsNone(pages[0]['previous'])
+
+        response = self.client.get(pages[2]['previous'])
+        self.assertEqual([item['title'] for item in response.json()['results']], ['Category 3', 'Category 4', 'Category 5'])
+
+    def test_page_size_is_capped(self):
+        print('Testing keyset pagination page size cap')
+        with self.settings(MAX_PAGE_SIZE=4):
+            response = self.client.get(self.url, {'page_size': 1000})
+        self.assertEqual(len(response.json()['results']), 4)
+
+    def test_invalid_cursor(self):
+        print('Testing keyset pagination invalid cursor')
+        response = self.client.get(self.url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CourseStudentTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.instructor = CustomUser.objects.create_user(username='instructor', email='instructor@gmail.com', password='testpassword', is_student=False)
+        self.client.force_authenticate(user=self.instructor)
+
+        self.course = Course.objects.create(title='Course', instructor=self.instructor)
+        self.students = [
+            CustomUser.objects.create_user(username=f'student{i}', email=f'student{i}@gmail.com', password='testpassword')
+            for i in range(3)
+        ]
+
+    def test_student_count_follows_enrollment(self):
+        print('Testing student count follows enrollment')
+        self.course.students.add(*self.students)
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.student_count, 3)
+
+        self.students[0].enrolled_courses.remove(self.course)
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.student_count, 2)
+
+        self.students[1].enrolled_courses.clear()
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.student_count, 1)
+
+    def test_course_detail_has_count_not_roster(self):
+        print('Testing course detail has student count instead of roster')
+        self.course.students.add(*self.students)
+        response = self.client.get(f'/courses/{self.course.pk}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['student_count'], 3)
+        self.assertNotIn('students', response.data)
+
+    def test_course_roster(self):
+        print('Testing paginated course roster')
+        self.course.students.add(*self.students)
+        response = self.client.get(f'/courses/{self.course.pk}/students/', {'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual([user['username'] for user in data['results']], ['student0', 'student1'])
+        self.assertNotIn('password', data['results'][0])
+        self.assertIsNotNone(data['next'])
+
+    def test_course_roster_requires_access(self):
+        print('Testing course roster requires access')
+        outsider = CustomUser.objects.create_user(username='outsider', email='outsider@gmail.com', password='testpassword')
+        self.client.force_authenticate(user=outsider)
+        response = self.client.get(f'/courses/{self.course.pk}/students/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class CategoryTreeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(username='testuser', email='testuser@gmail.com', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+
+        self.root = Category.objects.create(title='Root')
+        self.child = Category.objects.create(title='Child', parent=self.root)
+        self.grandchild = Category.objects.create(title='Grandchild', parent=self.child)
+        self.other = Category.objects.create(title='Other')
+
+        self.root_course = Course.objects.create(title='Root course')
+        self.root_course.category.add(self.root)
+        self.deep_course = Course.objects.create(title='Deep course')
+        self.deep_course.category.add(self.grandchild, self.child)
+        self.other_course = Course.objects.create(title='Other course')
+        self.other_course.category.add(self.other)
+
+    def test_paths_follow_moves(self):
+        print('Testing category paths follow moves')
+        self.assertEqual(self.grandchild.depth, 2)
+        self.assertTrue(self.grandchild.path.startswith(self.root.path))
+
+        self.child.parent = self.other
+        self.child.save()
+        self.grandchild.refresh_from_db()
+        self.assertEqual(self.grandchild.ancestor_ids, [self.other.pk, self.child.pk])
+        self.assertEqual(self.grandchild.depth, 2)
+
+    def test_move_under_descendant_rejected(self):
+        print('Testing category cannot move under its descendant')
+        response = self.client.put(f'/categories/{self.root.pk}/', {'title': 'Root', 'parent': self.grandchild.pk}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_filter_courses_with_descendants(self):
+        print('Testing filter courses including sub-categories')
+        response = self.client.get('/courses/', {'category': self.root.pk, 'include_descendants': 1})
+        titles = sorted(course['title'] for course in response.json()['results'])
+        self.assertEqual(titles, ['Deep course', 'Root course'])
+
+        response = self.client.get('/courses/', {'category': self.root.pk})
+        self.assertEqual([course['title'] for course in response.json()['results']], ['Root course'])
+
+    def test_category_parent_chain_query_count(self):
+        print('Testing category parent chain query count')
+        with self.assertNumQueries(3):
+            response = self.client.get('/categories/')
+        data = response.json()['results']
+        self.assertEqual(data[2]['parent']['parent']['title'], 'Root')
+
+    def test_category_tree(self):
+        print('Testing category tree')
+        with self.assertNumQueries(1):
+            response = self.client.get('/categories/tree/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        tree = response.json()
+        self.assertEqual([node['title'] for node in tree], ['Root', 'Other'])
+        child = tree[0]['children'][0]
+        self.assertEqual((child['title'], child['course_count']), ('Child', 1))
+        self.assertEqual(child['children'][0]['title'], 'Grandchild')
+
+
+class CourseAccessCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.instructor = CustomUser.objects.create_user(username='instructor', email='instructor@gmail.com', password='testpassword', is_student=False)
+        self.other_instructor = CustomUser.objects.create_user(username='other', email='other@gmail.com', password='testpassword', is_student=False)
+        self.student = CustomUser.objects.create_user(username='student', email='student@gmail.com', password='testpassword')
+        self.course = Course.objects.create(title='Course', instructor=self.instructor)
+
+    def test_warm_access_check_runs_no_queries(self):
+        print('Testing warm access check runs no queries')
+        self.course.students.add(self.student)
+        self.assertTrue(user_can_access_course(self.student, self.course))
+        with self.assertNumQueries(0):
+            self.assertTrue(user_can_access_course(self.student, self.course))
+
+    def test_enrollment_invalidates_access(self):
+        print('Testing enrollment invalidates cached access')
+        self.assertFalse(user_can_access_course(self.student, self.course))
+        self.student.enrolled_courses.add(self.course)
+        self.assertTrue(user_can_access_course(self.student, self.course))
+        self.course.students.clear()
+        self.assertFalse(user_can_access_course(self.student, self.course))
+
+        Enrollment.objects.create(course=self.course, user=self.student)
+        self.course.students.add(self.student)
+        self.assertTrue(user_can_access_course(self.student, self.course))
+
+    def test_instructor_change_invalidates_access(self):
+        print('Testing instructor change invalidates cached access')
+        self.assertTrue(user_can_access_course(self.instructor, self.course))
+        self.assertFalse(user_can_access_course(self.other_instructor, self.course))
+
+        self.course.instructor = self.other_instructor
+        self.course.save()
+        self.assertFalse(user_can_access_course(self.instructor, self.course))
+        self.assertTrue(user_can_access_course(self.other_instructor, self.course))
+
+
+class CourseObjectDetailTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.instructor = CustomUser.objects.create_user(username='instructor', email='instructor@gmail.com', password='testpassword', is_student=False)
+        self.student = CustomUser.objects.create_user(username='student', email='student@gmail.com', password='testpassword')
+        self.outsider = CustomUser.objects.create_user(username='outsider', email='outsider@gmail.com', password='testpassword')
+
+        self.course = Course.objects.create(title='Course', instructor=self.instructor)
+        self.course.students.add(self.student)
+        self.module = Module.objects.create(course=self.course, title='Module')
+        self.lession = Lession.objects.create(module=self.module, title='Lession')
+        self.assignment = Assignment.objects.create(module=self.module, title='Assignment')
+        self.submission = Submission.objects.create(assignment=self.assignment, student=self.student)
+
+    def test_detail_views_resolve_in_one_query(self):
+        print('Testing detail views resolve object and access in one query')
+        self.client.force_authenticate(user=self.student)
+        for url in (f'/lessions/{self.lession.pk}/', f'/assignments/{self.assignment.pk}/', f'/submissions/{self.submission.pk}/'):
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_detail_views_check_access(self):
+        print('Testing detail views reject users without access')
+        self.client.force_authenticate(user=self.outsider)
+        response = self.client.get(f'/modules/{self.module.pk}/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.get('/lessions/0/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_instructor_update_reuses_loaded_chain(self):
+        print('Testing instructor update reuses the loaded course chain')
+        self.client.force_authenticate(user=self.instructor)
+        response = self.client.patch(f'/lessions/{self.lession.pk}/', {'title': 'Renamed'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.lession.refresh_from_db()
+        self.assertEqual(self.lession.title, 'Renamed')
+
+        self.client.force_authenticate(user=self.student)
+        response = self.client.patch(f'/lessions/{self.lession.pk}/', {'title': 'Hijacked'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class CourseOutlineTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.instructor = CustomUser.objects.create_user(username='instructor', email='instructor@gmail.com', password='testpassword', is_student=False)
+        self.student = CustomUser.objects.create_user(username='student', email='student@gmail.com', password='testpassword')
+        self.client.force_authenticate(user=self.student)
+
+        self.course = Course.objects.create(title='Course', instructor=self.instructor)
+        self.course.students.add(self.student)
+        for i in range(3):
+            module = Module.objects.create(course=self.course, title=f'Module {i}')
+            Lession.objects.create(module=module, title=f'Lession {i}')
+            Assignment.objects.create(module=module, title=f'Assignment {i}')
+        self.url = f'/courses/{self.course.pk}/outline/'
+
+    def test_outline_query_count_and_cache(self):
+        print('Testing course outline query count and cache')
+        user_can_access_course(self.student, self.course)
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        modules = response.data['modules']
+        self.assertEqual([module['title'] for module in modules], ['Module 0', 'Module 1', 'Module 2'])
+        self.assertEqual(modules[1]['lessions'][0]['title'], 'Lession 1')
+        self.assertEqual(modules[2]['assignments'][0]['title'], 'Assignment 2')
+
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+
+    def test_outline_invalidated_by_content_change(self):
+        print('Testing course outline is invalidated by content changes')
+        self.client.get(self.url)
+        module = Module.objects.filter(course=self.course).first()
+        Lession.objects.create(module=module, title='Extra')
+        response = self.client.get(self.url)
+        self.assertEqual([lession['title'] for lession in response.data['modules'][0]['lessions']], ['Lession 0', 'Extra'])
+
+    def test_outline_requires_access(self):
+        print('Testing course outline requires access')
+        outsider = CustomUser.objects.create_user(username='outsider', email='outsider@gmail.com', password='testpassword')
+        self.client.force_authenticate(user=outsider)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.get('/courses/0/outline/').status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.instructor = CustomUser.objects.create_user(username='instructor', email='instructor@gmail.com', password='testpassword', is_student=False)
+        self.client.force_authenticate(user=self.instructor)
+
+        self.course = Course.objects.create(title='Course', instructor=self.instructor)
+        self.module = Module.objects.create(course=self.course, title='Module')
+        self.lession = Lession.objects.create(module=self.module, title='Lession')
+
+    def test_list_not_modified(self):
+        print('Testing conditional GET on a list')
+        response = self.client.get('/courses/')
+        etag = response['ETag']
+        self.assertFalse(response.has_header('Last-Modified'))
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/courses/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        Course.objects.create(title='Another', instructor=self.instructor)
+        response = self.client.get('/courses/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_detail_not_modified(self):
+        print('Testing conditional GET on a detail')
+        url = f'/lessions/{self.lession.pk}/'
+        etag = self.client.get(url)['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.lession.title = 'Changed'
+        self.lession.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_removal_is_not_answered_by_modified_since(self):
+        print('Testing conditional GET after a row is removed')
+        student = CustomUser.objects.create_user(username='student', email='student@gmail.com', password='testpassword')
+        self.course.students.add(student)
+        self.client.force_authenticate(user=student)
+        response = self.client.get('/my-courses/')
+        self.assertEqual(len(response.data['results']), 1)
+
+        self.course.students.remove(student)
+        response = self.client.get('/my-courses/', HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [])
+
+        # A single object still gets Last-Modified
+        self.client.force_authenticate(user=self.instructor)
+        self.assertTrue(self.client.get(f'/lessions/{self.lession.pk}/').has_header('Last-Modified'))
+
+    def test_course_changes_with_its_instructor(self):
+        print('Testing course validators follow the embedded instructor')
+        for url in ('/courses/', f'/courses/{self.course.pk}/', '/my-courses/'):
+            etag = self.client.get(url)['ETag']
+            self.instructor.first_name = f'Name for {url}'
+            self.instructor.save()
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIn(self.instructor.first_name, response.content.decode())
+
+    def test_module_changes_with_its_lessions(self):
+        print('Testing module validators follow embedded lessions')
+        url = f'/modules/{self.module.pk}/'
+        etag = self.client.get(url)['ETag']
+        Lession.objects.create(module=self.module, title='Another')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+
+class CourseSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(username='testuser', email='testuser@gmail.com', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+        self.url = '/courses/search/'
+
+        self.programming = Category.objects.create(title='Programming')
+        self.web = Category.objects.create(title='Web', parent=self.programming)
+
+        self.python = Course.objects.create(title='Python basics', description='Learn programming', price=10)
+        self.python.category.add(self.web)
+        self.django = Course.objects.create(title='Django for the web', description='Build apps with Python', price=50)
+        self.cooking = Course.objects.create(title='Cooking', description='Pasta and pizza', price=5)
+
+    def search(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [course['title'] for course in response.json()['results']]
+
+    def test_prefix_match_and_ranking(self):
+        print('Testing course search prefix match and ranking')
+        self.assertEqual(self.search(q='pyth'), ['Python basics', 'Django for the web'])
+        self.assertEqual(self.search(q='pizza'), ['Cooking'])
+
+    def test_filters(self):
+        print('Testing course search filters')
+        self.assertEqual(self.search(q='python', min_price=20), ['Django for the web'])
+        self.assertEqual(self.search(q='python', category=self.programming.pk), ['Python basics'])
+
+    def test_index_follows_changes(self):
+        print('Testing course search index follows changes')
+        self.cooking.title = 'Baking'
+        self.cooking.save()
+        self.assertEqual(self.search(q='baking'), ['Baking'])
+        self.cooking.delete()
+        self.assertEqual(self.search(q='baking'), [])
+
+    def test_pagination_and_validation(self):
+        print('Testing course search pagination and validation')
+        response = self.client.get(self.url, {'q': 'python', 'page_size': 1})
+        data = response.json()
+        self.assertEqual(len(data['results']), 1)
+        self.assertEqual(data['previous'], None)
+        data = self.client.get(data['next']).json()
+        self.assertEqual([course['title'] for course in data['results']], ['Django for the web'])
+        self.assertEqual(data['next'], None)
+        data = self.client.get(data['previous']).json()
+        self.assertEqual([course['title'] for course in data['results']], ['Python basics'])
+        self.assertEqual(data['previous'], None)
+
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_400_BAD_REQUEST)
+        for position in (['x', 1], [1.5, 'x'], [None, 1], ['nan', 1], [[1], 2]):
+            cursor = base64.urlsafe_b64encode(json.dumps({'p': position, 'r': 0}).encode()).decode()
+            response = self.client.get(self.url, {'q': 'python', 'cursor': cursor})
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CatalogResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.instructor = CustomUser.objects.create_user(username='instructor', email='instructor@gmail.com', password='testpassword', is_student=False)
+        self.client.force_authenticate(user=self.instructor)
+
+        self.category = Category.objects.create(title='Category')
+        self.course = Course.objects.create(title='Course', instructor=self.instructor)
+        self.course.category.add(self.category)
+
+    def test_warm_catalog_reads_run_no_queries(self):
+        print('Testing warm catalog reads run no queries')
+        for url in ('/categories/', f'/categories/{self.category.pk}/', '/courses/', f'/courses/{self.course.pk}/'):
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+            with self.assertNumQueries(0):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_catalog_cache_invalidation(self):
+        print('Testing catalog cache invalidation')
+        self.client.get('/courses/')
+        self.client.get(f'/courses/{self.course.pk}/')
+
+        self.category.title = 'Renamed'
+        self.category.save()
+        response = self.client.get(f'/courses/{self.course.pk}/')
+        self.assertEqual(response.data['category'][0]['title'], 'Renamed')
+
+        student = CustomUser.objects.create_user(username='student', email='student@gmail.com', password='testpassword')
+        self.course.students.add(student)
+        response = self.client.get('/courses/')
+        self.assertEqual(response.data['results'][0]['student_count'], 1)
+
+    def test_clearing_a_category_refreshes_its_courses(self):
+        print('Testing catalog cache after clearing a category')
+        self.assertEqual(len(self.client.get(f'/courses/{self.course.pk}/').data['category']), 1)
+        self.category.courses.clear()
+        self.assertEqual(self.client.get(f'/courses/{self.course.pk}/').data['category'], [])
+
+    def test_single_flight(self):
+        print('Testing single flight cache fill')
+        calls = []
+        compute = lambda: calls.append(1) or 'value'
+        cache.add('flight:lock', 1)
+        self.assertEqual(single_flight('flight', compute, 60, wait=0.1, poll=0.01), 'value')
+        cache.delete('flight:lock')
+        self.assertEqual(single_flight('flight', compute, 60), 'value')
+        self.assertEqual(single_flight('flight', compute, 60), 'value')
+        self.assertEqual(len(calls), 2)
+
+
+class ProtectedContentTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+        self.client = APIClient()
+        self.instructor = CustomUser.objects.create_user(username='instructor', email='instructor@gmail.com', password='testpassword', is_student=False)
+        self.student = CustomUser.objects.create_user(username='student', email='student@gmail.com', password='testpassword')
+        self.other_student = CustomUser.objects.create_user(username='other', email='other@gmail.com', password='testpassword')
+        self.outsider = CustomUser.objects.create_user(username='outsider', email='outsider@gmail.com', password='testpassword')
+
+        self.course = Course.objects.create(title='Course', instructor=self.instructor)
+        self.course.students.add(self.student, self.other_student)
+        self.module = Module.objects.create(course=self.course, title='Module')
+        self.data = bytes(range(256)) * 4
+        self.lession = Lession.objects.create(module=self.module, title='Lession')
+        self.lession.content.save('video.mp4', ContentFile(self.data))
+        self.assignment = Assignment.objects.create(module=self.module, title='Assignment')
+        self.submission = Submission.objects.create(assignment=self.assignment, student=self.student)
+        self.submission.content.save('answer.txt', ContentFile(b'my answer'))
+        self.url = f'/lessions/{self.lession.pk}/content/'
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def test_full_download(self):
+        print('Testing full protected download')
+        self.client.force_authenticate(user=self.student)
+        response = self.client.get(self.url, HTTP_ACCEPT='video/*')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Type'], 'video/mp4')
+
+    def test_range_request(self):
+        print('Testing range request returns partial content')
+        self.client.force_authenticate(user=self.student)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.data)}')
+        self.assertEqual(b''.join(response.streaming_content), self.data[100:200])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(b''.join(response.streaming_content), self.data[-10:])
+
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.data)}-')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.data)}')
+
+    def test_if_range_mismatch_sends_full_file(self):
+        print('Testing stale If-Range falls back to the full file')
+        self.client.force_authenticate(user=self.student)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_conditional_get(self):
+        print('Testing protected download honours If-None-Match')
+        self.client.force_authenticate(user=self.student)
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_access_checks(self):
+        print('Testing protected downloads check access')
+        self.client.force_authenticate(user=self.outsider)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        response = self.client.get(f'/assignments/{self.assignment.pk}/content/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        submission_url = f'/submissions/{self.submission.pk}/content/'
+        self.client.force_authenticate(user=self.other_student)
+        response = self.client.get(submission_url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(user=self.instructor)
+        response = self.client.get(submission_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), b'my answer')
+
+    def test_missing_content(self):
+        print('Testing download of an object without content')
+        self.client.force_authenticate(user=self.student)
+        response = self.client.get(f'/assignments/{self.assignment.pk}/content/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_content_url(self):
+        print('Testing serializers expose the protected content url')
+        self.client.force_authenticate(user=self.student)
+        response = self.client.get(f'/lessions/{self.lession.pk}/')
+        self.assertTrue(response.data['content_url'].endswith(self.url))
+        self.assertNotIn('content', response.data)
+        self.assertNotIn(self.lession.content.name.split('/')[1], response.content.decode())
+
+    def test_accel_redirect(self):
+        print('Testing X-Accel-Redirect offload')
+        self.client.force_authenticate(user=self.student)
+        with override_settings(PROTECTED_MEDIA_SERVER='nginx'):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        digest = hashlib.sha256(self.data).hexdigest()
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/cas/blobs/{digest[:2]}/{digest[2:4]}/{digest}')
+        self.assertEqual(response.content, b'')
+
+    def test_blobs_are_not_served_as_media(self):
+        print('Testing content-addressed blobs are not exposed by the DEBUG media route')
+        resolver = URLResolver(RegexPattern(r'^/'), urls.media_urlpatterns)
+        blob = os.path.relpath(self.lession.content.path, self.media_root).replace(os.sep, '/')
+        self.assertTrue(blob.startswith('cas/blobs/'))
+        for path in (blob, self.lession.content.name):
+            with self.assertRaises(Resolver404):
+                resolver.resolve(f'/media/{path}')
+        self.assertEqual(resolver.resolve('/media/avatars/user.png').kwargs['path'], 'avatars/user.png')
+
+    def test_content_disposition_is_escaped(self):
+        print('Testing download filenames are escaped in Content-Disposition')
+        storage = FileSystemStorage(location=self.media_root)
+        name = storage.save('notes "final" résumé.txt', ContentFile(b'notes'))
+        fieldfile = mock.Mock(storage=storage)
+        fieldfile.name = name
+        expected = 'inline; filename*=utf-8\'\'notes%20%22final%22%20r%C3%A9sum%C3%A9.txt'
+
+        request = RequestFactory().get(self.url)
+        self.assertEqual(serve_protected_file(request, fieldfile)['Content-Disposition'], expected)
+        request = RequestFactory().get(self.url, HTTP_RANGE='bytes=0-1')
+        self.assertEqual(serve_protected_file(request, fieldfile)['Content-Disposition'], expected)
+        with override_settings(PROTECTED_MEDIA_SERVER='nginx'):
+            self.assertEqual(serve_protected_file(request, fieldfile)['Content-Disposition'], expected)
+
+
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+        self.client = APIClient()
+        self.instructor = CustomUser.objects.create_user(username='instructor', email='instructor@gmail.com', password='testpassword', is_student=False)
+        self.student = CustomUser.objects.create_user(username='student', email='student@gmail.com', password='testpassword')
+        self.course = Course.objects.create(title='Course', instructor=self.instructor)
+        self.course.students.add(self.student)
+        self.module = Module.objects.create(course=self.course, title='Module')
+        self.lession = Lession.objects.create(module=self.module, title='Lession')
+        self.data = b'\x00\x00\x00\x18ftypmp42' + os.urandom(988)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def initiate(self, **extra):
+        payload = {'target': 'lession', 'object_id': self.lession.pk, 'filename': 'video.mp4', 'size': len(self.data)}
+        payload.update(extra)
+        return self.client.post('/uploads/', payload, format='json')
+
+    def put_chunk(self, upload_id, start, end, **headers):
+        return self.client.generic(
+            'PUT', f'/uploads/{upload_id}/', self.data[start:end + 1], content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {start}-{end}/{len(self.data)}', **headers
+        )
+
+    def test_resumable_upload(self):
+        print('Testing resumable chunked upload')
+        self.client.force_authenticate(user=self.instructor)
+        response = self.initiate(sha256=hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        upload_id = response.data['id']
+        upload = ChunkedUpload.objects.get(pk=upload_id)
+        self.assertTrue(upload.file.startswith(f'courses/{self.course.pk}/{self.module.pk}/lessions/'))
+
+        response = self.put_chunk(upload_id, 0, 399, HTTP_X_CHUNK_SHA256=hashlib.sha256(self.data[:400]).hexdigest())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Upload-Offset'], '400')
+
+        # A retried or skipped chunk is rejected with the offset to resume from
+        response = self.put_chunk(upload_id, 500, 999)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response['Upload-Offset'], '400')
+
+        response = self.client.head(f'/uploads/{upload_id}/')
+        self.assertEqual(response['Upload-Offset'], '400')
+
+        response = self.client.post(f'/uploads/{upload_id}/complete/')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        response = self.put_chunk(upload_id, 400, 999)
+        self.assertEqual(response['Upload-Offset'], '1000')
+
+        response = self.client.post(f'/uploads/{upload_id}/complete/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.lession.refresh_from_db()
+        self.assertEqual(self.lession.content.name, f'cas/{hashlib.sha256(self.data).hexdigest()}/video.mp4')
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, upload.file)))
+        with self.lession.content.open('rb') as file:
+            self.assertEqual(file.read(), self.data)
+
+    def test_bad_chunk_checksum_is_rolled_back(self):
+        print('Testing chunk with a bad checksum is rolled back')
+        self.client.force_authenticate(user=self.instructor)
+        upload_id = self.initiate().data['id']
+        response = self.put_chunk(upload_id, 0, 499, HTTP_X_CHUNK_SHA256='0' * 64)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        upload = ChunkedUpload.objects.get(pk=upload_id)
+        self.assertEqual(upload.offset, 0)
+        self.assertEqual(os.path.getsize(os.path.join(self.media_root, upload.file)), 0)
+
+    def test_file_checksum_mismatch(self):
+        print('Testing finalize rejects a file checksum mismatch')
+        self.client.force_authenticate(user=self.instructor)
+        upload_id = self.initiate(sha256='0' * 64).data['id']
+        self.put_chunk(upload_id, 0, 999)
+        response = self.client.post(f'/uploads/{upload_id}/complete/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.lession.refresh_from_db()
+        self.assertFalse(self.lession.content)
+
+    def test_upload_permissions(self):
+        print('Testing only the instructor can upload course content')
+        self.client.force_authenticate(user=self.student)
+        response = self.initiate()
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(user=self.instructor)
+        upload_id = self.initiate().data['id']
+        self.client.force_authenticate(user=self.student)
+        response = self.put_chunk(upload_id, 0, 999)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_upload_limits(self):
+        print('Testing chunked uploads apply the course size limit and type check')
+        self.client.force_authenticate(user=self.instructor)
+        Course.objects.filter(pk=self.course.pk).update(max_upload_size=500)
+        response = self.initiate()
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        Course.objects.filter(pk=self.course.pk).update(max_upload_size=None)
+        upload_id = self.initiate().data['id']
+        self.data = b'MZ\x90\x00' + b'\x00' * 8 + self.data[12:]
+        response = self.put_chunk(upload_id, 0, 499)
+        self.assertEqual(response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        self.assertEqual(ChunkedUpload.objects.get(pk=upload_id).offset, 0)
+
+    def test_chunk_waits_for_a_writer_in_progress(self):
+        print('Testing a chunk is not written while another request holds the upload')
+        self.client.force_authenticate(user=self.instructor)
+        upload_id = self.initiate().data['id']
+        ChunkedUpload.objects.filter(pk=upload_id).update(locked_at=timezone.now())
+        response = self.put_chunk(upload_id, 0, 499)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response['Upload-Offset'], '0')
+        path = os.path.join(self.media_root, ChunkedUpload.objects.get(pk=upload_id).file)
+        self.assertEqual(os.path.getsize(path), 0)
+
+        # A claim left behind by a crashed request expires
+        ChunkedUpload.objects.filter(pk=upload_id).update(
+            locked_at=timezone.now() - timedelta(seconds=settings.CHUNKED_UPLOAD_LOCK_TIMEOUT + 1)
+        )
+        response = self.put_chunk(upload_id, 0, 499)
+        self.assertEqual(response['Upload-Offset'], '500')
+        self.assertIsNone(ChunkedUpload.objects.get(pk=upload_id).locked_at)
+
+    def test_failed_chunk_releases_the_upload(self):
+        print('Testing a rejected chunk releases its claim')
+        self.client.force_authenticate(user=self.instructor)
+        upload_id = self.initiate().data['id']
+        self.put_chunk(upload_id, 0, 499, HTTP_X_CHUNK_SHA256='0' * 64)
+        self.assertIsNone(ChunkedUpload.objects.get(pk=upload_id).locked_at)
+        self.assertEqual(self.put_chunk(upload_id, 0, 499).status_code, status.HTTP_200_OK)
+
+    def test_finalize_uses_running_checksum(self):
+        print('Testing finalize does not re-read the uploaded file')
+        self.client.force_authenticate(user=self.instructor)
+        upload_id = self.initiate(sha256=hashlib.sha256(self.data).hexdigest()).data['id']
+        self.put_chunk(upload_id, 0, 399)
+        # The next chunk reaches a process that did not see the first one
+        uploads.forget_digest(uuid.UUID(upload_id))
+        self.put_chunk(upload_id, 400, 999)
+        with mock.patch.object(uploads, 'open', side_effect=AssertionError('file re-read'), create=True):
+            response = self.client.post(f'/uploads/{upload_id}/complete/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(ChunkedUpload.objects.get(pk=upload_id).sha256, hashlib.sha256(self.data).hexdigest())
+
+    def test_complete_is_claimed_once(self):
+        print('Testing concurrent and retried completion of an upload')
+        self.client.force_authenticate(user=self.instructor)
+        upload_id = self.initiate().data['id']
+        self.put_chunk(upload_id, 0, 999)
+
+        # Another request is completing the upload
+        ChunkedUpload.objects.filter(pk=upload_id).update(locked_at=timezone.now())
+        response = self.client.post(f'/uploads/{upload_id}/complete/')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        ChunkedUpload.objects.filter(pk=upload_id).update(locked_at=None)
+        first = self.client.post(f'/uploads/{upload_id}/complete/')
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        retried = self.client.post(f'/uploads/{upload_id}/complete/')
+        self.assertEqual(retried.status_code, status.HTTP_200_OK)
+        self.assertEqual(retried.data, first.data)
+        self.assertIsNone(ChunkedUpload.objects.get(pk=upload_id).locked_at)
+
+    def test_chunk_without_body(self):
+        print('Testing a chunk without a body is rejected')
+        self.client.force_authenticate(user=self.instructor)
+        upload_id = self.initiate().data['id']
+        response = self.client.generic('PUT', f'/uploads/{upload_id}/', HTTP_CONTENT_RANGE=f'bytes 0-499/{len(self.data)}')
+        self.assertEqual(response.status_code, status.HTTP_411_LENGTH_REQUIRED)
+        self.assertIsNone(ChunkedUpload.objects.get(pk=upload_id).locked_at)
+
+    def test_abort_removes_partial_file(self):
+        print('Testing aborting an upload removes its file')
+        self.client.force_authenticate(user=self.instructor)
+        upload_id = self.initiate().data['id']
+        self.put_chunk(upload_id, 0, 499)
+        path = os.path.join(self.media_root, ChunkedUpload.objects.get(pk=upload_id).file)
+
+        response = self.client.delete(f'/uploads/{upload_id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(ChunkedUpload.objects.filter(pk=upload_id).exists())
+
+
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+        self.instructor = CustomUser.objects.create_user(username='instructor', email='instructor@gmail.com', password='testpassword', is_student=False)
+        self.course = Course.objects.create(title='Course', instructor=self.instructor)
+        self.module1 = Module.objects.create(course=self.course, title='Module 1')
+        self.module2 = Module.objects.create(course=self.course, title='Module 2')
+        self.data = b'%PDF-1.4 shared handout'
+        self.digest = hashlib.sha256(self.data).hexdigest()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def blob_path(self):
+        return os.path.join(self.media_root, 'cas', 'blobs', self.digest[:2], self.digest[2:4], self.digest)
+
+    def make_lession(self, module, filename):
+        lession = Lession.objects.create(module=module, title='Lession')
+        lession.content.save(filename, ContentFile(self.data))
+        return lession
+
+    def collect(self):
+        # Backdate everything so the grace period does not protect it
+        StoredBlob.objects.update(updated_time=timezone.now() - timedelta(hours=2))
+        if os.path.exists(self.blob_path()):
+            os.utime(self.blob_path(), (0, 0))
+        call_command('gc_media_blobs', stdout=StringIO())
+
+    def test_identical_files_share_a_blob(self):
+        print('Testing identical uploads are stored once')
+        lession1 = self.make_lession(self.module1, 'handout.pdf')
+        lession2 = self.make_lession(self.module2, 'copy.pdf')
+
+        self.assertEqual(lession1.content.name, f'cas/{self.digest}/handout.pdf')
+        self.assertEqual(lession2.content.name, f'cas/{self.digest}/copy.pdf')
+        self.assertTrue(os.path.exists(self.blob_path()))
+        self.assertEqual(len(os.listdir(os.path.dirname(self.blob_path()))), 1)
+        self.assertEqual(StoredBlob.objects.get(pk=self.digest).refcount, 2)
+
+        with lession2.content.open('rb') as file:
+            self.assertEqual(file.read(), self.data)
+
+    def test_gc_removes_unreferenced_blobs(self):
+        print('Testing garbage collection of unreferenced blobs')
+        lession1 = self.make_lession(self.module1, 'handout.pdf')
+        lession2 = self.make_lession(self.module2, 'copy.pdf')
+
+        lession1.delete()
+        self.collect()
+        self.assertTrue(os.path.exists(self.blob_path()))
+        self.assertEqual(StoredBlob.objects.get(pk=self.digest).refcount, 1)
+
+        lession2.content.save('other.pdf', ContentFile(b'different'))
+        self.assertEqual(StoredBlob.objects.get(pk=self.digest).refcount, 0)
+        self.collect()
+        self.assertFalse(os.path.exists(self.blob_path()))
+        self.assertFalse(StoredBlob.objects.filter(pk=self.digest).exists())
+
+    def test_gc_keeps_a_blob_reused_while_collecting(self):
+        print('Testing garbage collection keeps a blob an ingest reuses meanwhile')
+        lession = self.make_lession(self.module1, 'handout.pdf')
+        lession.delete()
+        StoredBlob.objects.update(updated_time=timezone.now() - timedelta(hours=2))
+        os.utime(self.blob_path(), (0, 0))
+
+        real_replace = os.replace
+
+        def ingest_then_replace(src, dst):
+            # Another upload of the same file refreshes the blob just before it is moved aside
+            if src == self.blob_path():
+                os.utime(src)
+            real_replace(src, dst)
+
+        with mock.patch('courses.management.commands.gc_media_blobs.os.replace', side_effect=ingest_then_replace):
+            call_command('gc_media_blobs', stdout=StringIO())
+        self.assertTrue(os.path.exists(self.blob_path()))
+        self.assertTrue(StoredBlob.objects.filter(pk=self.digest).exists())
+
+    def test_recount_repairs_drift(self):
+        print('Testing gc --recount repairs reference counts')
+        self.make_lession(self.module1, 'handout.pdf')
+        StoredBlob.objects.update(refcount=0)
+
+        StoredBlob.objects.update(updated_time=timezone.now() - timedelta(hours=2))
+        os.utime(self.blob_path(), (0, 0))
+        call_command('gc_media_blobs', '--recount', stdout=StringIO())
+        self.assertTrue(os.path.exists(self.blob_path()))
+        self.assertEqual(StoredBlob.objects.get(pk=self.digest).refcount, 1)
+
+
+@override_settings(IMAGE_VARIANTS_ASYNC=False)
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+        self.client = APIClient()
+        self.user = CustomUser.objects.create_user(username='testuser', email='testuser@gmail.com', password='testpassword')
+        self.client.force_authenticate(user=self.user)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def image_file(self, name='cover.png'):
+        buffer = BytesIO()
+        Image.new('RGBA', (1200, 800), (200, 30, 30, 255)).save(buffer, 'PNG')
+        return ContentFile(buffer.getvalue(), name=name)
+
+    def test_variants_generated_on_save(self):
+        print('Testing image variants are generated when an avatar is saved')
+        with self.captureOnCommitCallbacks(execute=True):
+            category = Category.objects.create(title='Category', avatar=self.image_file())
+
+        thumb = os.path.join(self.media_root, 'categories', 'variants', 'cover.thumb.webp')
+        card = os.path.join(self.media_root, 'categories', 'variants', 'cover.card.jpg')
+        with Image.open(thumb) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (160, 160)))
+        with Image.open(card) as image:
+            self.assertEqual((image.format, image.size), ('JPEG', (480, 270)))
+
+        response = self.client.get(f'/categories/{category.pk}/')
+        self.assertTrue(response.data['avatar_variants']['thumb']['webp'].endswith('/media/categories/variants/cover.thumb.webp'))
+
+        # Saving without changing the image does not regenerate the variants
+        os.remove(thumb)
+        with self.captureOnCommitCallbacks(execute=True):
+            category.title = 'Renamed'
+            category.save()
+        self.assertFalse(os.path.exists(thumb))
+
+    def test_no_avatar(self):
+        print('Testing avatar variants are null without an avatar')
+        course = Course.objects.create(title='Course')
+        response = self.client.get(f'/courses/{course.pk}/')
+        self.assertIsNone(response.data['avatar_variants'])
+
+    def test_backfill_command(self):
+        print('Testing image variant backfill command')
+        Course.objects.create(title='Course', avatar=self.image_file('course.png'))
+        thumb = os.path.join(self.media_root, 'variants', 'course.thumb.webp')
+        self.assertFalse(os.path.exists(thumb))
+
+        call_command('generate_image_variants', '--model', 'course', stdout=StringIO())
+        self.assertTrue(os.path.exists(thumb))
+
+
+class SubmissionExportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+        self.client = APIClient()
+        self.instructor = CustomUser.objects.create_user(username='instructor', email='instructor@gmail.com', password='testpassword', is_student=False)
+        self.alice = CustomUser.objects.create_user(username='alice', email='alice@gmail.com', password='testpassword')
+        self.bob = CustomUser.objects.create_user(username='bob', email='bob@gmail.com', password='testpassword')
+        self.course = Course.objects.create(title='Course', instructor=self.instructor)
+        self.course.students.add(self.alice, self.bob)
+        self.module = Module.objects.create(course=self.course, title='Module')
+        self.assignment = Assignment.objects.create(module=self.module, title='Assignment', due_time=timezone.now() + timedelta(days=1))
+
+        self.alice_submission = Submission.objects.create(assignment=self.assignment, student=self.alice)
+        self.alice_submission.content.save('essay.txt', ContentFile(b'alice essay ' * 500))
+        self.bob_submission = Submission.objects.create(assignment=self.assignment, student=self.bob)
+        self.bob_submission.content.save('essay.txt', ContentFile(b'bob essay ' * 700))
+        Submission.objects.filter(pk=self.bob_submission.pk).update(submitted_at=timezone.now() + timedelta(days=2))
+        Submission.objects.create(assignment=self.assignment, student=self.alice)
+
+        self.url = f'/assignments/{self.assignment.pk}/submissions/export/'
+        self.client.force_authenticate(user=self.instructor)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def download(self, **headers):
+        response = self.client.get(self.url, **headers)
+        return response, b''.join(response.streaming_content)
+
+    def test_export_archive(self):
+        print('Testing submission export archive and manifest')
+        response, data = self.download()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(int(response['Content-Length']), len(data))
+
+        archive = zipfile.ZipFile(BytesIO(data))
+        self.assertIsNone(archive.testzip())
+        alice_name = f'alice/{self.alice_submission.pk}_essay.txt'
+        bob_name = f'bob/{self.bob_submission.pk}_essay.txt'
+        self.assertEqual(archive.namelist(), ['manifest.csv', alice_name, bob_name])
+        self.assertEqual(archive.read(bob_name), b'bob essay ' * 700)
+
+        rows = archive.read('manifest.csv').decode().splitlines()
+        self.assertEqual(len(rows), 4)
+        late = {row.split(',')[2] + ':' + row.split(',')[6]: row.split(',')[5] for row in rows[1:]}
+        self.assertEqual(late[f'alice:{alice_name}'], 'no')
+        self.assertEqual(late[f'bob:{bob_name}'], 'yes')
+        self.assertEqual(late['alice:'], 'no')
+
+    def test_resume_with_range(self):
+        print('Testing submission export resumes with Range')
+        response, full = self.download()
+        etag = response['ETag']
+
+        # Without cached CRCs the descriptors must still come out identical
+        cache.clear()
+        split = len(full) // 2
+        response, head = self.download(HTTP_RANGE=f'bytes=0-{split - 1}', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        cache.clear()
+        response, tail = self.download(HTTP_RANGE=f'bytes={split}-', HTTP_IF_RANGE=etag)
+        self.assertEqual(response['Content-Range'], f'bytes {split}-{len(full) - 1}/{len(full)}')
+        self.assertEqual(head + tail, full)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_export_changes_etag(self):
+        print('Testing submission export ETag follows the submissions')
+        etag = self.client.get(self.url)['ETag']
+        self.alice_submission.content.save('essay-v2.txt', ContentFile(b'rewritten'))
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_export_is_instructor_only(self):
+        print('Testing only the instructor can export submissions')
+        self.client.force_authenticate(user=self.alice)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class UploadValidationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+        self.client = APIClient()
+        self.instructor = CustomUser.objects.create_user(username='instructor', email='instructor@gmail.com', password='testpassword', is_student=False)
+        self.student = CustomUser.objects.create_user(username='student', email='student@gmail.com', password='testpassword')
+        self.course = Course.objects.create(title='Course', instructor=self.instructor, max_upload_size=2048)
+        self.course.students.add(self.student)
+        self.module = Module.objects.create(course=self.course, title='Module')
+        self.assignment = Assignment.objects.create(module=self.module, title='Assignment')
+        self.client.force_authenticate(user=self.student)
+        self.url = f'/submissions/?assignment={self.assignment.pk}'
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def submit(self, data, url=None, name='answer.pdf'):
+        upload = ContentFile(data, name=name)
+        return self.client.post(url or self.url, {'assignment': self.assignment.pk, 'content': upload}, format='multipart')
+
+    def test_sniff_content_type(self):
+        print('Testing content types are sniffed from magic bytes')
+        self.assertEqual(sniff_content_type(b'%PDF-1.7\n'), 'application/pdf')
+        self.assertEqual(sniff_content_type(b'\x89PNG\r\n\x1a\n....'), 'image/png')
+        self.assertEqual(sniff_content_type('résumé'.encode()[:-1]), 'text/plain')
+        self.assertIsNone(sniff_content_type(b'MZ\x90\x00\x03\x00'))
+
+    def test_accepts_allowed_file(self):
+        print('Testing an allowed submission file is accepted')
+        response = self.submit(b'%PDF-1.4 my answer')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_rejects_disallowed_type(self):
+        print('Testing a disallowed submission type is rejected')
+        response = self.submit(b'MZ\x90\x00' + b'\x00' * 100, name='answer.pdf')
+        self.assertEqual(response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        self.assertFalse(Submission.objects.exists())
+
+    def test_rejects_oversize_while_streaming(self):
+        print('Testing an oversize submission is rejected while streaming')
+        handler_limits = []
+        original = ValidatingUploadHandler.receive_data_chunk
+
+        def receive_data_chunk(handler, raw_data, start):
+            handler_limits.append(handler.max_size)
+            return original(handler, raw_data, start)
+
+        with mock.patch.object(ValidatingUploadHandler, 'receive_data_chunk', receive_data_chunk):
+            response = self.submit(b'%PDF-1.4 ' + b'x' * 4096)
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertEqual(handler_limits[0], 2048)
+        self.assertFalse(Submission.objects.exists())
+
+    def test_course_limit_applies_without_query_string(self):
+        print('Testing the course limit is enforced after parsing without a hint')
+        response = self.submit(b'%PDF-1.4 ' + b'x' * 4096, url='/submissions/')
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    def test_rejects_oversize_body_before_reading(self):
+        print('Testing an oversize request body is rejected up front')
+        with override_settings(MAX_UPLOAD_SIZE=10, DATA_UPLOAD_MAX_MEMORY_SIZE=10):
+            response = self.submit(b'%PDF-1.4 ' + b'x' * 4096, url='/submissions/')
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
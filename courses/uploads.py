@@ -0,0 +1,314 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler
+
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound, PermissionDenied, ValidationError
+
+from .models import ChunkedUpload, Lession, Assignment, Submission
+
+
+CHUNK_SIZE = 64 * 1024
+SNIFF_BYTES = 4096
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+# target -> (model, lookup from the model to its course)
+UPLOAD_TARGETS = {
+    ChunkedUpload.TARGET_LESSION: (Lession, 'module__course'),
+    ChunkedUpload.TARGET_ASSIGNMENT: (Assignment, 'module__course'),
+    ChunkedUpload.TARGET_SUBMISSION: (Submission, 'assignment__module__course'),
+}
+
+
+# (offset, magic bytes, content type), checked in order
+MAGIC_NUMBERS = (
+    (0, b'%PDF-', 'application/pdf'),
+    (0, b'PK\x03\x04', 'application/zip'),
+    (0, b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'application/x-ole-storage'),
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (0, b'\xff\xd8\xff', 'image/jpeg'),
+    (0, b'GIF87a', 'image/gif'),
+    (0, b'GIF89a', 'image/gif'),
+    (8, b'WEBP', 'image/webp'),
+    (4, b'ftyp', 'video/mp4'),
+    (0, b'\x1a\x45\xdf\xa3', 'video/webm'),
+    (0, b'ID3', 'audio/mpeg'),
+    (0, b'\xff\xfb', 'audio/mpeg'),
+    (0, b'OggS', 'audio/ogg'),
+    (0, b'7z\xbc\xaf\x27\x1c', 'application/x-7z-compressed'),
+    (0, b'Rar!\x1a\x07', 'application/vnd.rar'),
+)
+
+
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'The uploaded file is too large.'
+    default_code = 'upload_too_large'
+
+
+class UnsupportedUploadType(APIException):
+    status_code = status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+    default_detail = 'This type of file is not allowed here.'
+    default_code = 'unsupported_upload_type'
+
+
+def sniff_content_type(head):
+    """
+    Identify a file from its first bytes; ``text/plain`` for NUL-free UTF-8, otherwise ``None``.
+    """
+    for offset, magic, content_type in MAGIC_NUMBERS:
+        if head[offset:offset + len(magic)] == magic:
+            return content_type
+    if head and b'\x00' not in head:
+        try:
+            # The sample may end in the middle of a multi-byte character
+            head.decode('utf-8')
+        except UnicodeDecodeError as error:
+            if error.start < len(head) - 3:
+                return None
+        return 'text/plain'
+    return None
+
+
+def get_upload_limit(course):
+    return (course.max_upload_size if course is not None else None) or settings.MAX_UPLOAD_SIZE
+
+
+def check_upload_head(head, target):
+    content_type = sniff_content_type(head)
+    if content_type not in settings.UPLOAD_ALLOWED_TYPES[target]:
+        raise UnsupportedUploadType(f'Files of type {content_type or "unknown"} are not allowed here.')
+    return content_type
+
+
+def check_upload_size(size, limit):
+    if size > limit:
+        raise UploadTooLarge(f'Files are limited to {limit} bytes.')
+
+
+def validate_upload(file, course, target):
+    """
+    Check a parsed upload against the course size limit and the allowed types of ``target``.
+    """
+    check_upload_size(file.size, get_upload_limit(course))
+    position = file.tell()
+    file.seek(0)
+    head = file.read(SNIFF_BYTES)
+    file.seek(position)
+    check_upload_head(head, target)
+
+
+class ValidatingUploadHandler(FileUploadHandler):
+    """
+    First upload handler for content endpoints: rejects a file while it streams in.
+
+    A body larger than the limit (plus the space ordinary form fields may take) is refused
+    before it is read, the type is sniffed from the first chunk, and the upload is aborted as
+    soon as the received bytes pass the limit. Raising here stops the multipart parser, so the
+    handlers after it (memory or temporary file) never receive the rest of the body.
+    """
+
+    def __init__(self, request=None, max_size=None, target=None):
+        super().__init__(request)
+        self.max_size = max_size
+        self.target = target
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        check_upload_size(content_length, self.max_size + settings.DATA_UPLOAD_MAX_MEMORY_SIZE)
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        if start == 0:
+            check_upload_head(raw_data[:SNIFF_BYTES], self.target)
+        self.received += len(raw_data)
+        check_upload_size(self.received, self.max_size)
+        return raw_data
+
+    def file_complete(self, file_size):
+        if file_size == 0:
+            check_upload_head(b'', self.target)
+        return None
+
+
+def get_upload_target(target, object_id, user):
+    """
+    Load the object a chunked upload writes into, checking that ``user`` may replace its content.
+
+    Course content can be uploaded by the course instructor, a submission by its author.
+    """
+    model, course_path = UPLOAD_TARGETS[target]
+    select_related = [course_path]
+    if target == ChunkedUpload.TARGET_SUBMISSION:
+        select_related.append('student')
+
+    obj = model.objects.select_related(*select_related).filter(pk=object_id).first()
+    if obj is None:
+        raise NotFound(f"{model._meta.verbose_name.capitalize()} not found.")
+
+    if target == ChunkedUpload.TARGET_SUBMISSION:
+        allowed = obj.student_id == user.pk
+    else:
+        course = get_target_course(obj, target)
+        allowed = not user.is_student and course.instructor_id == user.pk
+    if not allowed:
+        raise PermissionDenied("You do not have permission to upload content for this object.")
+    return obj
+
+
+def get_target_course(obj, target):
+    course = obj
+    for name in UPLOAD_TARGETS[target][1].split('__'):
+        course = getattr(course, name)
+    return course
+
+
+def reserve_upload_file(obj, filename):
+    """
+    Claim the final storage name for ``filename`` under the object's ``upload_to`` path.
+
+    The file is created exclusively, so concurrent uploads of the same filename cannot end
+    up writing into the same file.
+    """
+    field = obj._meta.get_field('content')
+    storage = field.storage
+    name = field.generate_filename(obj, os.path.basename(filename))
+    while True:
+        name = storage.get_available_name(name, max_length=field.max_length)
+        path = storage.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+        except FileExistsError:
+            continue
+        return name
+
+
+def attach_upload_file(upload, obj):
+    """
+    Point the object's ``content`` at a finished upload, moving it into the blob store
+    when the field uses content-addressed storage.
+    """
+    field = obj._meta.get_field('content')
+    name = upload.file
+    if hasattr(field.storage, 'ingest'):
+        name = field.storage.ingest(field.storage.path(name), upload.sha256, upload.filename, field.max_length)
+    obj.content.name = name
+    obj.save()
+
+
+def upload_path(upload):
+    model, _ = UPLOAD_TARGETS[upload.target]
+    return model._meta.get_field('content').storage.path(upload.file)
+
+
+def delete_upload_file(upload):
+    model, _ = UPLOAD_TARGETS[upload.target]
+    if upload.file:
+        model._meta.get_field('content').storage.delete(upload.file)
+
+
+def parse_content_range(header, size):
+    """
+    Parse a ``Content-Range: bytes start-end/total`` chunk header into ``(start, end)``.
+    """
+    match = CONTENT_RANGE_RE.match(header.strip()) if header else None
+    if not match:
+        raise ValidationError({'Content-Range': 'Expected "bytes <start>-<end>/<total>".'})
+
+    start, end, total = (int(value) for value in match.groups())
+    if total != size:
+        raise ValidationError({'Content-Range': f'Total size must be {size}.'})
+    if end < start or end >= size:
+        raise ValidationError({'Content-Range': 'Invalid byte range.'})
+    if end - start + 1 > settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE:
+        raise ValidationError({'Content-Range': f'Chunks are limited to {settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE} bytes.'})
+    return start, end
+
+
+def write_chunk(path, start, length, stream, sha256=None, running=None):
+    """
+    Copy ``length`` bytes from ``stream`` into ``path`` at ``start``, hashing them on the way.
+    ``running``, the digest of the file before ``start``, is updated with them too.
+
+    Only ``CHUNK_SIZE`` bytes are held in memory at a time. A short body or a checksum mismatch
+    truncates the file back to ``start`` so the chunk can simply be retried.
+    """
+    digest = hashlib.sha256()
+    remaining = length
+    with open(path, 'r+b') as file:
+        file.seek(start)
+        while remaining > 0:
+            data = stream.read(min(CHUNK_SIZE, remaining))
+            if not data:
+                break
+            file.write(data)
+            digest.update(data)
+            if running is not None:
+                running.update(data)
+            remaining -= len(data)
+
+        error = None
+        if remaining:
+            error = 'Request body is shorter than the Content-Range.'
+        elif sha256 and digest.hexdigest() != sha256.lower():
+            error = 'Chunk checksum does not match.'
+        if error:
+            file.truncate(start)
+            raise ValidationError({'detail': error})
+    return digest.hexdigest()
+
+
+def read_head(path):
+    with open(path, 'rb') as file:
+        return file.read(SNIFF_BYTES)
+
+
+# upload id -> (offset, SHA-256 of the upload's bytes before it), most recently used last
+_running_digests = OrderedDict()
+_running_digests_lock = threading.Lock()
+RUNNING_DIGESTS_MAX = 1024
+
+
+def running_digest(upload, path):
+    """
+    SHA-256 of the first ``upload.offset`` bytes of the upload, to be continued with the next chunk.
+
+    hashlib state cannot be stored, so it is kept in memory by the process that wrote the
+    previous chunk; a chunk (or the finalize) reaching another process hashes the file so far once.
+    """
+    with _running_digests_lock:
+        entry = _running_digests.get(upload.pk)
+    if entry is not None and entry[0] == upload.offset:
+        return entry[1].copy()
+
+    digest = hashlib.sha256()
+    remaining = upload.offset
+    with open(path, 'rb') as file:
+        while remaining > 0:
+            data = file.read(min(CHUNK_SIZE, remaining))
+            if not data:
+                break
+            digest.update(data)
+            remaining -= len(data)
+    return digest
+
+
+def remember_digest(upload_pk, offset, digest):
+    with _running_digests_lock:
+        _running_digests[upload_pk] = (offset, digest)
+        _running_digests.move_to_end(upload_pk)
+        while len(_running_digests) > RUNNING_DIGESTS_MAX:
+            _running_digests.popitem(last=False)
+
+
+def forget_digest(upload_pk):
+    with _running_digests_lock:
+        _running_digests.pop(upload_pk, None)
@@ -1,14 +1,17 @@
+import re
+
 from django.conf import settings
-from django.conf.urls.static import static
-from django.urls import path
+from django.urls import path, re_path
+from django.views.static import serve
 
 from .views import (
-    CategoryListView, CategoryDetailView,
-    CourseListView,  CourseDetailView, MyCourseListView,
+    CategoryListView, CategoryDetailView, CategoryTreeView,
+    CourseListView,  CourseDetailView, CourseSearchView, CourseStudentListView, CourseOutlineView, MyCourseListView,
     ModuleListView, ModuleDetailView,
-    LessionListView, LessionDetailView,
-    AssignmentListView, AssignmentDetailView,
-    SubmissionListView, SubmissionDetailView,
+    LessionListView, LessionDetailView, LessionContentView,
+    AssignmentListView, AssignmentDetailView, AssignmentContentView,
+    SubmissionListView, SubmissionDetailView, SubmissionContentView, SubmissionExportView,
+    ChunkedUploadCreateView, ChunkedUploadDetailView, ChunkedUploadCompleteView,
     EnrollListView
 )
 
@@ -16,9 +19,13 @@ from .views import (
 urlpatterns = [
     path('categories/', CategoryListView.as_view(), name='category-list'),
     path('categories/<int:pk>/', CategoryDetailView.as_view(), name='category-detail'),
+    path('categories/tree/', CategoryTreeView.as_view(), name='category-tree'),
 
     path('courses/', CourseListView.as_view(), name='course-list'),
     path('courses/<int:pk>/', CourseDetailView.as_view(), name='course-detail'),
+    path('courses/search/', CourseSearchView.as_view(), name='course-search'),
+    path('courses/<int:pk>/students/', CourseStudentListView.as_view(), name='course-students'),
+    path('courses/<int:pk>/outline/', CourseOutlineView.as_view(), name='course-outline'),
     path('my-courses/', MyCourseListView.as_view(), name='my-course-list'),
 
     path('modules/', ModuleListView.as_view(), name='module-for-course'),
@@ -26,15 +33,30 @@ urlpatterns = [
 
     path('lessions/', LessionListView.as_view(), name='lessions-for-module'),
     path('lessions/<int:pk>/', LessionDetailView.as_view(), name='lession-detail'),
+    path('lessions/<int:pk>/content/', LessionContentView.as_view(), name='lession-content'),
     
     path('assignments/', AssignmentListView.as_view(), name='assignment-for-module'),
     path('assignments/<int:pk>/', AssignmentDetailView.as_view(), name='assignment-detail'),
+    path('assignments/<int:pk>/content/', AssignmentContentView.as_view(), name='assignment-content'),
+    path('assignments/<int:pk>/submissions/export/', SubmissionExportView.as_view(), name='submission-export'),
 
     path('submissions/', SubmissionListView.as_view(), name='submission-for-assignment'),
     path('submissions/<int:pk>/', SubmissionDetailView.as_view(), name='submission-detail'),
+    path('submissions/<int:pk>/content/', SubmissionContentView.as_view(), name='submission-content'),
+
+    path('uploads/', ChunkedUploadCreateView.as_view(), name='chunked-upload-create'),
+    path('uploads/<uuid:pk>/', ChunkedUploadDetailView.as_view(), name='chunked-upload-detail'),
+    path('uploads/<uuid:pk>/complete/', ChunkedUploadCompleteView.as_view(), name='chunked-upload-complete'),
 
     path('enrolls/', EnrollListView.as_view(), name='enroll-list'),
 ]
 
+# Course and submission files, content-addressed blobs included, are only reachable
+# through the access-checked content views
+media_prefix = re.escape(settings.MEDIA_URL.lstrip('/'))
+media_urlpatterns = [
+    re_path(rf'^{media_prefix}(?P<path>(?!courses/|assignments/|cas/).*)$', serve, {'document_root': settings.MEDIA_ROOT}),
+]
+
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+    urlpatterns += media_urlpatterns
\ No newline at end of file
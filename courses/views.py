@@ -1,24 +1,57 @@
+import math
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Prefetch, Q, Subquery
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework import generics
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
-from rest_framework.exceptions import PermissionDenied, NotFound
+from rest_framework.exceptions import PermissionDenied, NotFound, ValidationError
+from rest_framework.renderers import JSONRenderer
 
+from OnlineLearning_Platform.pagination import KeysetPagination
+
+from .access import user_can_access_course, user_can_access_course_pk
+from .cache import get_version
+from .mixins import (
+    CachedResponseMixin, ConditionalGetMixin, CourseObjectMixin, QueryPlanMixin, UploadValidationMixin,
+    get_deferred_fields, get_query_plan
+)
+from .search import get_search_backend
+from .exports import build_submission_export
+from .streaming import PassthroughRenderer, evaluate_range, partial_response, serve_protected_file
+from .uploads import (
+    UnsupportedUploadType, attach_upload_file, check_upload_head, check_upload_size, delete_upload_file, forget_digest,
+    get_target_course, get_upload_limit, get_upload_target, parse_content_range, read_head, remember_digest,
+    reserve_upload_file, running_digest, upload_path, write_chunk
+)
 from .serializers import (
     CategorySerializer, CategoryDetailSerializer,
-    CourseSerializer, CourseDetailSerializer,
+    CourseSerializer, CourseDetailSerializer, CourseStudentSerializer, CourseOutlineSerializer,
     ModuleSerializer,
-    LessionSerializer, AssignmentSerializer, SubmissionSerializer, EnrollSerializer
+    LessionSerializer, AssignmentSerializer, SubmissionSerializer, EnrollSerializer, ChunkedUploadSerializer
 )
 from .models import (
-    Category, Course, Module, Lession, Assignment, Submission, Enrollment
+    Category, ChunkedUpload, Course, Module, Lession, Assignment, Submission, Enrollment
 )
+from users.models import CustomUser
 
 
-class CategoryListView(generics.ListCreateAPIView):
+class CategoryListView(CachedResponseMixin, ConditionalGetMixin, generics.ListCreateAPIView):
     queryset = Category.objects.all()
     permission_classes = [IsAuthenticated]
+    cache_namespace = 'category'
+
+    def get_cache_versions(self):
+        return [('category-list',)]
 
     def get_serializer_class(self):
         if self.request.method == 'POST':
@@ -26,66 +59,233 @@ class CategoryListView(generics.ListCreateAPIView):
         return CategoryDetailSerializer
 
 
-class CategoryDetailView(generics.RetrieveUpdateAPIView):
+class CategoryDetailView(CachedResponseMixin, ConditionalGetMixin, generics.RetrieveUpdateAPIView):
     queryset = Category.objects.all()
     permission_classes = [IsAuthenticated]
+    cache_namespace = 'category'
+
+    def get_cache_versions(self):
+        return [('category', self.kwargs['pk'])]
 
     def get_serializer_class(self):
         if self.request.method in ['PUT', 'PATCH']:
             return CategorySerializer
         return CategoryDetailSerializer
 
+    def get_conditional_dependencies(self, obj=None):
+        # The nested parent chain is part of the payload
+        return [Category.objects.filter(pk__in=obj.ancestor_ids)]
+
 
-class CourseListView(generics.ListCreateAPIView):
+class CategoryTreeView(APIView):
     permission_classes = [IsAuthenticated]
 
+    def get(self, request):
+        categories = Category.objects.annotate(course_count=Count('courses')).order_by('path')
+
+        nodes = {}
+        roots = []
+        for category in categories:
+            node = {
+                'id': category.id,
+                'title': category.title,
+                'avatar': request.build_absolute_uri(category.avatar.url) if category.avatar else None,
+                'depth': category.depth,
+                'course_count': category.course_count,
+                'children': [],
+            }
+            nodes[category.id] = node
+            # Ordering by path guarantees a parent is seen before its children
+            parent = nodes.get(category.parent_id)
+            (parent['children'] if parent else roots).append(node)
+
+        return Response(roots, status=status.HTTP_200_OK)
+
+
+class CourseListView(CachedResponseMixin, ConditionalGetMixin, QueryPlanMixin, generics.ListCreateAPIView):
+    queryset = Course.objects.all()
+    permission_classes = [IsAuthenticated]
+    cache_namespace = 'course'
+
+    def get_cache_versions(self):
+        # Courses embed their categories, and the category filter depends on the tree
+        return [('course-list',), ('category-list',)]
+
     def get_serializer_class(self):
         if self.request.method == 'POST':
             return CourseSerializer
         return CourseDetailSerializer
     
     def get_queryset(self):
-        queryset = Course.objects.all()
+        queryset = super().get_queryset()
 
         category_pk = self.request.GET.get('category')
+        include_descendants = self.request.GET.get('include_descendants') in ('1', 'true')
+
+        if category_pk and include_descendants:
+            # Match the whole subtree by path prefix, resolved inside the same query
+            path = Category.objects.filter(pk=category_pk).values('path')[:1]
+            return queryset.filter(category__path__startswith=Subquery(path)).distinct()
 
         if category_pk:
             return queryset.filter(category=category_pk)
 
         return queryset
 
+    def get_conditional_dependencies(self, obj=None):
+        courses = self.filter_queryset(self.get_queryset())
+        return [Category.objects.all(), CustomUser.objects.filter(pk__in=courses.values('instructor'))]
+
 
-class CourseDetailView(generics.RetrieveUpdateAPIView):
+class CourseSearchView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        params = request.query_params
+        text = params.get('q', '').strip()
+        if not text:
+            return Response({'q': ['This query parameter is required.']}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            category = int(params['category']) if params.get('category') else None
+            min_price = Decimal(params['min_price']) if params.get('min_price') else None
+            max_price = Decimal(params['max_price']) if params.get('max_price') else None
+        except (ValueError, InvalidOperation):
+            return Response({'detail': 'Invalid filter value.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        paginator = KeysetPagination()
+        paginator.ordering = ('score', 'id')
+        paginator.base_url = request.build_absolute_uri()
+        limit = paginator.get_page_size(request)
+        position, reverse = paginator.decode_cursor(request)
+        if position is not None:
+            # The (score, id) position is passed to the search backend's raw SQL
+            try:
+                position = [float(position[0]), int(position[1])]
+            except (TypeError, ValueError, OverflowError):
+                raise NotFound(paginator.invalid_cursor_message)
+            if not math.isfinite(position[0]):
+                raise NotFound(paginator.invalid_cursor_message)
+
+        hits = get_search_backend().search(
+            text, category=category, min_price=min_price, max_price=max_price,
+            limit=limit + 1, after=position, reverse=reverse
+        )
+        has_more = len(hits) > limit
+        hits = hits[:limit]
+        if reverse:
+            hits.reverse()
+
+        # Same rules as KeysetPagination, with (score, id) positions
+        paginator.next_position = paginator.previous_position = None
+        if hits:
+            first, last = list(hits[0][::-1]), list(hits[-1][::-1])
+            if reverse:
+                paginator.next_position = last
+                paginator.previous_position = first if has_more else None
+            else:
+                paginator.next_position = last if has_more else None
+                paginator.previous_position = first if position is not None else None
+        elif reverse:
+            paginator.next_position = position
+        else:
+            paginator.previous_position = position
+
+        select_related, prefetch_related = get_query_plan(CourseDetailSerializer)
+        courses = Course.objects.select_related(*select_related).prefetch_related(*prefetch_related)
+        courses = courses.defer(*get_deferred_fields(CourseDetailSerializer)).in_bulk([course_id for course_id, _ in hits])
+        results = [courses[course_id] for course_id, _ in hits if course_id in courses]
+
+        serializer = CourseDetailSerializer(results, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
+
+
+class CourseDetailView(CachedResponseMixin, ConditionalGetMixin, QueryPlanMixin, generics.RetrieveUpdateAPIView):
     queryset = Course.objects.all()
     permission_classes = [IsAuthenticated]
+    cache_namespace = 'course'
+
+    def get_cache_versions(self):
+        return [('course', self.kwargs['pk']), ('category-list',)]
 
     def get_serializer_class(self):
         if self.request.method in ['PUT', 'PATCH']:
             return CourseSerializer
         return CourseDetailSerializer
-        
 
-class MyCourseListView(generics.ListAPIView):
+    def get_conditional_dependencies(self, obj=None):
+        return [Category.objects.filter(courses=obj), CustomUser.objects.filter(instructed_courses=obj)]
+
+
+
+class MyCourseListView(ConditionalGetMixin, QueryPlanMixin, generics.ListAPIView):
+    queryset = Course.objects.all()
     serializer_class = CourseDetailSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
         user = self.request.user
-        enrolled_courses = user.enrolled_courses.all()
-        instructed_courses = user.instructed_courses.all()
-        courses = enrolled_courses.union(instructed_courses)
-        return courses
+        # A single filter instead of union() so the query plan can still be applied
+        queryset = super().get_queryset()
+        return queryset.filter(Q(students=user) | Q(instructor=user)).distinct()
 
-def user_can_access_course(user, course):
-    """
-    Check if the user can access the course
-    """
-    has_enrolled = user.enrolled_courses.filter(pk=course.pk).exists()
-    is_course_instructor = course.instructor.username == user.username and not user.is_student
-    return has_enrolled or is_course_instructor
+    def get_conditional_dependencies(self, obj=None):
+        courses = self.filter_queryset(self.get_queryset())
+        return [Category.objects.all(), CustomUser.objects.filter(pk__in=courses.values('instructor'))]
+
+
+class CourseStudentListView(generics.ListAPIView):
+    serializer_class = CourseStudentSerializer
+    permission_classes = [IsAuthenticated]
+    cursor_ordering = ('date_joined', 'id')
+
+    def get_queryset(self):
+        course_pk = self.kwargs.get('pk')
+        user = self.request.user
 
+        try:
+            course = Course.objects.get(pk=course_pk)
+        except Course.DoesNotExist:
+            raise NotFound("Course not found.")
 
-class ModuleListView(generics.ListCreateAPIView):
+        if not user_can_access_course(user, course):
+            raise PermissionDenied("You do not have permission to access this course.")
+
+        fields = [field for field in CourseStudentSerializer.Meta.fields if field != 'avatar_variants']
+        return course.students.only(*fields, 'date_joined')
+
+
+class CourseOutlineView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        if not user_can_access_course_pk(request.user, pk):
+            if not Course.objects.filter(pk=pk).exists():
+                raise NotFound("Course not found.")
+            raise PermissionDenied("You do not have permission to access this course.")
+
+        key = f'course-outline:{pk}:{get_version("course-content", pk)}:{request.get_host()}'
+        data = cache.get(key)
+        if data is None:
+            data = self.build_outline(request, pk)
+            cache.set(key, data, getattr(settings, 'COURSE_OUTLINE_CACHE_TIMEOUT', 60 * 60))
+        return Response(data, status=status.HTTP_200_OK)
+
+    def build_outline(self, request, pk):
+        ordering = ('created_time', 'id')
+        modules = Module.objects.order_by(*ordering).prefetch_related(
+            Prefetch('lessions', queryset=Lession.objects.order_by(*ordering)),
+            Prefetch('assignments', queryset=Assignment.objects.order_by(*ordering)),
+        )
+        try:
+            course = Course.objects.prefetch_related(Prefetch('modules', queryset=modules)).get(pk=pk)
+        except Course.DoesNotExist:
+            raise NotFound("Course not found.")
+        return CourseOutlineSerializer(course, context={'request': request}).data
+
+
+class ModuleListView(ConditionalGetMixin, QueryPlanMixin, generics.ListCreateAPIView):
+    queryset = Module.objects.all()
     serializer_class = ModuleSerializer
     permission_classes = [IsAuthenticated]
 
@@ -98,37 +298,37 @@ class ModuleListView(generics.ListCreateAPIView):
                 course = Course.objects.get(pk=course_pk)
                 
                 if user_can_access_course(user, course):
-                    return Module.objects.filter(course=course)
+                    return super().get_queryset().filter(course=course)
                 
                 raise PermissionDenied("You do not have permission to access this course.")
             except Course.DoesNotExist:
                 raise NotFound("Course not found.")
         return Module.objects.none()
 
+    def get_conditional_dependencies(self, obj=None):
+        # Lession ids are embedded in each module
+        return [Lession.objects.filter(module__in=self.get_queryset())]
+
 
-class ModuleDetailView(generics.RetrieveUpdateAPIView):
+class ModuleDetailView(ConditionalGetMixin, CourseObjectMixin, QueryPlanMixin, generics.RetrieveUpdateAPIView):
+    queryset = Module.objects.all()
     serializer_class = ModuleSerializer
     permission_classes = [IsAuthenticated]
+    course_path = 'course'
+    not_found_message = "Module not found."
 
-    def get_queryset(self):
-        module_pk = self.kwargs.get('pk')
-        user = self.request.user
+    def get_conditional_dependencies(self, obj=None):
+        return [Lession.objects.filter(module=obj)]
 
-        try:
-            module = Module.objects.get(pk=module_pk)
-        except Module.DoesNotExist:
-            raise NotFound("Module not found.")
-        
-        course = module.course
-
-        if not user_can_access_course(user, course):
-            raise PermissionDenied("You do not have permission to access this course.")
 
-        return Module.objects.filter(pk=module_pk)
-
-class LessionListView(generics.ListCreateAPIView):
+class LessionListView(UploadValidationMixin, ConditionalGetMixin, generics.ListCreateAPIView):
     serializer_class = LessionSerializer
     permission_classes = [IsAuthenticated]
+    upload_target = 'lession'
+
+    def get_upload_course_filter(self):
+        module_pk = self.request.query_params.get('module', '')
+        return Q(modules=module_pk) if module_pk.isdigit() else None
 
     def get_queryset(self):
         module_pk = self.request.query_params.get('module', None)
@@ -136,7 +336,7 @@ class LessionListView(generics.ListCreateAPIView):
         
         if module_pk is not None:
             try:
-                module = Module.objects.get(pk=module_pk)
+                module = Module.objects.select_related('course').get(pk=module_pk)
                 course = module.course
 
                 if user_can_access_course(user, course):
@@ -150,29 +350,26 @@ class LessionListView(generics.ListCreateAPIView):
         return Lession.objects.none()
 
 
-class LessionDetailView(generics.RetrieveUpdateAPIView):
+class LessionDetailView(UploadValidationMixin, ConditionalGetMixin, CourseObjectMixin, generics.RetrieveUpdateAPIView):
+    queryset = Lession.objects.all()
     serializer_class = LessionSerializer
     permission_classes = [IsAuthenticated]
+    course_path = 'module__course'
+    not_found_message = "Lession not found."
+    upload_target = 'lession'
 
-    def get_queryset(self):
-        lession_pk = self.kwargs.get('pk')
-        user = self.request.user
+    def get_upload_course_filter(self):
+        return Q(modules__lessions=self.kwargs['pk'])
 
-        try:
-            lession = Lession.objects.get(pk=lession_pk)
-        except Lession.DoesNotExist:
-            raise NotFound("Lession not found.")
-        
-        course = lession.module.course
 
-        if not user_can_access_course(user, course):
-            raise PermissionDenied("You do not have permission to access this course.")
-
-        return Lession.objects.filter(pk=lession_pk)
-
-class AssignmentListView(generics.ListCreateAPIView):
+class AssignmentListView(UploadValidationMixin, ConditionalGetMixin, generics.ListCreateAPIView):
     serializer_class = AssignmentSerializer
     permission_classes = [IsAuthenticated]
+    upload_target = 'assignment'
+
+    def get_upload_course_filter(self):
+        module_pk = self.request.query_params.get('module', '')
+        return Q(modules=module_pk) if module_pk.isdigit() else None
 
     def get_queryset(self):
         module_pk = self.request.query_params.get('module', None)
@@ -180,7 +377,7 @@ class AssignmentListView(generics.ListCreateAPIView):
 
         if module_pk is not None:
             try:
-                module = Module.objects.get(pk=module_pk)
+                module = Module.objects.select_related('course').get(pk=module_pk)
                 course = module.course
 
                 if user_can_access_course(user, course):
@@ -193,30 +390,27 @@ class AssignmentListView(generics.ListCreateAPIView):
         return Assignment.objects.none()
 
 
-class AssignmentDetailView(generics.RetrieveUpdateAPIView):
+class AssignmentDetailView(UploadValidationMixin, ConditionalGetMixin, CourseObjectMixin, generics.RetrieveUpdateAPIView):
+    queryset = Assignment.objects.all()
     serializer_class = AssignmentSerializer
     permission_classes = [IsAuthenticated]
+    course_path = 'module__course'
+    not_found_message = "Assignment not found."
+    upload_target = 'assignment'
 
-    def get_queryset(self):
-        assignment_pk = self.kwargs.get('pk')
-        user = self.request.user
+    def get_upload_course_filter(self):
+        return Q(modules__assignments=self.kwargs['pk'])
 
-        try:
-            assignment = Assignment.objects.get(pk=assignment_pk)
-        except Assignment.DoesNotExist:
-            raise NotFound("Assignment not found.")
-        
-        course = assignment.module.course
 
-        if not user_can_access_course(user, course):
-            raise PermissionDenied("You do not have permission to access this course.")
-        
-        return Assignment.objects.filter(pk=assignment_pk)
-
-
-class SubmissionListView(generics.ListCreateAPIView):
+class SubmissionListView(UploadValidationMixin, generics.ListCreateAPIView):
     serializer_class = SubmissionSerializer
     permission_classes = [IsAuthenticated]
+    cursor_ordering = ('submitted_at', 'id')
+    upload_target = 'submission'
+
+    def get_upload_course_filter(self):
+        assignment_pk = self.request.query_params.get('assignment', '')
+        return Q(modules__assignments=assignment_pk) if assignment_pk.isdigit() else None
 
     def get_queryset(self):
         assignment_pk = self.request.query_params.get('assignment', None)
@@ -224,7 +418,7 @@ class SubmissionListView(generics.ListCreateAPIView):
 
         if assignment_pk is not None:
             try:
-                assignment = Assignment.objects.get(pk=assignment_pk)
+                assignment = Assignment.objects.select_related('module__course').get(pk=assignment_pk)
                 course = assignment.module.course
 
                 if user_can_access_course(user, course):
@@ -237,30 +431,272 @@ class SubmissionListView(generics.ListCreateAPIView):
         return Submission.objects.none()
 
 
-class SubmissionDetailView(generics.RetrieveUpdateAPIView):
+class SubmissionDetailView(UploadValidationMixin, CourseObjectMixin, generics.RetrieveUpdateAPIView):
+    queryset = Submission.objects.all()
     serializer_class = SubmissionSerializer
     permission_classes = [IsAuthenticated]
+    course_path = 'assignment__module__course'
+    not_found_message = "Submission not found."
+    upload_target = 'submission'
 
-    def get_queryset(self):
-        submission_pk = self.kwargs.get('pk')
-        user = self.request.user
+    def get_upload_course_filter(self):
+        return Q(modules__assignments__submission=self.kwargs['pk'])
+
+
+class LessionContentView(CourseObjectMixin, generics.GenericAPIView):
+    queryset = Lession.objects.all()
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [JSONRenderer, PassthroughRenderer]
+    course_path = 'module__course'
+    not_found_message = "Lession not found."
 
+    def get(self, request, *args, **kwargs):
+        lession = self.get_object()
+        if not lession.content:
+            raise NotFound("This lession has no content.")
+        return serve_protected_file(request, lession.content)
+
+
+class AssignmentContentView(CourseObjectMixin, generics.GenericAPIView):
+    queryset = Assignment.objects.all()
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [JSONRenderer, PassthroughRenderer]
+    course_path = 'module__course'
+    not_found_message = "Assignment not found."
+
+    def get(self, request, *args, **kwargs):
+        assignment = self.get_object()
+        if not assignment.content:
+            raise NotFound("This assignment has no content.")
+        return serve_protected_file(request, assignment.content)
+
+
+class SubmissionContentView(CourseObjectMixin, generics.GenericAPIView):
+    queryset = Submission.objects.all()
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [JSONRenderer, PassthroughRenderer]
+    course_path = 'assignment__module__course'
+    not_found_message = "Submission not found."
+
+    def get(self, request, *args, **kwargs):
+        submission = self.get_object()
+        user = request.user
+
+        # Only the author and the course instructor can download a submission
+        if submission.student_id != user.pk and self.get_course(submission).instructor_id != user.pk:
+            raise PermissionDenied("You do not have permission to access this submission.")
+        if not submission.content:
+            raise NotFound("This submission has no content.")
+        return serve_protected_file(request, submission.content)
+
+
+class SubmissionExportView(CourseObjectMixin, generics.GenericAPIView):
+    """
+    ZIP of every submission file of an assignment plus a CSV manifest, generated while it streams.
+
+    Supports ``Range``/``If-Range`` so interrupted downloads can be resumed.
+    """
+    queryset = Assignment.objects.all()
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [JSONRenderer, PassthroughRenderer]
+    course_path = 'module__course'
+    not_found_message = "Assignment not found."
+
+    def get(self, request, *args, **kwargs):
+        assignment = self.get_object()
+        user = request.user
+        if user.is_student or self.get_course(assignment).instructor_id != user.pk:
+            raise PermissionDenied("Only the course instructor can export submissions.")
+
+        submissions = list(
+            Submission.objects.filter(assignment=assignment).select_related('student').order_by('submitted_at', 'id')
+        )
+        archive, etag = build_submission_export(assignment, submissions)
+
+        response, byte_range = evaluate_range(request, archive.size, etag)
+        if response is not None:
+            return response
+
+        if byte_range is None:
+            response = StreamingHttpResponse(archive.iter_range(), content_type='application/zip')
+            response['Content-Length'] = str(archive.size)
+        else:
+            response = partial_response(archive.iter_range(*byte_range), byte_range, archive.size, 'application/zip')
+        response['Content-Disposition'] = f'attachment; filename="assignment-{assignment.pk}-submissions.zip"'
+        response['Accept-Ranges'] = 'bytes'
+        response['ETag'] = etag
+        return response
+
+
+class ChunkedUploadCreateView(generics.CreateAPIView):
+    """
+    Start a resumable upload into an existing lession, assignment or submission.
+    """
+    serializer_class = ChunkedUploadSerializer
+    permission_classes = [IsAuthenticated]
+
+    def perform_create(self, serializer):
+        data = serializer.validated_data
+        obj = get_upload_target(data['target'], data['object_id'], self.request.user)
+        check_upload_size(data['size'], get_upload_limit(get_target_course(obj, data['target'])))
+        serializer.save(user=self.request.user, file=reserve_upload_file(obj, data['filename']))
+
+
+class ChunkedUploadMixin:
+
+    def get_upload(self, pk):
+        upload = ChunkedUpload.objects.filter(pk=pk, user=self.request.user).first()
+        if upload is None:
+            raise NotFound("Upload not found.")
+        return upload
+
+    def offset_response(self, upload, status_code=status.HTTP_200_OK):
+        response = Response(ChunkedUploadSerializer(upload).data, status=status_code)
+        response['Upload-Offset'] = str(upload.offset)
+        return response
+
+    def claim_upload(self, upload, offset):
+        """
+        Take the upload if it is still at ``offset`` and no other request is working on it.
+
+        Returns a queryset that matches the row only while this request holds it, or ``None``.
+        A claim left behind by a crashed request expires after ``CHUNKED_UPLOAD_LOCK_TIMEOUT``.
+        """
+        now = timezone.now()
+        stale = now - timedelta(seconds=settings.CHUNKED_UPLOAD_LOCK_TIMEOUT)
+        claimed = ChunkedUpload.objects.filter(
+            Q(locked_at__isnull=True) | Q(locked_at__lt=stale),
+            pk=upload.pk, offset=offset, status=ChunkedUpload.STATUS_UPLOADING,
+        ).update(locked_at=now)
+        if not claimed:
+            return None
+        return ChunkedUpload.objects.filter(pk=upload.pk, locked_at=now)
+
+
+class ChunkedUploadDetailView(ChunkedUploadMixin, APIView):
+    """
+    ``GET``/``HEAD`` report the committed offset, ``PUT`` appends a chunk and ``DELETE`` aborts.
+
+    A chunk carries ``Content-Range: bytes <start>-<end>/<size>`` and may carry its hex SHA-256
+    in ``X-Chunk-SHA256``; it must start exactly at the committed offset, otherwise the
+    response is 409 with the offset to resume from in ``Upload-Offset``.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        return self.offset_response(self.get_upload(pk))
+
+    def put(self, request, pk):
+        upload = self.get_upload(pk)
+        if upload.status != ChunkedUpload.STATUS_UPLOADING:
+            raise ValidationError("This upload is already complete.")
+
+        start, end = parse_content_range(request.META.get('HTTP_CONTENT_RANGE'), upload.size)
+        if request.stream is None:
+            # Django only exposes a body that has a Content-Length
+            return Response({'detail': 'Content-Length is required.'}, status=status.HTTP_411_LENGTH_REQUIRED)
+        if start != upload.offset:
+            return self.offset_response(upload, status_code=status.HTTP_409_CONFLICT)
+
+        # Claim the upload before touching the file: only one request writes a chunk at a time
+        held = self.claim_upload(upload, start)
+        if held is None:
+            upload.refresh_from_db()
+            return self.offset_response(upload, status_code=status.HTTP_409_CONFLICT)
+
+        length = end - start + 1
+        path = upload_path(upload)
         try:
-            submission = Submission.objects.get(pk=submission_pk)
-        except Submission.DoesNotExist:
-            raise NotFound("Submission not found.")
+            digest = running_digest(upload, path)
+            write_chunk(
+                path, start, length, request.stream, sha256=request.META.get('HTTP_X_CHUNK_SHA256'), running=digest
+            )
+            if start == 0:
+                try:
+                    check_upload_head(read_head(path), upload.target)
+                except UnsupportedUploadType:
+                    with open(path, 'r+b') as file:
+                        file.truncate(0)
+                    raise
+        except Exception:
+            held.update(locked_at=None)
+            raise
+
+        updated = held.update(offset=start + length, locked_at=None, updated_time=timezone.now())
+        upload.refresh_from_db()
+        if not updated:
+            # Our claim went stale and another request took the upload over
+            return self.offset_response(upload, status_code=status.HTTP_409_CONFLICT)
+        remember_digest(upload.pk, upload.offset, digest)
+        return self.offset_response(upload)
+
+    def delete(self, request, pk):
+        upload = self.get_upload(pk)
+        if upload.status == ChunkedUpload.STATUS_UPLOADING:
+            delete_upload_file(upload)
+        forget_digest(upload.pk)
+        upload.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ChunkedUploadCompleteView(ChunkedUploadMixin, APIView):
+    """
+    Verify a fully received upload and attach it to its object's ``content`` field.
+    """
+    target_serializers = {
+        ChunkedUpload.TARGET_LESSION: LessionSerializer,
+        ChunkedUpload.TARGET_ASSIGNMENT: AssignmentSerializer,
+        ChunkedUpload.TARGET_SUBMISSION: SubmissionSerializer,
+    }
+    permission_classes = [IsAuthenticated]
 
-        course = submission.assignment.module.course
+    def post(self, request, pk):
+        upload = self.get_upload(pk)
+        if upload.status == ChunkedUpload.STATUS_COMPLETE:
+            # A retried request gets the same answer
+            return self.completed_response(request, upload)
+        if upload.offset != upload.size:
+            return self.offset_response(upload, status_code=status.HTTP_409_CONFLICT)
+
+        # Only one request may move the assembled file
+        held = self.claim_upload(upload, upload.size)
+        if held is None:
+            upload.refresh_from_db()
+            if upload.status == ChunkedUpload.STATUS_COMPLETE:
+                return self.completed_response(request, upload)
+            return self.offset_response(upload, status_code=status.HTTP_409_CONFLICT)
 
-        if not user_can_access_course(user, course):
-            raise PermissionDenied("You do not have permission to access this course.")
-        
-        return Submission.objects.filter(pk=submission_pk)
+        try:
+            # Usually kept up to date chunk by chunk, so the file is not read again here
+            sha256 = running_digest(upload, upload_path(upload)).hexdigest()
+            if upload.sha256 and upload.sha256 != sha256:
+                raise ValidationError("File checksum does not match.")
+
+            obj = get_upload_target(upload.target, upload.object_id, request.user)
+            upload.sha256 = sha256
+            with transaction.atomic():
+                attach_upload_file(upload, obj)
+                held.update(
+                    sha256=sha256, status=ChunkedUpload.STATUS_COMPLETE, locked_at=None, updated_time=timezone.now()
+                )
+        except Exception:
+            held.update(locked_at=None)
+            raise
+        forget_digest(upload.pk)
+
+        serializer = self.target_serializers[upload.target](obj, context={'request': request})
+        return Response(serializer.data)
+
+    def completed_response(self, request, upload):
+        obj = get_upload_target(upload.target, upload.object_id, request.user)
+        serializer = self.target_serializers[upload.target](obj, context={'request': request})
+        return Response(serializer.data)
 
 
 class EnrollListView(generics.ListCreateAPIView):
     serializer_class = EnrollSerializer
     permission_classes = [IsAuthenticated]
+    cursor_ordering = ('enroll_time', 'id')
 
     def get_queryset(self):
         user = self.request.user
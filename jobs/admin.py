@@ -0,0 +1,9 @@
+from django.contrib import admin
+from .models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'queue', 'priority', 'status', 'attempts', 'run_at', 'created_time', 'finished_time')
+    search_fields = ('name', 'last_error')
+    list_filter = ('queue', 'status')
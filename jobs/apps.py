@@ -0,0 +1,16 @@
+from django.apps import AppConfig
+from django.utils.module_loading import autodiscover_modules
+
+
+class JobsConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'jobs'
+
+    def ready(self):
+        from OnlineLearning_Platform import metrics
+
+        from .queue import collect_queue_metrics
+
+        # Register the @task functions of every app
+        autodiscover_modules('tasks')
+        metrics.register_collector(collect_queue_metrics)
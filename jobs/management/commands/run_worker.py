@@ -0,0 +1,110 @@
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from OnlineLearning_Platform import metrics
+from jobs.queue import claim_jobs, record_outcome, requeue_stale_jobs, run_job
+
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        body = metrics.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs from the database queue.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queue', action='append', help='Queue to consume (repeatable, default: JOB_WORKER_QUEUES).')
+        parser.add_argument('--concurrency', type=int, default=settings.JOB_WORKER_CONCURRENCY)
+        parser.add_argument(
+            '--mode', choices=('thread', 'process'), default='thread',
+            help='Run jobs in threads (I/O bound work) or in processes (CPU bound work).'
+        )
+        parser.add_argument('--poll-interval', type=float, default=settings.JOB_POLL_INTERVAL)
+        parser.add_argument('--burst', action='store_true', help='Exit once no job is due instead of polling.')
+        parser.add_argument('--metrics-port', type=int, help='Serve this worker\'s metrics on the given port.')
+
+    def handle(self, *args, **options):
+        queues = options['queue'] or settings.JOB_WORKER_QUEUES
+        concurrency = options['concurrency']
+        worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        if options['metrics_port']:
+            server = ThreadingHTTPServer(('', options['metrics_port']), MetricsHandler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        if options['mode'] == 'process':
+            # Forked children must not share the parent's database connections
+            connections.close_all()
+            executor = ProcessPoolExecutor(max_workers=concurrency)
+        else:
+            executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='job')
+
+        self.stdout.write(f'Worker {worker_id} consuming {", ".join(queues)} with {concurrency} {options["mode"]}s.')
+        running = set()
+        last_requeue = 0
+        with executor:
+            while not self.stopping:
+                if time.monotonic() - last_requeue > settings.JOB_LOCK_TIMEOUT / 2:
+                    requeue_stale_jobs()
+                    last_requeue = time.monotonic()
+
+                free = concurrency - len(running)
+                claimed = claim_jobs(worker_id, queues, free) if free else []
+                running.update(executor.submit(run_job, job_id, False) for job_id in claimed)
+
+                if not running:
+                    if options['burst']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                # Block while every slot is busy, otherwise look for new jobs after a poll interval
+                timeout = None if len(running) >= concurrency else options['poll_interval']
+                done, running = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self.collect(future)
+
+            for future in running:
+                self.collect(future)
+        self.stdout.write(self.style.SUCCESS(f'Worker {worker_id} stopped.'))
+
+    def collect(self, future):
+        try:
+            outcome = future.result()
+        except Exception:
+            # e.g. "database is locked" while loading or finishing the job. It stays running
+            # under this worker's lock, and requeue_stale_jobs returns it to the queue.
+            metrics.incr('jobs_crashed_total')
+            logger.exception('A job slot crashed outside the job itself')
+            return
+        record_outcome(outcome)
+
+    def stop(self, signum, frame):
+        # Finish the running jobs, claim no new ones
+        self.stopping = True
@@ -0,0 +1,47 @@
+from django.db import models
+from django.utils import timezone
+
+
+class Job(models.Model):
+    """
+    A unit of background work, stored in the database and executed by ``run_worker``.
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    )
+
+    queue = models.CharField(max_length=50, default='default')
+    name = models.CharField(max_length=200)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    # Higher priorities are claimed first
+    priority = models.SmallIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True, default='')
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, default='')
+    created_time = models.DateTimeField(auto_now_add=True)
+    started_time = models.DateTimeField(blank=True, null=True)
+    finished_time = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        db_table = 'jobs'
+        indexes = [
+            models.Index(fields=['status', 'queue', '-priority', 'run_at'], name='jobs_claim_idx'),
+            models.Index(fields=['status', 'locked_at'], name='jobs_locked_idx'),
+        ]
+        verbose_name = 'job'
+        verbose_name_plural = 'jobs'
+
+    def __str__(self):
+        return f'{self.name} ({self.status})'
@@ -0,0 +1,187 @@
+import logging
+import random
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Count, F
+from django.utils import timezone
+
+from OnlineLearning_Platform import metrics
+
+from .models import Job
+
+
+logger = logging.getLogger(__name__)
+
+# Dotted task name -> (function, default options)
+registry = {}
+
+
+def task(queue='default', priority=0, max_attempts=None):
+    """
+    Register a function as a background task.
+
+    The function gains ``.enqueue(*args, **kwargs)``; arguments must be JSON serializable.
+    """
+    def decorator(func):
+        name = f'{func.__module__}.{func.__qualname__}'
+        registry[name] = (func, {
+            'queue': queue,
+            'priority': priority,
+            'max_attempts': max_attempts or settings.JOB_MAX_ATTEMPTS,
+        })
+        func.task_name = name
+        func.enqueue = lambda *args, **kwargs: enqueue(name, *args, **kwargs)
+        return func
+    return decorator
+
+
+def enqueue(task_name, *args, queue=None, priority=None, run_at=None, max_attempts=None, **kwargs):
+    """
+    Queue ``task_name`` (a registered name or task function) to run in a worker; returns the Job.
+
+    The job is saved in the caller's transaction, so a worker only sees it once it commits.
+    """
+    name = getattr(task_name, 'task_name', task_name)
+    if name not in registry:
+        raise ValueError(f'Unknown task: {name}')
+
+    options = registry[name][1]
+    job = Job.objects.create(
+        queue=queue or options['queue'],
+        name=name,
+        args=list(args),
+        kwargs=kwargs,
+        priority=options['priority'] if priority is None else priority,
+        max_attempts=max_attempts or options['max_attempts'],
+        run_at=run_at or timezone.now(),
+    )
+    metrics.incr('jobs_enqueued_total', queue=job.queue)
+    return job
+
+
+def claim_jobs(worker_id, queues, limit):
+    """
+    Claim up to ``limit`` due jobs for ``worker_id``.
+
+    Each claim is a conditional UPDATE from ``queued`` to ``running``, so concurrent workers
+    never run the same job and no row lock or broker is needed.
+    """
+    now = timezone.now()
+    candidates = (
+        Job.objects.filter(status=Job.STATUS_QUEUED, queue__in=queues, run_at__lte=now)
+        .order_by('-priority', 'run_at', 'id')
+        .values_list('pk', flat=True)[:limit * 2]
+    )
+
+    claimed = []
+    for pk in candidates:
+        updated = Job.objects.filter(pk=pk, status=Job.STATUS_QUEUED).update(
+            status=Job.STATUS_RUNNING, locked_by=worker_id, locked_at=now,
+            attempts=F('attempts') + 1, started_time=now,
+        )
+        if updated:
+            claimed.append(pk)
+            if len(claimed) == limit:
+                break
+    return claimed
+
+
+def backoff_delay(attempts):
+    """
+    Exponential backoff with jitter: base, 2 x base, 4 x base ... capped at JOB_MAX_BACKOFF.
+    """
+    delay = min(settings.JOB_RETRY_BACKOFF * 2 ** (attempts - 1), settings.JOB_MAX_BACKOFF)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def run_job(job_id, record_metrics=True):
+    """
+    Execute a claimed job and record its outcome. Safe to call from a thread or a child process.
+
+    Returns the outcome ``(queue, status, wait_seconds, run_seconds)``; a worker running jobs in
+    child processes passes ``record_metrics=False`` and records it in the parent instead.
+    """
+    close_old_connections()
+    try:
+        job = Job.objects.get(pk=job_id)
+        func = registry.get(job.name, (None,))[0]
+        started = time.monotonic()
+        try:
+            if func is None:
+                raise LookupError(f'Unknown task: {job.name}')
+            func(*job.args, **job.kwargs)
+        except Exception:
+            status = fail_job(job, traceback.format_exc(), retry=func is not None)
+        else:
+            Job.objects.filter(pk=job.pk, status=Job.STATUS_RUNNING, locked_by=job.locked_by).update(
+                status=Job.STATUS_SUCCEEDED, finished_time=timezone.now(), locked_by='', last_error=''
+            )
+            status = Job.STATUS_SUCCEEDED
+
+        outcome = (job.queue, status, max((job.started_time - job.run_at).total_seconds(), 0), time.monotonic() - started)
+        if record_metrics:
+            record_outcome(outcome)
+        return outcome
+    finally:
+        close_old_connections()
+
+
+def record_outcome(outcome):
+    queue, status, wait, duration = outcome
+    metrics.incr(f'jobs_{status}_total', queue=queue)
+    metrics.observe('job_wait_seconds', wait, queue=queue)
+    metrics.observe('job_run_seconds', duration, queue=queue)
+
+
+def fail_job(job, error, retry=True):
+    """
+    Put a failed job back in the queue with a backoff delay, or mark it failed when it is out
+    of attempts. Returns the new status (``retried`` or ``failed``).
+    """
+    now = timezone.now()
+    claimed = Job.objects.filter(pk=job.pk, status=Job.STATUS_RUNNING, locked_by=job.locked_by)
+    if retry and job.attempts < job.max_attempts:
+        claimed.update(
+            status=Job.STATUS_QUEUED, run_at=now + timedelta(seconds=backoff_delay(job.attempts)),
+            locked_by='', last_error=error,
+        )
+        logger.warning('Job %s (%s) failed, retrying: %s', job.pk, job.name, error.strip().splitlines()[-1])
+        return 'retried'
+
+    claimed.update(status=Job.STATUS_FAILED, finished_time=now, locked_by='', last_error=error)
+    logger.error('Job %s (%s) failed: %s', job.pk, job.name, error)
+    return Job.STATUS_FAILED
+
+
+def requeue_stale_jobs():
+    """
+    Return jobs whose worker died mid-run (locked longer than JOB_LOCK_TIMEOUT) to the queue.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.JOB_LOCK_TIMEOUT)
+    stale = Job.objects.filter(status=Job.STATUS_RUNNING, locked_at__lt=cutoff)
+    for job in stale:
+        status = fail_job(job, f'Worker {job.locked_by} did not finish the job within {settings.JOB_LOCK_TIMEOUT}s.')
+        metrics.incr(f'jobs_{status}_total', queue=job.queue)
+
+
+_reported_gauges = set()
+
+
+def collect_queue_metrics():
+    """
+    Set ``jobs_queued``/``jobs_running`` gauges per queue from the jobs table.
+    """
+    counts = (
+        Job.objects.filter(status__in=[Job.STATUS_QUEUED, Job.STATUS_RUNNING])
+        .order_by().values('queue', 'status').annotate(total=Count('*'))
+    )
+    current = {(row['queue'], row['status']): row['total'] for row in counts}
+    for queue, status in _reported_gauges - current.keys():
+        metrics.set_gauge(f'jobs_{status}', 0, queue=queue)
+    for (queue, status), total in current.items():
+        metrics.set_gauge(f'jobs_{status}', total, queue=queue)
+    _reported_gauges.update(current)
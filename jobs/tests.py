@@ -0,0 +1,148 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core import mail
+from django.core.management import call_command
+from django.db import OperationalError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from OnlineLearning_Platform import metrics
+from users.models import CustomUser
+from users.tasks import send_verification_code
+
+from .models import Job
+from .queue import claim_jobs, enqueue, run_job, task
+
+
+calls = []
+
+
+@task(queue='test', max_attempts=2)
+def record_call(value):
+    calls.append(value)
+
+
+@task(queue='test', max_attempts=2)
+def always_fails():
+    raise RuntimeError('boom')
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+        metrics.reset()
+
+    def test_enqueue_and_run(self):
+        print('Testing enqueue and run a job')
+        job = record_call.enqueue('hello')
+        self.assertEqual((job.queue, job.status), ('test', Job.STATUS_QUEUED))
+
+        self.assertEqual(claim_jobs('worker-1', ['test'], 10), [job.pk])
+        # Another worker cannot claim the same job
+        self.assertEqual(claim_jobs('worker-2', ['test'], 10), [])
+
+        run_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(calls, ['hello'])
+        self.assertEqual((job.status, job.attempts), (Job.STATUS_SUCCEEDED, 1))
+        self.assertEqual(metrics.get_value('jobs_succeeded_total', queue='test'), 1)
+        self.assertEqual(metrics.get_value('job_run_seconds_count', queue='test'), 1)
+
+    def test_priority_and_schedule(self):
+        print('Testing jobs are claimed by priority and run_at')
+        low = enqueue(record_call, 'low')
+        high = enqueue(record_call, 'high', priority=5)
+        enqueue(record_call, 'later', run_at=timezone.now() + timedelta(hours=1))
+        self.assertEqual(claim_jobs('worker', ['test'], 10), [high.pk, low.pk])
+
+    def test_retry_with_backoff(self):
+        print('Testing failed jobs are retried with backoff')
+        job = always_fails.enqueue()
+        claim_jobs('worker', ['test'], 1)
+        run_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_QUEUED)
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('RuntimeError: boom', job.last_error)
+        self.assertEqual(claim_jobs('worker', ['test'], 1), [])
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        claim_jobs('worker', ['test'], 1)
+        run_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.STATUS_FAILED, 2))
+        self.assertEqual(metrics.get_value('jobs_failed_total', queue='test'), 1)
+
+    def test_unknown_task(self):
+        print('Testing enqueueing an unregistered task fails')
+        with self.assertRaises(ValueError):
+            enqueue('os.system', 'true')
+
+    @override_settings(METRICS_ALLOWED_IPS=('127.0.0.1',))
+    def test_queue_depth_metrics(self):
+        print('Testing queue depth gauges')
+        record_call.enqueue('a')
+        record_call.enqueue('b')
+        response = self.client.get('/metrics/', REMOTE_ADDR='127.0.0.1')
+        self.assertIn('jobs_queued{queue="test"} 2', response.content.decode())
+
+    def test_login_enqueues_verification_email(self):
+        print('Testing login queues the verification email')
+        CustomUser.objects.create_user(username='testuser', email='testuser@gmail.com', password='testpassword')
+        response = APIClient().post('/login/', {'username': 'testuser', 'password': 'testpassword'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        job = Job.objects.get()
+        self.assertEqual((job.name, job.queue, job.args[0]), ('users.tasks.send_verification_code', 'email', 'testuser@gmail.com'))
+        self.assertEqual(len(mail.outbox), 0)
+
+        claim_jobs('worker', ['email'], 1)
+        run_job(job.pk)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn(str(job.args[1]), mail.outbox[0].body)
+
+
+class WorkerCommandTests(TransactionTestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_burst_worker(self):
+        print('Testing run_worker drains the queue')
+        for value in range(5):
+            record_call.enqueue(value)
+        always_fails.enqueue(max_attempts=1)
+
+        call_command('run_worker', '--queue', 'test', '--burst', '--concurrency', '3', stdout=StringIO())
+        self.assertEqual(sorted(calls), [0, 1, 2, 3, 4])
+        self.assertEqual(Job.objects.filter(status=Job.STATUS_SUCCEEDED).count(), 5)
+        self.assertEqual(Job.objects.filter(status=Job.STATUS_FAILED).count(), 1)
+
+    def test_default_worker_sends_verification_emails(self):
+        print('Testing run_worker without --queue consumes the email queue')
+        send_verification_code.enqueue('testuser@gmail.com', 123456)
+
+        call_command('run_worker', '--burst', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(Job.objects.get().status, Job.STATUS_SUCCEEDED)
+
+    def test_crashed_slot_does_not_stop_the_worker(self):
+        print('Testing run_worker survives a database error outside a job')
+        for value in range(3):
+            record_call.enqueue(value)
+        real_run_job = run_job
+
+        def locked_once(job_id, record_metrics=True):
+            if Job.objects.get(pk=job_id).args == [1]:
+                raise OperationalError('database is locked')
+            return real_run_job(job_id, record_metrics)
+
+        with mock.patch('jobs.management.commands.run_worker.run_job', side_effect=locked_once), \
+                self.assertLogs('jobs.management.commands.run_worker', 'ERROR'):
+            call_command('run_worker', '--queue', 'test', '--burst', '--concurrency', '1', stdout=StringIO())
+        self.assertEqual(sorted(calls), [0, 2])
+        # Left running for requeue_stale_jobs to recover
+        self.assertEqual(Job.objects.get(args=[1]).status, Job.STATUS_RUNNING)
@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0002_transaction_amount'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['user', 'created_time', 'id'], name='transactions_user_created_idx'),
+        ),
+    ]
@@ -5,6 +5,8 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 
+from OnlineLearning_Platform.pagination import paginate
+
 from .models import Transaction
 from .serializers import TransactionSerializer
 
@@ -14,8 +16,7 @@ class TransactionListView(APIView):
     def get(self, request):
         user = request.user
         data = Transaction.objects.filter(user=user)
-        serializer = TransactionSerializer(data, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return paginate(self, data, request, TransactionSerializer)
     
     def post(self, request):
         data = request.data
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
+
+    def ready(self):
+        from OnlineLearning_Platform.images import track_image_field
+
+        from .models import CustomUser
+
+        track_image_field(CustomUser, 'avatar')
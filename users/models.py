@@ -6,9 +6,14 @@ class CustomUser(AbstractUser):
     email = models.EmailField(unique=True)
     avatar = models.ImageField(upload_to='avatars/', blank=True, null=True)
     is_student = models.BooleanField(default=True)
+    # Validates the course payloads that embed a user as their instructor
+    updated_time = models.DateTimeField(auto_now=True)
     
     USERNAME_FIELD = 'username'
     REQUIRED_FIELDS = ['email']
+
+    class Meta(AbstractUser.Meta):
+        indexes = [models.Index(fields=['date_joined', 'id'], name='users_joined_id_idx')]
     
 
 class UserProfile(models.Model):
@@ -1,13 +1,18 @@
 from rest_framework import serializers
+
+from OnlineLearning_Platform.images import ImageVariantsField
+
 from .models import CustomUser, UserProfile
 
 
 class CustomUserSerializer(serializers.ModelSerializer):
+    avatar_variants = ImageVariantsField(source='avatar')
+
     class Meta:
         model = CustomUser
         fields = (
             'id', 'username', 'email', 'password', 'first_name', 'last_name',
-            'is_active', 'is_staff', 'date_joined', 'is_student', 'avatar', 'last_login'
+            'is_active', 'is_staff', 'date_joined', 'is_student', 'avatar', 'avatar_variants', 'last_login'
             )
 
 
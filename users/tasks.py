@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.core.mail import send_mail
+
+from jobs.queue import task
+
+
+@task(queue='email', priority=10)
+def send_verification_code(email, code):
+    subject = 'Your Verification Code'
+    message = f'Your verification code is: {code}'
+    from_email = settings.EMAIL_HOST_USER
+    recipient_list = [email]
+
+    send_mail(subject, message, from_email, recipient_list)
@@ -2,8 +2,6 @@ import random
 
 from django.contrib.auth import authenticate
 from django.core.cache import cache
-from django.conf import settings
-from django.core.mail import send_mail
 
 from rest_framework import status
 from rest_framework.response import Response
@@ -12,18 +10,13 @@ from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
 
 
+from OnlineLearning_Platform.pagination import paginate
+
+from .tasks import send_verification_code
 from .serializers import CustomUserSerializer, RegisterSerializer, UserProfileSerializer
 from .models import CustomUser, UserProfile
 
 
-def send_verification_code(email, code):
-    subject = 'Your Verification Code'
-    message = f'Your verification code is: {code}'
-    from_email = settings.EMAIL_HOST_USER
-    recipient_list = [email]
-    
-    send_mail(subject, message, from_email, recipient_list)
-
 class RegisterView(APIView):
 
     def post(self, request):
@@ -55,10 +48,8 @@ class LoginView(APIView):
         code = random.randint(10000, 99999)
         cache.set(str(username), code)
 
-        # try:
-        #     send_verification_code(email, code)
-        # except Exception:
-        #     return Response({'error': 'Something went wrong'})
+        # SMTP runs in a background worker so the login response does not wait for it
+        send_verification_code.enqueue(email, code)
 
         return Response({'detail': f'Code sent to {email}',
                          'code': code})
@@ -97,11 +88,11 @@ class TokenGeneratorView(APIView):
 
 class UserView(APIView):
     permission_classes = [IsAuthenticatedOrReadOnly]
+    cursor_ordering = ('date_joined', 'id')
 
     def get(self, request):
         users = CustomUser.objects.all()
-        serializer = CustomUserSerializer(users, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)    
+        return paginate(self, users, request, CustomUserSerializer)
 
 
 class UserDetailView(APIView):